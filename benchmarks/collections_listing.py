@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк обработки большого списка коллекций: построчный путь (Row -> dict)
+против колоночного (pyarrow.compute над пачками Arrow).
+
+Данные синтетические, BigQuery и переменные окружения бота (.env) не нужны. Построчный путь здесь получает готовые
+кортежи, поэтому разбор JSON ответа REST (который Storage Read API тоже убирает)
+в замер не входит. Запуск из корня проекта:
+    python benchmarks/collections_listing.py --rows 100000
+"""
+import sys
+import time
+import argparse
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import pyarrow as pa
+from services.bq_client import BigQueryClient, collections_from_arrow
+
+Row = namedtuple('Row', ['collection_id', 'collection_name', 'company_id', 'created_at', 'updated_at'])
+
+
+def make_rows(count: int):
+    """Генерирует строки, похожие на таблицу коллекций (каждая пятая - TSUM Collection Panel)"""
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    rows = []
+    for i in range(count):
+        created_at = start + timedelta(minutes=i, microseconds=i % 1000)
+        rows.append(Row(
+            collection_id=f"{i:08x}-0000-4000-8000-{i:012x}",
+            collection_name=f"TSUM Collection Panel {i}" if i % 5 == 0 else f"Collection {i}",
+            company_id='tsum_cs' if i % 3 == 0 else 'other',
+            created_at=created_at,
+            updated_at=created_at + timedelta(hours=1) if i % 2 else None,
+        ))
+    return rows
+
+
+def make_batches(rows, batch_size: int):
+    """Собирает те же строки в пачки Arrow (как их отдает to_arrow_iterable)"""
+    schema = pa.schema([
+        ('collection_id', pa.string()),
+        ('collection_name', pa.string()),
+        ('company_id', pa.string()),
+        ('created_at', pa.timestamp('us', tz='UTC')),
+        ('updated_at', pa.timestamp('us', tz='UTC')),
+    ])
+    table = pa.Table.from_pylist([row._asdict() for row in rows], schema=schema)
+    return table.to_batches(max_chunksize=batch_size)
+
+
+def measure(func, repeat: int) -> float:
+    """Лучшее время из repeat запусков (в секундах)"""
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100000, help='Количество строк')
+    parser.add_argument('--batch-size', type=int, default=10000, help='Размер пачки Arrow')
+    parser.add_argument('--repeat', type=int, default=5, help='Количество повторов')
+    args = parser.parse_args()
+
+    rows = make_rows(args.rows)
+    batches = make_batches(rows, args.batch_size)
+
+    row_path = lambda: [BigQueryClient._row_to_collection(row) for row in rows]
+    arrow_path = lambda: [c for batch in batches for c in collections_from_arrow(batch)]
+
+    # Оба пути должны давать одинаковый результат
+    assert row_path() == arrow_path()
+
+    row_time = measure(row_path, args.repeat)
+    arrow_time = measure(arrow_path, args.repeat)
+
+    print(f"Rows: {args.rows}, Arrow batch size: {args.batch_size}")
+    print(f"Row-by-row:  {row_time * 1000:8.1f} ms ({args.rows / row_time:,.0f} rows/s)")
+    print(f"Arrow:       {arrow_time * 1000:8.1f} ms ({args.rows / arrow_time:,.0f} rows/s)")
+    print(f"Speedup:     {row_time / arrow_time:8.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -11,6 +11,9 @@ from handlers.commands import (
 )
 from handlers.report_handler import handle_report_callback
 from services.scheduler import StatusScheduler
+from services.collector_worker import get_worker_pool
+from services.bq_async import get_async_bq_client
+from services.bq_metrics import get_metrics_sink
 from services.chat_manager import add_chat, remove_chat
 
 # Настройка логирования
@@ -106,11 +109,25 @@ def main():
     
     async def post_init(app: Application):
         """Функция, выполняемая после инициализации бота"""
+        # Запускаем процессы-воркеры для сбора отчетов через Selenium
+        await get_worker_pool().start()
+        
         # Запускаем планировщик в фоне
         asyncio.create_task(scheduler.start())
         logger.info("Scheduler started")
     
+    async def post_shutdown(app: Application):
+        """Функция, выполняемая при остановке бота"""
+        # Отдаем аренду ведущего, чтобы проверку статусов сразу подхватил другой экземпляр
+        scheduler.stop()
+        # Останавливаем процессы-воркеры (они закрывают свои браузеры)
+        await get_worker_pool().stop()
+        # Останавливаем пул потоков BigQuery и выводим сводку по стоимости запросов
+        get_async_bq_client().shutdown()
+        get_metrics_sink().log_summary()
+    
     application.post_init = post_init
+    application.post_shutdown = post_shutdown
     
     # Запускаем бота
     logger.info("Starting bot...")
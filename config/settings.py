@@ -63,6 +63,11 @@ DATA_DIR.mkdir(exist_ok=True)
 USERS_FILE = DATA_DIR / 'users.json'  # Список разрешенных пользователей
 CHATS_FILE = DATA_DIR / 'chats.json'  # Список бесед для отправки отчетов
 COLLECTIONS_STATUS_FILE = DATA_DIR / 'collections_status.json'  # Кэш статусов коллекций
+STATUS_JOURNAL_FILE = DATA_DIR / 'collections_status.journal'  # Журнал изменений кэша статусов
+COLLECTIONS_MIRROR_FILE = DATA_DIR / 'collections.db'  # Локальная копия таблицы коллекций (SQLite)
+TENANTS_FILE = DATA_DIR / 'tenants.json'  # Правила отслеживания по клиентам (необязательный)
+REPORT_OUTBOX_FILE = DATA_DIR / 'report_outbox.db'  # Очередь отчетов на отправку (SQLite)
+LEADER_LEASE_FILE = DATA_DIR / 'leader.db'  # Аренда ведущего экземпляра (SQLite)
 
 # Создаем файлы, если их нет
 if not USERS_FILE.exists():
@@ -82,14 +87,125 @@ LOG_DIR = BASE_DIR / 'logs'
 LOG_DIR.mkdir(exist_ok=True)
 LOG_FILE = LOG_DIR / 'bot.log'
 
+# Доступ к BigQuery из бота: запросы выполняются в отдельном пуле потоков,
+# чтобы не блокировать event loop; по таймауту задание BigQuery отменяется
+BQ_MAX_CONCURRENCY = int(os.getenv('BQ_MAX_CONCURRENCY', '4'))  # Одновременных запросов к BigQuery
+BQ_QUERY_TIMEOUT = float(os.getenv('BQ_QUERY_TIMEOUT', '60'))  # Ожидание результата одного запроса (сек)
+BQ_CALL_TIMEOUT = float(os.getenv('BQ_CALL_TIMEOUT', '90'))  # Максимальное время вызова из бота (сек)
+
+# Повторы временных ошибок BigQuery (сеть, 5xx, превышение лимитов) с экспоненциальной задержкой
+BQ_RETRY_ATTEMPTS = int(os.getenv('BQ_RETRY_ATTEMPTS', '3'))  # Попыток на запрос, включая первую
+BQ_RETRY_BASE_DELAY = float(os.getenv('BQ_RETRY_BASE_DELAY', '1'))  # Базовая задержка (сек)
+BQ_RETRY_MAX_DELAY = float(os.getenv('BQ_RETRY_MAX_DELAY', '10'))  # Максимальная задержка (сек)
+# Circuit breaker: после стольких неудачных запросов подряд BigQuery не опрашивается BQ_BREAKER_RESET_TIMEOUT секунд
+BQ_BREAKER_FAILURES = int(os.getenv('BQ_BREAKER_FAILURES', '5'))
+BQ_BREAKER_RESET_TIMEOUT = float(os.getenv('BQ_BREAKER_RESET_TIMEOUT', '60'))
+
+# Метрики запросов BigQuery (байты, стоимость, cache hit, slot-ms, время) в формате JSON Lines
+BQ_METRICS_FILE = LOG_DIR / 'bq_metrics.jsonl'
+# Бюджет объема одного запроса в байтах (0 - без проверки); проверяется пробным запуском (dry run).
+# BQ_BUDGET_MODE: 'warn' - только предупреждение в логе, 'enforce' - запрос не выполняется
+BQ_MAX_BYTES_PER_QUERY = int(os.getenv('BQ_MAX_BYTES_PER_QUERY', '0'))
+BQ_BUDGET_MODE = os.getenv('BQ_BUDGET_MODE', 'warn').lower()
+# Выгружать большие списки коллекций через BigQuery Storage Read API (нужны pyarrow и google-cloud-bigquery-storage)
+BQ_USE_STORAGE_API = os.getenv('BQ_USE_STORAGE_API', 'true').lower() == 'true'
+
+# Сколько секунд кэшировать количество коллекций для пагинации /collections
+COLLECTIONS_COUNT_TTL = int(os.getenv('COLLECTIONS_COUNT_TTL', '300'))
+# Сколько секунд хранить страницы /collections в общем кэше (сбрасывается и при изменениях статусов)
+LISTING_CACHE_TTL = int(os.getenv('LISTING_CACHE_TTL', '120'))
+
+# Пакетный поиск коллекций по ID: запросы за окно объединяются в один запрос к BigQuery
+LOOKUP_BATCH_WINDOW_MS = int(os.getenv('LOOKUP_BATCH_WINDOW_MS', '50'))  # Окно сбора запросов (мс)
+LOOKUP_BATCH_SIZE = int(os.getenv('LOOKUP_BATCH_SIZE', '100'))  # Максимум ID в одном запросе
+LOOKUP_CACHE_SIZE = int(os.getenv('LOOKUP_CACHE_SIZE', '256'))  # Размер LRU-кэша найденных коллекций
+LOOKUP_CACHE_TTL = int(os.getenv('LOOKUP_CACHE_TTL', '60'))  # Время жизни записи в кэше (сек)
+
 # Интервал проверки статусов коллекций (в секундах)
-STATUS_CHECK_INTERVAL = int(os.getenv('STATUS_CHECK_INTERVAL', '60'))  # По умолчанию 60 секунд
+STATUS_CHECK_INTERVAL = int(os.getenv('STATUS_CHECK_INTERVAL', '60'))  # Интервал после запуска (сек)
+# Адаптивный интервал: после найденных переходов - STATUS_MIN_INTERVAL, в тихий период растет
+# в STATUS_INTERVAL_BACKOFF раз за проверку до STATUS_MAX_INTERVAL; разброс ±STATUS_INTERVAL_JITTER
+STATUS_MIN_INTERVAL = float(os.getenv('STATUS_MIN_INTERVAL', '30'))
+STATUS_MAX_INTERVAL = float(os.getenv('STATUS_MAX_INTERVAL', '600'))
+STATUS_INTERVAL_BACKOFF = float(os.getenv('STATUS_INTERVAL_BACKOFF', '1.5'))
+STATUS_INTERVAL_JITTER = float(os.getenv('STATUS_INTERVAL_JITTER', '0.1'))
+# Границы интервала по часам суток: "начало-конец:мин:макс" через запятую, например "9-21:30:300,21-9:120:1800"
+STATUS_INTERVAL_PROFILES = os.getenv('STATUS_INTERVAL_PROFILES', '')
+
+# Инкрементальный опрос статусов: между полными сверками запрашиваются только строки,
+# измененные после сохраненного watermark (с перекрытием на запаздывающие записи)
+STATUS_FULL_RECONCILE_INTERVAL = int(os.getenv('STATUS_FULL_RECONCILE_INTERVAL', '1800'))  # Полная сверка (сек)
+STATUS_WATERMARK_OVERLAP = int(os.getenv('STATUS_WATERMARK_OVERLAP', '120'))  # Перекрытие окна (сек)
+# Изменения кэша статусов дописываются в журнал; после стольких записей журнал
+# сворачивается в collections_status.json
+STATUS_JOURNAL_COMPACT_EVERY = int(os.getenv('STATUS_JOURNAL_COMPACT_EVERY', '500'))
+
+# Доставка отчетов отделена от проверки статусов: проверка идет по своему интервалу,
+# изменившиеся коллекции попадают в очередь, которую разбирают воркеры доставки
+REPORT_DELIVERY_WORKERS = int(os.getenv('REPORT_DELIVERY_WORKERS', '2'))
+REPORT_DELIVERY_BATCH = int(os.getenv('REPORT_DELIVERY_BATCH', '10'))  # Сколько коллекций воркер берет за раз
+# Очередь отчетов на диске: неудачный сбор или отправка повторяются с удвоением задержки
+REPORT_MAX_ATTEMPTS = int(os.getenv('REPORT_MAX_ATTEMPTS', '5'))
+REPORT_RETRY_DELAY = float(os.getenv('REPORT_RETRY_DELAY', '300'))  # Задержка первого повтора (сек)
+REPORT_OUTBOX_RETENTION = float(os.getenv('REPORT_OUTBOX_RETENTION', str(30 * 24 * 3600)))  # Хранить завершенные (сек)
+
+# Несколько экземпляров бота с общим data/: проверку статусов и отправку отчетов ведет только
+# экземпляр, держащий аренду; остальные обслуживают команды и забирают аренду после ее истечения
+LEADER_LEASE_TTL = float(os.getenv('LEADER_LEASE_TTL', '30'))  # Срок аренды (сек)
+
+# Источник статистики отчетов: 'selenium' - сбор через браузер (по умолчанию), 'sql' - запрос
+# к таблицам айтемов/действий BigQuery (Selenium только как запасной вариант). SQL-счетчики еще
+# не сверены с отчетами Мозаики, поэтому 'sql' включать только вместе со сверкой
+REPORT_SOURCE = os.getenv('REPORT_SOURCE', 'selenium').lower()
+# Сверка: дополнительно собирать отчет через Selenium в фоне и логировать расхождения с SQL
+# (при REPORT_SOURCE=sql включена по умолчанию)
+REPORT_CROSS_CHECK = os.getenv('REPORT_CROSS_CHECK', 'true' if REPORT_SOURCE == 'sql' else 'false').lower() == 'true'
+
+# Локальная копия таблицы коллекций: синхронизируется на каждом шаге планировщика,
+# если синхронизации не было дольше MIRROR_MAX_STALENESS, чтение идет в BigQuery
+MIRROR_MAX_STALENESS = int(os.getenv('MIRROR_MAX_STALENESS', '300'))  # Допустимый возраст копии (сек)
+MIRROR_FULL_SYNC_INTERVAL = int(os.getenv('MIRROR_FULL_SYNC_INTERVAL', '3600'))  # Полная перезагрузка (сек)
+# Копия синхронизируется при каждой проверке статусов и, независимо от адаптивного интервала
+# проверок, не реже чем раз в MIRROR_SYNC_INTERVAL (должен быть меньше MIRROR_MAX_STALENESS)
+MIRROR_SYNC_INTERVAL = int(os.getenv('MIRROR_SYNC_INTERVAL', str(MIRROR_MAX_STALENESS // 2)))
+
+# Ожидание сетевой тишины в Мозаике (вместо фиксированных пауз после навигации)
+NETWORK_IDLE_QUIET_MS = int(os.getenv('NETWORK_IDLE_QUIET_MS', '500'))  # Сколько мс сеть должна молчать
+NETWORK_IDLE_TIMEOUT = float(os.getenv('NETWORK_IDLE_TIMEOUT', '15'))  # Максимальное ожидание (в секундах)
+# Долгоживущий запрос (URL содержит один из NETWORK_LONG_POLL_PATTERNS: long-polling, аналитика)
+# перестает блокировать ожидание через NETWORK_IDLE_STALE_REQUEST секунд. Остальные запросы,
+# включая медленные запросы данных отчета, ждем до NETWORK_IDLE_TIMEOUT
+NETWORK_IDLE_STALE_REQUEST = float(os.getenv('NETWORK_IDLE_STALE_REQUEST', '4'))
+# Фрагменты URL через запятую (пусто - встроенный список services.network_tracker)
+NETWORK_LONG_POLL_PATTERNS = [p.strip() for p in os.getenv('NETWORK_LONG_POLL_PATTERNS', '').split(',') if p.strip()]
+
+# Сколько раз повторять упавший этап сбора отчета на том же браузере
+REPORT_STAGE_RETRIES = int(os.getenv('REPORT_STAGE_RETRIES', '2'))
+
+# Ограничения ресурсов для браузеров Chrome
+MAX_CHROME_COLLECTORS = int(os.getenv('MAX_CHROME_COLLECTORS', '2'))  # Браузеров одновременно (на все воркеры)
+CHROME_MIN_FREE_MB = float(os.getenv('CHROME_MIN_FREE_MB', '700'))  # Минимум MemAvailable для запуска браузера
+CHROME_MAX_RSS_MB = float(os.getenv('CHROME_MAX_RSS_MB', '1500'))  # Порог RSS для пересоздания браузера
+CHROME_MAX_REPORTS = int(os.getenv('CHROME_MAX_REPORTS', '20'))  # Пересоздавать браузер после N отчетов
+COLLECTOR_ADMISSION_TIMEOUT = float(os.getenv('COLLECTOR_ADMISSION_TIMEOUT', '600'))  # Ожидание допуска (сек)
+COLLECTOR_IDLE_TIMEOUT = float(os.getenv('COLLECTOR_IDLE_TIMEOUT', '300'))  # Закрывать простаивающий браузер (сек)
+
+# Процессы-воркеры для сбора отчетов (каждый собирает один отчет за раз)
+COLLECTOR_WORKERS = int(os.getenv('COLLECTOR_WORKERS', '2'))
+REPORT_JOB_TIMEOUT = float(os.getenv('REPORT_JOB_TIMEOUT', '900'))  # Максимальное время сбора отчета (сек)
+
+# Точки WebDriver для браузеров: 'local' (Chrome под Xvfb контейнера) и/или адреса
+# удаленных chromedriver / Selenium standalone, через запятую; суффикс *N - максимум сессий.
+# Пример: WEBDRIVER_ENDPOINTS=local*2,http://127.0.0.1:9515,http://10.0.0.5:4444/wd/hub*4
+WEBDRIVER_ENDPOINTS = os.getenv('WEBDRIVER_ENDPOINTS', 'local')
+WEBDRIVER_HEALTH_CHECK_INTERVAL = float(os.getenv('WEBDRIVER_HEALTH_CHECK_INTERVAL', '30'))  # Секунды
 
 # URL Мозаики
 ADMIN_URL = "https://sandbox-prod.mosaica.ai"
 MOSAICA_URL = "https://sandbox-prod.mosaica.ai"
 
 # Прокси для BigQuery (опционально, можно отключить установив USE_PROXY=false)
+# Применяются только к HTTP-сессиям BigQuery; лучший прокси выбирается по задержке и доле ошибок
 USE_PROXY = os.getenv('USE_PROXY', 'false').lower() == 'true'
 PROXY_SERVERS = [
     "net-157-22-102-218.mcccx.com:8444",
@@ -98,4 +214,8 @@ PROXY_SERVERS = [
     "net-157-22-102-62.mcccx.com:8444",
     "net-147-78-182-237.mcccx.com:8444",
 ]
+# Проверка прокси: запрос через прокси к PROXY_PROBE_URL (подходит любой HTTP-ответ)
+PROXY_PROBE_URL = os.getenv('PROXY_PROBE_URL', 'https://bigquery.googleapis.com/')
+PROXY_HEALTH_CHECK_INTERVAL = float(os.getenv('PROXY_HEALTH_CHECK_INTERVAL', '60'))  # Секунды
+PROXY_HEALTH_CHECK_TIMEOUT = float(os.getenv('PROXY_HEALTH_CHECK_TIMEOUT', '5'))  # Секунды
 
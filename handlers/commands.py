@@ -1,10 +1,12 @@
+import asyncio
 import logging
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 from handlers.base import is_authorized_user
-from services.bq_client import BigQueryClient
-from services.status_tracker import StatusTracker
-from config.settings import BIGQUERY_PROJECT_ID, GOOGLE_APPLICATION_CREDENTIALS_JSON
+from services.listing_cache import get_listing_cache
+from services.collections_mirror import get_collections_mirror
+from services.bq_async import get_async_bq_client
+from services.collection_filters import CollectionFilter, parse_collection_filter
 
 logger = logging.getLogger(__name__)
 
@@ -30,6 +32,34 @@ def shorten_collection_name(name: str) -> str:
         return f"{shortened} {rest}"
     return shortened
 
+# Подсказка по аргументам /collections
+COLLECTIONS_USAGE = (
+    "Фильтры /collections (можно сочетать):\n"
+    "• слова без ключа или name=... - название содержит\n"
+    "• prefix=... - название начинается с\n"
+    "• company=tsum_cs - компания\n"
+    "• created=2025-01-01..2025-01-31, updated=2025-02-01.. - даты (ГГГГ-ММ-ДД или ДД.ММ.ГГГГ)\n"
+    "• status=tsum - только 'tsum cs'\n"
+    "Пример: /collections panel created=2025-01-01.."
+)
+
+def filter_token(collection_filter: CollectionFilter) -> str:
+    """
+    Короткое обозначение фильтра для callback_data (не больше 64 байт)
+    
+    Фильтр только по статусу передается в кнопке целиком, поисковый фильтр
+    хранится в user_data, а в кнопке - метка 'q'.
+    """
+    if collection_filter.is_status_only:
+        return collection_filter.status or 'all'
+    return 'q'
+
+def filter_from_token(token: str, context: ContextTypes.DEFAULT_TYPE) -> CollectionFilter:
+    """Восстанавливает фильтр по обозначению из callback_data"""
+    if token == 'q':
+        return context.user_data.get('collection_filter') or CollectionFilter()
+    return CollectionFilter.from_status(token if token != 'all' else None)
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /start"""
     # Проверяем, что это личное сообщение
@@ -61,6 +91,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "👋 Добро пожаловать в бот отчетов по коллекциям!\n\n"
         "Доступные команды:\n"
         "/collections - Показать все коллекции\n"
+        "/collections <поиск> - Найти коллекции по названию, компании и датам\n"
         "/collections_tsum - Показать коллекции со статусом 'tsum cs'\n"
         "/status <collection_id> - Показать статус коллекции"
     )
@@ -98,7 +129,8 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "/collections - Показать все коллекции компании tsum_cs\n"
         "/collections_tsum - Показать только коллекции со статусом 'tsum cs'\n"
         "/status <collection_id> - Показать детальную информацию о статусе коллекции\n"
-        "/help - Показать эту справку"
+        "/help - Показать эту справку\n\n"
+        f"{COLLECTIONS_USAGE}"
     )
     
     try:
@@ -106,8 +138,14 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except:
         pass
 
-async def show_collections(update: Update, context: ContextTypes.DEFAULT_TYPE, filter_status: str = None, page: int = 0, edit_message=None):
-    """Показывает список коллекций с пагинацией"""
+async def show_collections(update: Update, context: ContextTypes.DEFAULT_TYPE, collection_filter: CollectionFilter = None,
+                           page: int = 0, edit_message=None, base_filter: CollectionFilter = None):
+    """
+    Показывает список коллекций с пагинацией
+    
+    При прямом вызове команды фильтр берется из ее аргументов (см. COLLECTIONS_USAGE)
+    поверх base_filter; фильтрация выполняется в запросе, а не в боте.
+    """
     # Проверяем, что это личное сообщение
     if update.effective_chat.type != 'private':
         if update.message:
@@ -136,52 +174,43 @@ async def show_collections(update: Update, context: ContextTypes.DEFAULT_TYPE, f
         if not hasattr(context, 'user_data'):
             context.user_data = {}
         
-        # Очищаем кэш если фильтр изменился или это прямой вызов команды
-        cached_filter = context.user_data.get('filter_status')
-        # Если это прямой вызов команды (не через callback), всегда очищаем кэш
-        is_direct_command = update.message is not None
-        if is_direct_command or cached_filter != filter_status:
-            # Фильтр изменился или прямой вызов команды, нужно перезагрузить коллекции
-            if 'collections' in context.user_data:
-                del context.user_data['collections']
-            if 'filter_status' in context.user_data:
-                del context.user_data['filter_status']
-        
-        # Сохраняем коллекции в context для пагинации
-        if 'collections' not in context.user_data:
-            loading_msg = None
-            if edit_message:
-                try:
-                    await edit_message.edit_text("⏳ Загружаю коллекции...")
-                    loading_msg = edit_message
-                except:
-                    loading_msg = await update.message.reply_text("⏳ Загружаю коллекции...")
-            else:
-                loading_msg = await update.message.reply_text("⏳ Загружаю коллекции...")
-            
-            bq_client = BigQueryClient(GOOGLE_APPLICATION_CREDENTIALS_JSON, BIGQUERY_PROJECT_ID)
-            
-            if filter_status:
-                collections = bq_client.get_collections_with_status(filter_status)
-                context.user_data['filter_status'] = filter_status
-            else:
-                collections = bq_client.get_all_collections()
-                context.user_data['filter_status'] = None
-            
-            context.user_data['collections'] = collections
-            context.user_data['loading_msg'] = loading_msg
-            context.user_data['current_page'] = page
-        else:
-            collections = context.user_data['collections']
-            filter_status = context.user_data.get('filter_status')
-            loading_msg = context.user_data.get('loading_msg')
-            context.user_data['current_page'] = page
+        if collection_filter is None:
+            try:
+                collection_filter = parse_collection_filter(
+                    (context.args or []) if update.message is not None and not edit_message else [],
+                    base=base_filter
+                )
+            except ValueError as e:
+                await update.message.reply_text(f"❌ {e}\n\n{COLLECTIONS_USAGE}")
+                return
+        
+        # Прямой вызов команды - новое сообщение со списком, иначе редактируем существующее
+        loading_msg = None
+        if update.message is not None and not edit_message:
+            loading_msg = await update.message.reply_text("⏳ Загружаю коллекции...")
         
-        if not collections:
+        # Настройки пагинации
+        ITEMS_PER_PAGE = 12  # По 12 коллекций на страницу (6 строк по 2 кнопки)
+        
+        # Страницы берутся из общего кэша списков: пользователи, открывшие одну и ту же
+        # страницу, не запускают повторные запросы к BigQuery
+        total_count, page, page_collections = await get_listing_cache().get_page(collection_filter, page, ITEMS_PER_PAGE)
+        total_pages = (total_count + ITEMS_PER_PAGE - 1) // ITEMS_PER_PAGE
+        
+        # В сессии пользователя храним только фильтр и номер страницы
+        context.user_data['collection_filter'] = collection_filter
+        context.user_data['current_page'] = page
+        
+        if not page_collections:
+            not_found_text = "❌ Коллекции не найдены."
+            if not collection_filter.is_status_only:
+                not_found_text += f"\n🔎 {collection_filter.describe()}"
             if edit_message:
-                await edit_message.edit_text("❌ Коллекции не найдены.")
+                await edit_message.edit_text(not_found_text)
+            elif loading_msg:
+                await loading_msg.edit_text(not_found_text)
             elif update.message:
-                await update.message.reply_text("❌ Коллекции не найдены.")
+                await update.message.reply_text(not_found_text)
             if update.message:
                 try:
                     await update.message.delete()
@@ -189,21 +218,6 @@ async def show_collections(update: Update, context: ContextTypes.DEFAULT_TYPE, f
                     pass
             return
         
-        # Настройки пагинации
-        ITEMS_PER_PAGE = 12  # По 12 коллекций на страницу (6 строк по 2 кнопки)
-        total_pages = (len(collections) + ITEMS_PER_PAGE - 1) // ITEMS_PER_PAGE
-        
-        # Проверяем границы страницы
-        if page < 0:
-            page = 0
-        if page >= total_pages:
-            page = total_pages - 1
-        
-        # Получаем коллекции для текущей страницы
-        start_idx = page * ITEMS_PER_PAGE
-        end_idx = min(start_idx + ITEMS_PER_PAGE, len(collections))
-        page_collections = collections[start_idx:end_idx]
-        
         # Формируем клавиатуру с кнопками
         keyboard = []
         
@@ -213,7 +227,7 @@ async def show_collections(update: Update, context: ContextTypes.DEFAULT_TYPE, f
             for j in range(2):
                 if i + j < len(page_collections):
                     coll = page_collections[i + j]
-                    name = coll.get('collection_name', 'Без названия')
+                    name = coll.collection_name or 'Без названия'
                     # Сокращаем название
                     short_name = shorten_collection_name(name)
                     # Ограничиваем длину названия для кнопки
@@ -222,7 +236,7 @@ async def show_collections(update: Update, context: ContextTypes.DEFAULT_TYPE, f
                     row.append(
                         InlineKeyboardButton(
                             short_name,
-                            callback_data=f"coll_{coll['collection_id']}"
+                            callback_data=f"coll_{coll.collection_id}"
                         )
                     )
             keyboard.append(row)
@@ -232,11 +246,12 @@ async def show_collections(update: Update, context: ContextTypes.DEFAULT_TYPE, f
         
         # Шаг перехода - 5 страниц (или меньше, если до конца меньше 5)
         PAGE_STEP = 5
+        token = filter_token(collection_filter)
         
         # Кнопка "Назад" - переходит на 5 страниц назад
         prev_page = max(0, page - PAGE_STEP)
         if page > 0:
-            nav_row.append(InlineKeyboardButton("◀️ Назад", callback_data=f"page_{prev_page}_{filter_status or 'all'}"))
+            nav_row.append(InlineKeyboardButton("◀️ Назад", callback_data=f"page_{prev_page}_{token}"))
         
         # Кнопка с номером страницы
         nav_row.append(InlineKeyboardButton(f"📄 {page+1}/{total_pages}", callback_data="page_info"))
@@ -244,7 +259,7 @@ async def show_collections(update: Update, context: ContextTypes.DEFAULT_TYPE, f
         # Кнопка "Вперед" - переходит на 5 страниц вперед
         next_page = min(total_pages - 1, page + PAGE_STEP)
         if page < total_pages - 1:
-            nav_row.append(InlineKeyboardButton("Вперед ▶️", callback_data=f"page_{next_page}_{filter_status or 'all'}"))
+            nav_row.append(InlineKeyboardButton("Вперед ▶️", callback_data=f"page_{next_page}_{token}"))
         
         keyboard.append(nav_row)
         
@@ -257,7 +272,7 @@ async def show_collections(update: Update, context: ContextTypes.DEFAULT_TYPE, f
                 p = page + i
                 if p < total_pages:
                     # Текущая страница будет первой в списке
-                    quick_nav.append(InlineKeyboardButton(str(p+1), callback_data=f"page_{p}_{filter_status or 'all'}"))
+                    quick_nav.append(InlineKeyboardButton(str(p+1), callback_data=f"page_{p}_{token}"))
             if quick_nav:
                 keyboard.append(quick_nav)
         
@@ -268,6 +283,13 @@ async def show_collections(update: Update, context: ContextTypes.DEFAULT_TYPE, f
         
         # Текст сообщения - минимальный (Telegram требует непустой текст)
         message_text = f"Страница {page+1}/{total_pages}"
+        if not collection_filter.is_status_only:
+            message_text += f"\n🔎 {collection_filter.describe()} (найдено: {total_count})"
+        
+        # Если список взят из локальной копии, показываем, насколько он свежий
+        mirror = get_collections_mirror()
+        if await asyncio.to_thread(mirror.is_fresh):
+            message_text += f"\n🕒 Данные обновлены {int(mirror.age_seconds())} с назад"
         
         # Редактируем существующее сообщение или создаем новое
         if edit_message:
@@ -298,7 +320,7 @@ async def show_collections(update: Update, context: ContextTypes.DEFAULT_TYPE, f
 
 async def show_collections_tsum(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показывает коллекции со статусом 'tsum cs'"""
-    await show_collections(update, context, filter_status='tsum cs')
+    await show_collections(update, context, base_filter=CollectionFilter(status='tsum cs'))
 
 async def show_collection_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показывает статус конкретной коллекции и сразу начинает собирать отчет"""
@@ -401,16 +423,12 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if len(parts) >= 3:
             try:
                 page = int(parts[1])
-                filter_status = parts[2] if parts[2] != 'all' else None
-                
-                # Очищаем кэш коллекций, чтобы загрузить заново
-                if 'collections' in context.user_data:
-                    del context.user_data['collections']
+                collection_filter = filter_from_token("_".join(parts[2:]), context)
                 
                 # Сохраняем текущую страницу
                 context.user_data['current_page'] = page
                 # Показываем нужную страницу
-                await show_collections(update, context, filter_status=filter_status, page=page, edit_message=query.message)
+                await show_collections(update, context, collection_filter=collection_filter, page=page, edit_message=query.message)
             except ValueError:
                 await query.answer("Ошибка: неверный номер страницы", show_alert=True)
     elif callback_data == "page_info":
@@ -420,16 +438,20 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # Возвращаемся к списку коллекций
         if not hasattr(context, 'user_data'):
             context.user_data = {}
-        filter_status = context.user_data.get('filter_status')
+        collection_filter = context.user_data.get('collection_filter') or CollectionFilter()
         current_page = context.user_data.get('current_page', 0)
-        await show_collections(update, context, filter_status=filter_status, page=current_page, edit_message=query.message)
+        await show_collections(update, context, collection_filter=collection_filter, page=current_page, edit_message=query.message)
     elif callback_data == "refresh_collections":
-        # Обновляем список коллекций
-        if 'collections' in context.user_data:
-            del context.user_data['collections']
+        # Обновляем список коллекций: подтягиваем изменения в локальную копию
+        # и сбрасываем общий кэш списков
         await query.edit_message_text("⏳ Обновляю список коллекций...")
-        filter_status = context.user_data.get('filter_status')
-        await show_collections(update, context, filter_status=filter_status, page=0, edit_message=query.message)
+        try:
+            await get_async_bq_client().run(get_collections_mirror().sync)
+        except Exception as e:
+            logger.error(f"Error syncing collections mirror: {e}")
+        get_listing_cache().invalidate()
+        collection_filter = context.user_data.get('collection_filter') or CollectionFilter()
+        await show_collections(update, context, collection_filter=collection_filter, page=0, edit_message=query.message)
 
 async def show_collection_info(query, collection_id: str, context: ContextTypes.DEFAULT_TYPE):
     """Показывает детальную информацию о коллекции и сразу начинает собирать отчет"""
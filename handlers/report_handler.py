@@ -2,14 +2,25 @@ import logging
 from telegram import Update
 from telegram.ext import ContextTypes
 from handlers.base import is_authorized_user
-from services.selenium_collector import SeleniumCollector
-from config.settings import ADMIN_EMAIL, ADMIN_PASSWORD
+from services.report_engine import get_report_engine, REPORT_SOURCE_SELENIUM
+from services.report_sender import ReportSender
+from config.settings import ADMIN_EMAIL, ADMIN_PASSWORD, REPORT_SOURCE
 
 logger = logging.getLogger(__name__)
 
+# Подписи этапов сбора отчета для промежуточного сообщения
+REPORT_STAGE_LABELS = {
+    'session': 'Вход в Мозаику...',
+    'showoff_view': 'Открываю Showoff Collections...',
+    'search_results': 'Ищу коллекцию...',
+    'edit_panel': 'Открываю форму коллекции...',
+    'stats': 'Читаю статистику...',
+    'sql_stats': 'Считаю статистику в BigQuery...',
+}
+
 async def generate_report(update: Update, context: ContextTypes.DEFAULT_TYPE, collection_id: str, edit_message=None):
     """
-    Генерирует отчет по коллекции через Selenium
+    Генерирует отчет по коллекции (через BigQuery, Selenium - запасной вариант)
     
     Args:
         update: Обновление от Telegram
@@ -69,14 +80,17 @@ async def generate_report(update: Update, context: ContextTypes.DEFAULT_TYPE, co
     
     try:
         # ТЕПЕРЬ получаем информацию о коллекции (после показа сообщения)
-        import asyncio
-        from services.bq_client import BigQueryClient
-        from config.settings import BIGQUERY_PROJECT_ID, GOOGLE_APPLICATION_CREDENTIALS_JSON
+        from services.collection_lookup import get_collection_lookup
         from handlers.commands import shorten_collection_name
         
-        # Выполняем запрос к BigQuery в отдельном потоке, чтобы не блокировать event loop
-        bq_client = BigQueryClient(GOOGLE_APPLICATION_CREDENTIALS_JSON, BIGQUERY_PROJECT_ID)
-        collection = await asyncio.to_thread(bq_client.get_collection_by_id, collection_id)
+        # Поиск объединяется с одновременными запросами других пользователей в один запрос
+        # к BigQuery (и кэшируется), event loop не блокируется
+        try:
+            collection = await get_collection_lookup().get(collection_id)
+        except Exception as e:
+            logger.error(f"Collection lookup failed for {collection_id}: {e}")
+            await loading_msg.edit_text("❌ BigQuery недоступен, не удалось получить данные коллекции. Попробуйте позже.")
+            return
         
         # Обновляем сообщение с информацией о коллекции, если она найдена
         if collection:
@@ -100,29 +114,25 @@ async def generate_report(update: Update, context: ContextTypes.DEFAULT_TYPE, co
             except:
                 pass
         
-        # Проверяем, что email и password заданы
-        if not ADMIN_EMAIL or not ADMIN_PASSWORD:
+        # Проверяем, что email и password заданы (без них возможен только сбор через BigQuery)
+        if REPORT_SOURCE == REPORT_SOURCE_SELENIUM and (not ADMIN_EMAIL or not ADMIN_PASSWORD):
             error_msg = "❌ Не настроены учетные данные для входа в Мозаику. Проверьте ADMIN_EMAIL и ADMIN_PASSWORD в .env файле."
             await loading_msg.edit_text(error_msg)
             return
         
-        # Выполняем тяжелые операции Selenium в отдельном потоке, чтобы не блокировать event loop
-        def collect_report():
-            """Синхронная функция для сбора отчета"""
-            collector = SeleniumCollector(ADMIN_EMAIL, ADMIN_PASSWORD)
+        # Показываем пользователю, на каком этапе сбор отчета
+        async def show_progress(stage: str):
+            stage_label = REPORT_STAGE_LABELS.get(stage)
+            if not stage_label:
+                return
             try:
-                # Входим в Мозаику
-                if not collector.login():
-                    return None, "❌ Не удалось войти в Мозаику. Проверьте учетные данные."
-                
-                # Собираем отчет
-                report = collector.get_collection_report(collection_id)
-                return report, None
-            finally:
-                collector.close()
+                await loading_msg.edit_text(f"{loading_text}\n\n🔄 {stage_label}")
+            except:
+                pass
         
-        # Выполняем сбор отчета в отдельном потоке
-        report, error_msg = await asyncio.to_thread(collect_report)
+        # Статистика считается запросом к BigQuery; если данных нет, отчет собирается
+        # через Selenium в отдельном процессе-воркере, не блокируя event loop
+        report, error_msg = await get_report_engine().collect_report(collection_id, on_progress=show_progress)
         
         if error_msg:
             await loading_msg.edit_text(error_msg)
@@ -134,47 +144,9 @@ async def generate_report(update: Update, context: ContextTypes.DEFAULT_TYPE, co
             return
         
         # Используем уже полученную информацию о коллекции
-        if not collection:
-            collection = await asyncio.to_thread(bq_client.get_collection_by_id, collection_id)
-        
         collection_name = collection.get('collection_name', 'Без названия') if collection else 'Без названия'
         
-        # Формируем ссылку в формате admin.dresscode.ai
-        collection_url = f"https://admin.dresscode.ai/collection/{collection_id}"
-        
-        # Формируем сообщение с отчетом в формате как на фото
-        # Формат:
-        # "Добрый вечер!\n"
-        # "\n"
-        # "Направляем пак {полное название коллекции}\n"
-        # "{ссылка}\n"
-        # "\n"
-        # "Статистика..."
-        
-        # Формируем сообщение с HTML форматированием для кликабельной ссылки
-        # Экранируем специальные символы HTML в названии коллекции и делаем жирным
-        from html import escape
-        escaped_name = escape(collection_name)
-        message = "Добрый вечер!\n"
-        message += "\n"
-        message += f"Направляем пак <b>{escaped_name}</b>\n"
-        message += f"<a href=\"{collection_url}\">{collection_url}</a>\n"
-        message += "\n"
-        
-        # Добавляем статистику
-        total_done = report.get('total_done', 0) or 0
-        combo_items = report.get('combo_items', 0) or 0
-        
-        if total_done:
-            message += f"Общее количество уникальных done-айтемов - {total_done}\n"
-        
-        if combo_items:
-            message += f"Из них combo-айтемов – {combo_items}\n"
-        
-        # Рассчитываем "Итого total done" = total_done + combo_items
-        total_done_items = total_done + combo_items
-        if total_done_items > 0:
-            message += f"Итого total done - {total_done_items} айтемов"
+        message = ReportSender.format_report(collection_id, collection_name, report)
         
         # Редактируем существующее сообщение с отчетом (используем HTML для кликабельной ссылки)
         await loading_msg.edit_text(message, parse_mode='HTML')
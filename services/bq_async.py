@@ -0,0 +1,105 @@
+import asyncio
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional
+from services.bq_client import BigQueryClient, get_bq_client
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncBigQueryClient:
+    """
+    Асинхронный фасад над BigQueryClient
+
+    Синхронные вызовы клиента выполняются в отдельном ограниченном пуле потоков,
+    поэтому медленный запрос не блокирует event loop бота. Если вызов не уложился
+    в таймаут или был отменен, его задания BigQuery отменяются.
+
+    Методы BigQueryClient доступны напрямую как корутины:
+        collections = await async_client.get_all_collections()
+    """
+
+    def __init__(self, client: BigQueryClient, max_workers: int = 4, default_timeout: float = 90.0):
+        """
+        Args:
+            client: Синхронный клиент BigQuery
+            max_workers: Максимум одновременно выполняемых вызовов BigQuery
+            default_timeout: Таймаут вызова по умолчанию (в секундах)
+        """
+        self.client = client
+        self.default_timeout = default_timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='bigquery')
+
+    def _call_in_scope(self, jobs: List, func: Callable, *args, **kwargs):
+        """Выполняет функцию в потоке пула, регистрируя ее задания BigQuery в jobs"""
+        with self.client.job_scope(jobs):
+            return func(*args, **kwargs)
+
+    def _cancel_jobs(self, jobs: List):
+        """Отменяет незавершенные задания BigQuery"""
+        for job in list(jobs):
+            try:
+                if not job.done():
+                    job.cancel()
+                    logger.warning(f"BigQuery job {job.job_id} cancelled")
+            except Exception as e:
+                logger.debug(f"Could not cancel BigQuery job: {e}")
+
+    async def run(self, func: Callable, *args, timeout: Optional[float] = None, **kwargs):
+        """
+        Выполняет синхронную функцию, работающую с BigQuery, в пуле потоков
+
+        Args:
+            func: Функция (метод BigQueryClient или код, который его вызывает)
+            timeout: Таймаут в секундах (по умолчанию default_timeout)
+
+        Returns:
+            Результат функции
+
+        Raises:
+            asyncio.TimeoutError: Если вызов не уложился в таймаут
+        """
+        loop = asyncio.get_running_loop()
+        jobs = []
+        future = loop.run_in_executor(
+            self._executor,
+            functools.partial(self._call_in_scope, jobs, func, *args, **kwargs)
+        )
+        try:
+            return await asyncio.wait_for(future, timeout or self.default_timeout)
+        except asyncio.TimeoutError:
+            logger.error(f"BigQuery call {getattr(func, '__name__', func)} timed out")
+            await loop.run_in_executor(None, self._cancel_jobs, jobs)
+            raise
+        except asyncio.CancelledError:
+            await loop.run_in_executor(None, self._cancel_jobs, jobs)
+            raise
+
+    def __getattr__(self, name: str):
+        """Оборачивает методы BigQueryClient в корутины"""
+        attr = getattr(self.client, name)
+        if not callable(attr):
+            return attr
+
+        async def method(*args, timeout: Optional[float] = None, **kwargs):
+            return await self.run(attr, *args, timeout=timeout, **kwargs)
+
+        method.__name__ = name
+        return method
+
+    def shutdown(self):
+        """Останавливает пул потоков"""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+_async_client: Optional[AsyncBigQueryClient] = None
+
+
+def get_async_bq_client() -> AsyncBigQueryClient:
+    """Возвращает общий асинхронный фасад над клиентом BigQuery"""
+    global _async_client
+    if _async_client is None:
+        from config.settings import BQ_MAX_CONCURRENCY, BQ_CALL_TIMEOUT
+        _async_client = AsyncBigQueryClient(get_bq_client(), BQ_MAX_CONCURRENCY, BQ_CALL_TIMEOUT)
+    return _async_client
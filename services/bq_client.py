@@ -1,14 +1,209 @@
+import copy
 import json
 import os
 from google.cloud import bigquery
 from google.oauth2 import service_account
-from typing import List, Dict, Optional
+import google.auth.credentials
+from datetime import datetime
+from collections import OrderedDict
+from typing import List, Dict, Optional, Tuple
 import logging
 import traceback
-import random
+import threading
+import time
+from contextlib import contextmanager
+from services.bq_metrics import get_metrics_sink
+from services.collection_filters import CollectionFilter
+from services.tenants import TenantRule
+from services.proxy_pool import ProxyPool, ProxiedAuthorizedSession, get_proxy_pool
+from services.bq_transport import (
+    BigQueryError, BigQueryTransientError, BigQueryTimeoutError,
+    RetryPolicy, classify_error, get_circuit_breaker,
+)
+
+# Arrow и BigQuery Storage Read API - необязательные зависимости для быстрой выгрузки больших списков
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+except ImportError:
+    pa = None
+    pc = None
+
+try:
+    from google.cloud import bigquery_storage
+except ImportError:
+    bigquery_storage = None
 
 logger = logging.getLogger(__name__)
 
+# Как долго переиспользовать оценку объема из пробного запуска для одного и того же запроса
+DRY_RUN_CACHE_TTL = 3600.0
+# Сколько оценок хранить (запросы с разными параметрами - разные записи)
+DRY_RUN_CACHE_SIZE = 512
+
+
+class QueryBudgetExceeded(BigQueryError):
+    """Запрос обработал бы больше байт, чем разрешено BQ_MAX_BYTES_PER_QUERY"""
+
+
+def _format_timestamps(column):
+    """Форматирует колонку TIMESTAMP в строки так же, как str(datetime) в UTC; NULL остается None"""
+    if not pa.types.is_timestamp(column.type):
+        return pc.cast(column, pa.string())
+    # Значения TIMESTAMP хранятся в UTC: приведение к типу без таймзоны не меняет их,
+    # а приведение к строке без таймзоны в десятки раз быстрее strftime
+    naive = pc.cast(column, pa.timestamp('us'))
+    formatted = pc.replace_substring(pc.cast(naive, pa.string()), '.000000', '')
+    return pc.binary_join_element_wise(formatted, '+00:00', '')
+
+
+def collections_from_arrow(table) -> List[Dict]:
+    """
+    Преобразует результат запроса коллекций (pyarrow.Table или RecordBatch) в список словарей
+    
+    Статус и строки времени считаются над целыми колонками (pyarrow.compute),
+    словари собираются только в самом конце.
+    """
+    names = table.column('collection_name')
+    # Если в названии есть "TSUM Collection Panel", считаем статус "tsum cs"
+    is_tsum = pc.fill_null(pc.match_substring(names, 'TSUM Collection Panel'), False)
+    statuses = pc.if_else(is_tsum, 'tsum cs', '')
+    
+    columns = zip(
+        table.column('collection_id').to_pylist(),
+        names.to_pylist(),
+        table.column('company_id').to_pylist(),
+        statuses.to_pylist(),
+        _format_timestamps(table.column('created_at')).to_pylist(),
+        _format_timestamps(table.column('updated_at')).to_pylist(),
+    )
+    return [
+        {
+            'collection_id': collection_id,
+            'collection_name': collection_name,
+            'company_id': company_id,
+            'status': status,
+            'created_at': created_at,
+            'updated_at': updated_at,
+        }
+        for collection_id, collection_name, company_id, status, created_at, updated_at in columns
+    ]
+
+
+def parse_credentials(credentials_json) -> Dict:
+    """
+    Разбирает учетные данные сервисного аккаунта и исправляет private_key
+    
+    Args:
+        credentials_json: JSON строка, путь к файлу или словарь с учетными данными
+    
+    Returns:
+        Словарь с учетными данными
+    """
+    # Пробуем сначала распарсить как JSON строку
+    credentials_dict = None
+
+    # Если это уже словарь
+    if isinstance(credentials_json, dict):
+        credentials_dict = credentials_json
+    # Если это путь к файлу
+    elif os.path.exists(credentials_json) and os.path.isfile(credentials_json):
+        with open(credentials_json, 'r', encoding='utf-8') as f:
+            credentials_dict = json.load(f)
+    else:
+        # Пробуем распарсить как JSON строку
+        try:
+            credentials_dict = json.loads(credentials_json)
+        except json.JSONDecodeError as e:
+            # Если не получилось, пробуем обработать экранированные символы
+            # В .env файлах могут быть двойные экранирования
+            try:
+                # Заменяем \\n на \n для правильной обработки переносов строк
+                processed_json = credentials_json.replace('\\n', '\n').replace('\\\\', '\\')
+                credentials_dict = json.loads(processed_json)
+            except Exception as e2:
+                logger.error(f"JSON decode error: {e}")
+                logger.error(f"Second attempt error: {e2}")
+                logger.error(f"First 200 chars of credentials: {credentials_json[:200]}")
+                raise ValueError(f"Не удалось распарсить JSON из GOOGLE_APPLICATION_CREDENTIALS: {e}")
+
+    # Важно: исправляем private_key - заменяем \\n на реальные переносы строк
+    if credentials_dict and 'private_key' in credentials_dict:
+        private_key = credentials_dict['private_key']
+        if isinstance(private_key, str):
+            # Пробуем разные варианты замены переносов строк
+            original_key = private_key
+            original_length = len(private_key)
+
+            # Вариант 1: \\\\n -> \n (двойное экранирование в .env - проверяем сначала)
+            if '\\\\n' in private_key:
+                private_key = private_key.replace('\\\\n', '\n')
+                logger.debug(f"Replaced \\\\n with actual newline in private_key (length: {original_length} -> {len(private_key)})")
+
+            # Вариант 2: \\n -> \n (стандартное экранирование)
+            elif '\\n' in private_key:
+                private_key = private_key.replace('\\n', '\n')
+                logger.debug(f"Replaced \\n with actual newline in private_key (length: {original_length} -> {len(private_key)})")
+
+            # Убираем лишние пробелы в начале/конце, но сохраняем переносы строк
+            private_key = private_key.strip()
+
+            # Проверяем длину - приватный ключ должен быть длинным (обычно > 1000 символов)
+            if len(private_key) < 100:
+                logger.error(f"Private key seems too short: {len(private_key)} characters. Original length was {original_length}")
+                logger.error(f"First 100 chars: {original_key[:100]}")
+                logger.error(f"Last 100 chars: {original_key[-100:]}")
+                raise ValueError(f"Private key is too short ({len(private_key)} chars). Check JSON parsing in .env file.")
+
+            # Проверяем, что ключ начинается правильно
+            if not private_key.startswith('-----BEGIN'):
+                logger.warning("Private key doesn't start with -----BEGIN, trying to fix...")
+                # Пробуем найти начало ключа
+                begin_idx = private_key.find('-----BEGIN')
+                if begin_idx != -1:
+                    private_key = private_key[begin_idx:]
+                else:
+                    logger.error("Could not find -----BEGIN in private_key")
+                    raise ValueError("Invalid private_key format: missing -----BEGIN")
+
+            # Проверяем, что ключ заканчивается правильно
+            if not private_key.endswith('-----END PRIVATE KEY-----'):
+                # Пробуем найти конец ключа
+                end_idx = private_key.rfind('-----END PRIVATE KEY-----')
+                if end_idx != -1:
+                    private_key = private_key[:end_idx + len('-----END PRIVATE KEY-----')]
+                else:
+                    logger.warning("Could not find proper end of private_key")
+
+            credentials_dict['private_key'] = private_key
+            logger.info(f"Private key processed: length={len(private_key)}, starts={private_key[:30]}..., ends={private_key[-30:]}")
+    
+    return credentials_dict
+
+
+# Кэш объектов credentials: разбор JSON и починка ключа выполняются один раз на процесс
+_credentials_cache: Dict[str, service_account.Credentials] = {}
+_credentials_lock = threading.Lock()
+
+
+def load_credentials(credentials_json) -> service_account.Credentials:
+    """
+    Возвращает объект credentials сервисного аккаунта (с кэшированием)
+    
+    Args:
+        credentials_json: JSON строка, путь к файлу или словарь с учетными данными
+    """
+    cache_key = json.dumps(credentials_json, sort_keys=True) if isinstance(credentials_json, dict) else credentials_json
+    with _credentials_lock:
+        credentials = _credentials_cache.get(cache_key)
+        if credentials is None:
+            credentials = service_account.Credentials.from_service_account_info(
+                parse_credentials(credentials_json)
+            )
+            _credentials_cache[cache_key] = credentials
+        return credentials
+
+
 class BigQueryClient:
     """Клиент для работы с BigQuery"""
     
@@ -21,112 +216,46 @@ class BigQueryClient:
             project_id: ID проекта Google Cloud
         """
         try:
-            # Пробуем сначала распарсить как JSON строку
-            credentials_dict = None
-            
-            # Если это уже словарь
-            if isinstance(credentials_json, dict):
-                credentials_dict = credentials_json
-            # Если это путь к файлу
-            elif os.path.exists(credentials_json) and os.path.isfile(credentials_json):
-                with open(credentials_json, 'r', encoding='utf-8') as f:
-                    credentials_dict = json.load(f)
-            else:
-                # Пробуем распарсить как JSON строку
-                try:
-                    credentials_dict = json.loads(credentials_json)
-                except json.JSONDecodeError as e:
-                    # Если не получилось, пробуем обработать экранированные символы
-                    # В .env файлах могут быть двойные экранирования
-                    try:
-                        # Заменяем \\n на \n для правильной обработки переносов строк
-                        processed_json = credentials_json.replace('\\n', '\n').replace('\\\\', '\\')
-                        credentials_dict = json.loads(processed_json)
-                    except Exception as e2:
-                        logger.error(f"JSON decode error: {e}")
-                        logger.error(f"Second attempt error: {e2}")
-                        logger.error(f"First 200 chars of credentials: {credentials_json[:200]}")
-                        raise ValueError(f"Не удалось распарсить JSON из GOOGLE_APPLICATION_CREDENTIALS: {e}")
-            
-            # Важно: исправляем private_key - заменяем \\n на реальные переносы строк
-            if credentials_dict and 'private_key' in credentials_dict:
-                private_key = credentials_dict['private_key']
-                if isinstance(private_key, str):
-                    # Пробуем разные варианты замены переносов строк
-                    original_key = private_key
-                    original_length = len(private_key)
-                    
-                    # Вариант 1: \\\\n -> \n (двойное экранирование в .env - проверяем сначала)
-                    if '\\\\n' in private_key:
-                        private_key = private_key.replace('\\\\n', '\n')
-                        logger.debug(f"Replaced \\\\n with actual newline in private_key (length: {original_length} -> {len(private_key)})")
-                    
-                    # Вариант 2: \\n -> \n (стандартное экранирование)
-                    elif '\\n' in private_key:
-                        private_key = private_key.replace('\\n', '\n')
-                        logger.debug(f"Replaced \\n with actual newline in private_key (length: {original_length} -> {len(private_key)})")
-                    
-                    # Убираем лишние пробелы в начале/конце, но сохраняем переносы строк
-                    private_key = private_key.strip()
-                    
-                    # Проверяем длину - приватный ключ должен быть длинным (обычно > 1000 символов)
-                    if len(private_key) < 100:
-                        logger.error(f"Private key seems too short: {len(private_key)} characters. Original length was {original_length}")
-                        logger.error(f"First 100 chars: {original_key[:100]}")
-                        logger.error(f"Last 100 chars: {original_key[-100:]}")
-                        raise ValueError(f"Private key is too short ({len(private_key)} chars). Check JSON parsing in .env file.")
-                    
-                    # Проверяем, что ключ начинается правильно
-                    if not private_key.startswith('-----BEGIN'):
-                        logger.warning("Private key doesn't start with -----BEGIN, trying to fix...")
-                        # Пробуем найти начало ключа
-                        begin_idx = private_key.find('-----BEGIN')
-                        if begin_idx != -1:
-                            private_key = private_key[begin_idx:]
-                        else:
-                            logger.error("Could not find -----BEGIN in private_key")
-                            raise ValueError("Invalid private_key format: missing -----BEGIN")
-                    
-                    # Проверяем, что ключ заканчивается правильно
-                    if not private_key.endswith('-----END PRIVATE KEY-----'):
-                        # Пробуем найти конец ключа
-                        end_idx = private_key.rfind('-----END PRIVATE KEY-----')
-                        if end_idx != -1:
-                            private_key = private_key[:end_idx + len('-----END PRIVATE KEY-----')]
-                        else:
-                            logger.warning("Could not find proper end of private_key")
-                    
-                    credentials_dict['private_key'] = private_key
-                    logger.info(f"Private key processed: length={len(private_key)}, starts={private_key[:30]}..., ends={private_key[-30:]}")
+            # Создаем credentials объект (разбирается один раз на процесс)
+            credentials = load_credentials(credentials_json)
             
-            # Создаем credentials объект
-            credentials = service_account.Credentials.from_service_account_info(
-                credentials_dict
-            )
+            # Google API требует credentials с областями доступа; при передаче своей
+            # HTTP-сессии bigquery.Client не добавляет их сам
+            credentials = google.auth.credentials.with_scopes_if_required(credentials, bigquery.Client.SCOPE)
             
-            # Настройка прокси для BigQuery (если нужен)
-            from config.settings import USE_PROXY, PROXY_SERVERS
-            
-            if USE_PROXY and PROXY_SERVERS:
-                try:
-                    # Выбираем случайный прокси
-                    proxy = random.choice(PROXY_SERVERS)
-                    proxy_url = f"http://{proxy}"
-                    
-                    # Устанавливаем переменные окружения для прокси
-                    os.environ['HTTP_PROXY'] = proxy_url
-                    os.environ['HTTPS_PROXY'] = proxy_url
-                    os.environ['http_proxy'] = proxy_url
-                    os.environ['https_proxy'] = proxy_url
-                    
-                    logger.info(f"Using proxy for BigQuery: {proxy}")
-                except Exception as e:
-                    logger.warning(f"Failed to set up proxy: {e}, continuing without proxy")
+            # Прокси (если включены) применяются только к сессиям BigQuery, а не ко всему процессу
+            proxy_pool = get_proxy_pool()
+            http = ProxiedAuthorizedSession(credentials, proxy_pool) if proxy_pool else None
+            if proxy_pool:
+                logger.info(f"Using proxy pool for BigQuery ({len(proxy_pool.proxies)} proxies)")
             else:
                 logger.info("Proxy disabled or not configured, using direct connection")
             
             # Инициализируем клиент
-            self.client = bigquery.Client(credentials=credentials, project=project_id)
+            self.client = bigquery.Client(credentials=credentials, project=project_id, _http=http)
+            # Поток-локальный список, куда регистрируются запущенные задания (см. job_scope)
+            self._local = threading.local()
+            # Кэш количества коллекций по фильтру: {CollectionFilter: (count, время)}
+            self._count_cache: Dict[CollectionFilter, tuple] = {}
+            # Курсоры keyset-пагинации: {(CollectionFilter, page_size): {страница: (created_at, collection_id)}}
+            self._page_cursors: Dict[tuple, Dict[int, tuple]] = {}
+            self._pagination_lock = threading.Lock()
+            # Оценки пробных запусков (LRU): {(текст запроса, параметры): (байт, время)}
+            self._dry_run_cache: OrderedDict = OrderedDict()
+            self._dry_run_lock = threading.Lock()
+            self.metrics = get_metrics_sink()
+            # Повторы временных ошибок и общий для процесса circuit breaker
+            from config.settings import BQ_RETRY_ATTEMPTS, BQ_RETRY_BASE_DELAY, BQ_RETRY_MAX_DELAY
+            self.retry_policy = RetryPolicy(BQ_RETRY_ATTEMPTS, BQ_RETRY_BASE_DELAY, BQ_RETRY_MAX_DELAY)
+            self.breaker = get_circuit_breaker()
+            # Клиент Storage Read API для выгрузки больших результатов (если установлен)
+            self._bqstorage_client = None
+            from config.settings import BQ_USE_STORAGE_API
+            if BQ_USE_STORAGE_API and bigquery_storage is not None and pa is not None:
+                try:
+                    self._bqstorage_client = self._create_bqstorage_client(credentials, proxy_pool)
+                except Exception as e:
+                    logger.warning(f"BigQuery Storage Read API is not available, using REST: {e}")
             logger.info("BigQuery client initialized successfully")
         except Exception as e:
             logger.error(f"Failed to initialize BigQuery client: {e}")
@@ -134,6 +263,226 @@ class BigQueryClient:
             logger.error(traceback.format_exc())
             raise
     
+    @staticmethod
+    def _create_bqstorage_client(credentials, proxy_pool: Optional[ProxyPool]):
+        """
+        Создает клиент Storage Read API
+        
+        gRPC-канал не переключает прокси на ходу, поэтому он закрепляется за лучшим
+        прокси на момент запуска.
+        """
+        proxy = proxy_pool.select() if proxy_pool else None
+        if proxy is None:
+            return bigquery_storage.BigQueryReadClient(credentials=credentials)
+        
+        from google.cloud.bigquery_storage_v1.services.big_query_read.transports import BigQueryReadGrpcTransport
+        channel = BigQueryReadGrpcTransport.create_channel(
+            credentials=credentials,
+            options=[('grpc.http_proxy', proxy.url)],
+        )
+        return bigquery_storage.BigQueryReadClient(transport=BigQueryReadGrpcTransport(channel=channel))
+    
+    @contextmanager
+    def job_scope(self, jobs: List):
+        """
+        Регистрирует задания BigQuery, запущенные в текущем потоке, в переданный список
+        
+        Нужен, чтобы асинхронный фасад мог отменить задания вызова, превысившего таймаут.
+        """
+        previous = getattr(self._local, 'jobs', None)
+        self._local.jobs = jobs
+        try:
+            yield jobs
+        finally:
+            self._local.jobs = previous
+    
+    def _check_budget(self, query: str, job_config: Optional[bigquery.QueryJobConfig],
+                      label: str) -> Optional[int]:
+        """
+        Оценивает объем запроса пробным запуском (dry run) и сверяет его с бюджетом
+        
+        Пробный запуск бесплатный; оценка для одного запроса (текст и значения
+        параметров - от них зависит объем) переиспользуется DRY_RUN_CACHE_TTL секунд. В режиме 'warn' превышение пишется в лог,
+        в режиме 'enforce' запрос не запускается.
+        
+        Returns:
+            Оценка объема в байтах или None, если бюджет не задан
+        
+        Raises:
+            QueryBudgetExceeded: Бюджет превышен в режиме 'enforce'
+        """
+        from config.settings import BQ_MAX_BYTES_PER_QUERY, BQ_BUDGET_MODE
+        
+        if not BQ_MAX_BYTES_PER_QUERY:
+            return None
+        
+        parameters = list(job_config.query_parameters) if job_config else []
+        key = (query, json.dumps([p.to_api_repr() for p in parameters], sort_keys=True, default=str))
+        with self._dry_run_lock:
+            cached = self._dry_run_cache.get(key)
+            if cached and time.monotonic() - cached[1] < DRY_RUN_CACHE_TTL:
+                self._dry_run_cache.move_to_end(key)
+            else:
+                cached = None
+        
+        if cached:
+            estimate = cached[0]
+        else:
+            # Пробный запуск - вне блокировки: параллельные запросы не ждут друг друга
+            dry_run_config = bigquery.QueryJobConfig(
+                dry_run=True,
+                use_query_cache=False,
+                query_parameters=parameters,
+            )
+            estimate = self.client.query(query, job_config=dry_run_config).total_bytes_processed or 0
+            with self._dry_run_lock:
+                self._dry_run_cache[key] = (estimate, time.monotonic())
+                self._dry_run_cache.move_to_end(key)
+                while len(self._dry_run_cache) > DRY_RUN_CACHE_SIZE:
+                    self._dry_run_cache.popitem(last=False)
+        
+        if estimate > BQ_MAX_BYTES_PER_QUERY:
+            message = (f"BigQuery {label} would process {estimate} bytes, "
+                       f"budget is {BQ_MAX_BYTES_PER_QUERY} bytes")
+            if BQ_BUDGET_MODE == 'enforce':
+                logger.error(message)
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+        
+        return estimate
+    
+    def _run_query(self, query: str, job_config: Optional[bigquery.QueryJobConfig] = None,
+                   timeout: Optional[float] = None, label: str = 'query'):
+        """
+        Запускает запрос и ждет результат с ограничением по времени
+        
+        timeout - общий срок на запрос вместе с повторами. Если результат не получен
+        в срок, задание отменяется в BigQuery, чтобы не тратить слоты и байты на ответ,
+        который уже никто не ждет. Временные ошибки (сеть, 5xx, превышение лимитов)
+        повторяются с экспоненциальной задержкой, пока срок не истек; серия таких
+        ошибок размыкает circuit breaker, и следующие запросы сразу получают
+        BigQueryUnavailableError. Объем, стоимость и время каждой попытки
+        записываются в сборщик метрик.
+        
+        Args:
+            query: Текст SQL запроса
+            job_config: Конфигурация задания (параметры запроса)
+            timeout: Срок на запрос в секундах (по умолчанию BQ_QUERY_TIMEOUT)
+            label: Метка запроса для метрик (обычно имя метода)
+        
+        Returns:
+            Итератор строк результата
+        
+        Raises:
+            BigQueryUnavailableError: Circuit breaker разомкнут
+            BigQueryTimeoutError: Запрос не уложился в срок
+            BigQueryTransientError: Временная ошибка не прошла после всех повторов
+            QueryBudgetExceeded: Запрос превышает бюджет в режиме 'enforce'
+            BigQueryError: Постоянная ошибка запроса
+        """
+        from config.settings import BQ_QUERY_TIMEOUT, BQ_MAX_BYTES_PER_QUERY, BQ_BUDGET_MODE
+        
+        deadline = time.monotonic() + (timeout or BQ_QUERY_TIMEOUT)
+        self.breaker.before_call()
+        
+        attempt = 0
+        while True:
+            started = time.monotonic()
+            query_job = None
+            dry_run_bytes = None
+            try:
+                remaining = deadline - started
+                if remaining <= 0:
+                    raise BigQueryTimeoutError(f"BigQuery {label} deadline exceeded")
+                
+                dry_run_bytes = self._check_budget(query, job_config, label)
+                run_config = job_config
+                if BQ_MAX_BYTES_PER_QUERY and BQ_BUDGET_MODE == 'enforce':
+                    # Страховка на стороне BigQuery, если оценка пробного запуска устарела.
+                    # Конфигурация вызывающего (может быть общей) не меняется - ставим лимит в копии
+                    run_config = copy.deepcopy(job_config) if job_config else bigquery.QueryJobConfig()
+                    run_config.maximum_bytes_billed = BQ_MAX_BYTES_PER_QUERY
+                
+                query_job = self.client.query(query, job_config=run_config)
+                scope = getattr(self._local, 'jobs', None)
+                if scope is not None:
+                    scope.append(query_job)
+                
+                results = query_job.result(timeout=max(0.0, deadline - time.monotonic()))
+            except QueryBudgetExceeded:
+                # Backend ответил - это не сбой транспорта
+                self.breaker.record_success()
+                raise
+            except Exception as e:
+                if query_job is not None:
+                    try:
+                        if not query_job.done():
+                            query_job.cancel()
+                            logger.warning(f"BigQuery job {query_job.job_id} cancelled")
+                    except Exception as cancel_error:
+                        logger.debug(f"Could not cancel BigQuery job: {cancel_error}")
+                    self.metrics.record(label, query_job, (time.monotonic() - started) * 1000,
+                                        error=str(e), dry_run_bytes=dry_run_bytes)
+                
+                error = classify_error(e)
+                if not isinstance(error, BigQueryTransientError):
+                    self.breaker.record_success()
+                    raise error from e
+                
+                delay = self.retry_policy.delay(attempt)
+                attempt += 1
+                if attempt >= self.retry_policy.attempts or time.monotonic() + delay >= deadline:
+                    self.breaker.record_failure()
+                    logger.error(f"BigQuery {label} failed after {attempt} attempt(s): {e}")
+                    raise error from e
+                
+                logger.warning(f"BigQuery {label} failed ({type(e).__name__}: {e}), "
+                               f"retrying in {delay:.1f}s (attempt {attempt + 1}/{self.retry_policy.attempts})")
+                time.sleep(delay)
+                continue
+            
+            self.breaker.record_success()
+            self.metrics.record(label, query_job, (time.monotonic() - started) * 1000, dry_run_bytes=dry_run_bytes)
+            return results
+    
+    def _collections_from_results(self, results) -> List[Dict]:
+        """
+        Преобразует большой результат запроса коллекций в список словарей
+        
+        При наличии pyarrow результат читается пачками Arrow (через Storage Read API,
+        если он доступен, иначе через REST) и обрабатывается по колонкам;
+        без pyarrow - построчно.
+        """
+        if pa is None:
+            return [self._row_to_collection(row) for row in results]
+        
+        if hasattr(results, 'to_arrow_iterable'):
+            batches = results.to_arrow_iterable(bqstorage_client=self._bqstorage_client)
+        else:
+            batches = results.to_arrow(bqstorage_client=self._bqstorage_client).to_batches()
+        
+        collections = []
+        for batch in batches:
+            collections.extend(collections_from_arrow(batch))
+        return collections
+    
+    @staticmethod
+    def _row_to_collection(row) -> Dict:
+        """Преобразует строку результата запроса в словарь коллекции"""
+        # Определяем статус по названию коллекции
+        collection_name = row.collection_name or ''
+        # Если в названии есть "TSUM Collection Panel", считаем статус "tsum cs"
+        collection_status = 'tsum cs' if 'TSUM Collection Panel' in collection_name else ''
+        
+        return {
+            'collection_id': row.collection_id,
+            'collection_name': row.collection_name,
+            'company_id': row.company_id,
+            'status': collection_status,
+            'created_at': str(row.created_at) if row.created_at else None,
+            'updated_at': str(row.updated_at) if row.updated_at else None,
+        }
+    
     def get_collections_with_status(self, status: str = 'tsum cs') -> List[Dict]:
         """
         Получает список коллекций с указанным статусом
@@ -143,6 +492,9 @@ class BigQueryClient:
         
         Returns:
             Список словарей с информацией о коллекциях
+        
+        Raises:
+            BigQueryError: Ошибка запроса (пустой список означает, что коллекций действительно нет)
         """
         from config.settings import BIGQUERY_TABLE_COLLECTIONS
         
@@ -161,31 +513,167 @@ class BigQueryClient:
         """
         
         try:
-            query_job = self.client.query(query)
-            results = query_job.result()
+            results = self._run_query(query, label='get_collections_with_status')
             
-            collections = []
-            for row in results:
-                # Определяем статус по названию коллекции
-                collection_name = row.collection_name or ''
-                # Если в названии есть "TSUM Collection Panel", считаем статус "tsum cs"
-                collection_status = 'tsum cs' if 'TSUM Collection Panel' in collection_name else ''
-                
-                collections.append({
-                    'collection_id': row.collection_id,
-                    'collection_name': row.collection_name,
-                    'company_id': row.company_id,
-                    'status': collection_status,
-                    'created_at': str(row.created_at) if row.created_at else None,
-                    'updated_at': str(row.updated_at) if row.updated_at else None,
-                })
+            collections = self._collections_from_results(results)
             
             logger.info(f"Found {len(collections)} collections with status '{status}'")
             return collections
             
-        except Exception as e:
+        except BigQueryError as e:
             logger.error(f"Error getting collections: {e}")
+            raise
+    
+    def get_collections_changed_since(self, since: datetime, company_ids: Optional[List[str]] = None) -> List[Dict]:
+        """
+        Получает коллекции компаний, созданные или измененные начиная с указанного момента
+        
+        Фильтр по названию не применяется: так видны и коллекции, которые перестали
+        подходить под правило клиента (их нужно убрать из кэша статусов).
+        
+        Args:
+            since: Нижняя граница COALESCE(updated_at, created_at) (включительно)
+            company_ids: ID компаний (None - коллекции всех компаний)
+        
+        Returns:
+            Список словарей с информацией о коллекциях
+        
+        Raises:
+            BigQueryError: Ошибка запроса
+        """
+        from config.settings import BIGQUERY_TABLE_COLLECTIONS
+        
+        company_filter = "AND company_id IN UNNEST(@company_ids)" if company_ids else ""
+        query = f"""
+        SELECT 
+            collection_id,
+            collection_name,
+            company_id,
+            created_at,
+            updated_at
+        FROM `{BIGQUERY_TABLE_COLLECTIONS}`
+        WHERE COALESCE(updated_at, created_at) >= @since
+        {company_filter}
+        ORDER BY created_at DESC
+        """
+        
+        try:
+            query_parameters = [bigquery.ScalarQueryParameter("since", "TIMESTAMP", since)]
+            if company_ids:
+                query_parameters.append(bigquery.ArrayQueryParameter("company_ids", "STRING", list(company_ids)))
+            job_config = bigquery.QueryJobConfig(query_parameters=query_parameters)
+            
+            results = self._run_query(query, job_config, label='get_collections_changed_since')
+            
+            collections = [self._row_to_collection(row) for row in results]
+            
+            logger.info(f"Found {len(collections)} collections changed since {since.isoformat()}")
+            return collections
+            
+        except BigQueryError as e:
+            logger.error(f"Error getting changed collections: {e}")
+            raise
+    
+    def get_collections_fingerprint(self, since: datetime,
+                                    company_ids: Optional[List[str]] = None) -> Tuple[int, int]:
+        """
+        Отпечаток набора строк, который вернул бы get_collections_changed_since
+        
+        Считается на стороне BigQuery: BIT_XOR(FARM_FINGERPRINT(...)) по паре
+        (collection_id, COALESCE(updated_at, created_at)) и количество строк. В ответе
+        одна строка, поэтому, если отпечаток совпал с прошлым опросом, сами строки
+        можно не выгружать и не обрабатывать.
+        
+        Returns:
+            (количество строк, отпечаток; 0 для пустого набора)
+        
+        Raises:
+            BigQueryError: Ошибка запроса
+        """
+        from config.settings import BIGQUERY_TABLE_COLLECTIONS
+        
+        company_filter = "AND company_id IN UNNEST(@company_ids)" if company_ids else ""
+        query = f"""
+        SELECT
+            COUNT(*) AS row_count,
+            BIT_XOR(FARM_FINGERPRINT(CONCAT(
+                CAST(collection_id AS STRING), '|',
+                CAST(COALESCE(updated_at, created_at) AS STRING)
+            ))) AS fingerprint
+        FROM `{BIGQUERY_TABLE_COLLECTIONS}`
+        WHERE COALESCE(updated_at, created_at) >= @since
+        {company_filter}
+        """
+        
+        try:
+            query_parameters = [bigquery.ScalarQueryParameter("since", "TIMESTAMP", since)]
+            if company_ids:
+                query_parameters.append(bigquery.ArrayQueryParameter("company_ids", "STRING", list(company_ids)))
+            job_config = bigquery.QueryJobConfig(query_parameters=query_parameters)
+            
+            results = self._run_query(query, job_config, label='get_collections_fingerprint')
+            row = next(iter(results))
+            return row.row_count, row.fingerprint or 0
+            
+        except BigQueryError as e:
+            logger.error(f"Error getting collections fingerprint: {e}")
+            raise
+    
+    def get_collections_for_tenants(self, tenants: List[TenantRule]) -> List[Dict]:
+        """
+        Получает коллекции, подходящие под правило хотя бы одного клиента, одним запросом
+        
+        Стоимость опроса не зависит от числа клиентов: все правила объединяются
+        через OR в одном сканировании таблицы. Какому клиенту принадлежит коллекция,
+        определяет вызывающий код (match_tenant).
+        
+        Args:
+            tenants: Правила клиентов
+        
+        Returns:
+            Список словарей с информацией о коллекциях
+        
+        Raises:
+            BigQueryError: Ошибка запроса
+        """
+        from config.settings import BIGQUERY_TABLE_COLLECTIONS
+        
+        if not tenants:
             return []
+        
+        conditions = []
+        query_parameters = []
+        for i, tenant in enumerate(tenants):
+            conditions.append(f"(company_id = @company_{i} AND STRPOS(collection_name, @pattern_{i}) > 0)")
+            query_parameters += [
+                bigquery.ScalarQueryParameter(f"company_{i}", "STRING", tenant.company_id),
+                bigquery.ScalarQueryParameter(f"pattern_{i}", "STRING", tenant.name_pattern),
+            ]
+        
+        query = f"""
+        SELECT 
+            collection_id,
+            collection_name,
+            company_id,
+            created_at,
+            updated_at
+        FROM `{BIGQUERY_TABLE_COLLECTIONS}`
+        WHERE {' OR '.join(conditions)}
+        ORDER BY created_at DESC
+        """
+        
+        try:
+            job_config = bigquery.QueryJobConfig(query_parameters=query_parameters)
+            results = self._run_query(query, job_config, label='get_collections_for_tenants')
+            
+            collections = self._collections_from_results(results)
+            
+            logger.info(f"Found {len(collections)} collections for {len(tenants)} tenants")
+            return collections
+            
+        except BigQueryError as e:
+            logger.error(f"Error getting tenant collections: {e}")
+            raise
     
     def get_all_collections(self) -> List[Dict]:
         """
@@ -193,6 +681,9 @@ class BigQueryClient:
         
         Returns:
             Список словарей с информацией о коллекциях
+        
+        Raises:
+            BigQueryError: Ошибка запроса
         """
         from config.settings import BIGQUERY_TABLE_COLLECTIONS
         
@@ -208,83 +699,332 @@ class BigQueryClient:
         """
         
         try:
-            query_job = self.client.query(query)
-            results = query_job.result()
+            results = self._run_query(query, label='get_all_collections')
             
-            collections = []
-            for row in results:
-                # Определяем статус по названию коллекции
-                collection_name = row.collection_name or ''
-                # Если в названии есть "TSUM Collection Panel", считаем статус "tsum cs"
-                collection_status = 'tsum cs' if 'TSUM Collection Panel' in collection_name else ''
-                
-                collections.append({
-                    'collection_id': row.collection_id,
-                    'collection_name': row.collection_name,
-                    'company_id': row.company_id,
-                    'status': collection_status,
-                    'created_at': str(row.created_at) if row.created_at else None,
-                    'updated_at': str(row.updated_at) if row.updated_at else None,
-                })
+            collections = self._collections_from_results(results)
             
             logger.info(f"Found {len(collections)} collections")
             return collections
             
-        except Exception as e:
+        except BigQueryError as e:
             logger.error(f"Error getting all collections: {e}")
-            return []
+            raise
     
-    def get_collection_by_id(self, collection_id: str) -> Optional[Dict]:
+    @staticmethod
+    def _collections_filter(collection_filter: CollectionFilter) -> tuple:
         """
-        Получает информацию о коллекции по ID
+        Возвращает условия WHERE и параметры запроса для фильтра списка коллекций
+        
+        Все значения передаются параметрами запроса; фильтрация выполняется в BigQuery,
+        и в ответ приходят только нужные строки.
         
         Args:
-            collection_id: ID коллекции
+            collection_filter: Фильтр списка
+        
+        Returns:
+            Кортеж (список условий SQL, список параметров запроса)
+        """
+        conditions, params = [], []
+        if collection_filter.status == 'tsum cs':
+            conditions += ["company_id = 'tsum_cs'", "collection_name LIKE '%TSUM Collection Panel%'"]
+        if collection_filter.company_id:
+            conditions.append("company_id = @company_id")
+            params.append(bigquery.ScalarQueryParameter("company_id", "STRING", collection_filter.company_id))
+        if collection_filter.name_contains:
+            conditions.append("STRPOS(LOWER(collection_name), @name_contains) > 0")
+            params.append(bigquery.ScalarQueryParameter("name_contains", "STRING",
+                                                        collection_filter.name_contains.lower()))
+        if collection_filter.name_prefix:
+            conditions.append("STARTS_WITH(LOWER(collection_name), @name_prefix)")
+            params.append(bigquery.ScalarQueryParameter("name_prefix", "STRING",
+                                                        collection_filter.name_prefix.lower()))
+        for i, (column, operator, moment) in enumerate(collection_filter.date_bounds()):
+            conditions.append(f"{column} {operator} @date_bound_{i}")
+            params.append(bigquery.ScalarQueryParameter(f"date_bound_{i}", "TIMESTAMP", moment))
+        return conditions, params
+    
+    def count_collections(self, collection_filter: CollectionFilter = CollectionFilter()) -> int:
+        """
+        Возвращает количество коллекций для фильтра (с кэшированием на COLLECTIONS_COUNT_TTL)
+        
+        Args:
+            collection_filter: Фильтр списка (по умолчанию все коллекции)
+        
+        Returns:
+            Количество коллекций (при ошибке - последнее известное)
+        
+        Raises:
+            BigQueryError: Ошибка запроса, а известного количества нет
+        """
+        from config.settings import BIGQUERY_TABLE_COLLECTIONS, COLLECTIONS_COUNT_TTL
+        
+        with self._pagination_lock:
+            cached = self._count_cache.get(collection_filter)
+        if cached and time.monotonic() - cached[1] < COLLECTIONS_COUNT_TTL:
+            return cached[0]
+        
+        conditions, params = self._collections_filter(collection_filter)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        query = f"""
+        SELECT COUNT(*) AS total
+        FROM `{BIGQUERY_TABLE_COLLECTIONS}`
+        {where}
+        """
+        
+        try:
+            job_config = bigquery.QueryJobConfig(query_parameters=params)
+            results = self._run_query(query, job_config, label='count_collections')
+            total = next(iter(results)).total
+            
+            with self._pagination_lock:
+                now = time.monotonic()
+                # Произвольных фильтров (поиск) может быть много - устаревшие записи
+                # и курсоры их страниц выбрасываем
+                for stale in [f for f, (_, loaded_at) in self._count_cache.items()
+                              if now - loaded_at >= COLLECTIONS_COUNT_TTL]:
+                    del self._count_cache[stale]
+                    for cursor_key in [k for k in self._page_cursors if k[0] == stale]:
+                        del self._page_cursors[cursor_key]
+                self._count_cache[collection_filter] = (total, now)
+            return total
+            
+        except BigQueryError as e:
+            logger.error(f"Error counting collections: {e}")
+            # Лучше показать устаревшее количество, чем пустой список
+            if cached:
+                return cached[0]
+            raise
+    
+    def get_collections_page(self, collection_filter: CollectionFilter = CollectionFilter(), page: int = 0,
+                             page_size: int = 12) -> List[Dict]:
+        """
+        Получает одну страницу списка коллекций (новые сначала)
+        
+        Страница выбирается по ключу (created_at, collection_id) последней строки
+        предыдущей страницы с LIMIT, поэтому запрос возвращает только page_size строк.
+        Если курсор предыдущей страницы неизвестен (переход сразу на далекую страницу),
+        используется OFFSET.
+        
+        Args:
+            collection_filter: Фильтр списка (по умолчанию все коллекции)
+            page: Номер страницы (с нуля)
+            page_size: Количество коллекций на странице
         
         Returns:
-            Словарь с информацией о коллекции или None
+            Список словарей с информацией о коллекциях
+        
+        Raises:
+            BigQueryError: Ошибка запроса
         """
         from config.settings import BIGQUERY_TABLE_COLLECTIONS
         
+        cursor_key = (collection_filter, page_size)
+        with self._pagination_lock:
+            cursor = self._page_cursors.get(cursor_key, {}).get(page - 1) if page > 0 else None
+        
+        conditions, params = self._collections_filter(collection_filter)
+        params = list(params) + [bigquery.ScalarQueryParameter("page_size", "INT64", page_size)]
+        offset_clause = ""
+        
+        # NULL в created_at приравниваем к началу эпохи, чтобы ключ сортировки был полным
+        sort_key = "IFNULL(created_at, TIMESTAMP_MICROS(0))"
+        if cursor:
+            conditions.append(
+                f"({sort_key} < @cursor_created_at "
+                f"OR ({sort_key} = @cursor_created_at AND collection_id < @cursor_id))"
+            )
+            params += [
+                bigquery.ScalarQueryParameter("cursor_created_at", "TIMESTAMP", cursor[0]),
+                bigquery.ScalarQueryParameter("cursor_id", "STRING", cursor[1]),
+            ]
+        elif page > 0:
+            offset_clause = "OFFSET @offset"
+            params.append(bigquery.ScalarQueryParameter("offset", "INT64", page * page_size))
+        
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
         query = f"""
         SELECT 
             collection_id,
             collection_name,
             company_id,
             created_at,
-            updated_at
+            updated_at,
+            {sort_key} AS sort_created_at
         FROM `{BIGQUERY_TABLE_COLLECTIONS}`
-        WHERE collection_id = @collection_id
-        LIMIT 1
+        {where}
+        ORDER BY sort_created_at DESC, collection_id DESC
+        LIMIT @page_size {offset_clause}
         """
         
         try:
-            job_config = bigquery.QueryJobConfig(
-                query_parameters=[
-                    bigquery.ScalarQueryParameter("collection_id", "STRING", collection_id)
-                ]
-            )
+            job_config = bigquery.QueryJobConfig(query_parameters=params)
+            rows = list(self._run_query(query, job_config, label='get_collections_page'))
             
-            query_job = self.client.query(query, job_config=job_config)
-            results = query_job.result()
+            if rows:
+                last = rows[-1]
+                with self._pagination_lock:
+                    self._page_cursors.setdefault(cursor_key, {})[page] = (last.sort_created_at, last.collection_id)
             
-            for row in results:
-                # Определяем статус по названию коллекции
-                collection_name = row.collection_name or ''
-                status = 'tsum cs' if 'tsum' in collection_name.lower() and 'cs' in collection_name.lower() else ''
-                
-                return {
-                    'collection_id': row.collection_id,
-                    'collection_name': row.collection_name,
-                    'company_id': row.company_id,
-                    'status': status,
-                    'created_at': str(row.created_at) if row.created_at else None,
-                    'updated_at': str(row.updated_at) if row.updated_at else None,
-                }
+            collections = [self._row_to_collection(row) for row in rows]
+            logger.info(f"Loaded page {page} of collections ({len(collections)} rows, "
+                        f"{'keyset' if cursor else 'offset' if page else 'first page'})")
+            return collections
             
-            return None
+        except BigQueryError as e:
+            logger.error(f"Error getting collections page: {e}")
+            raise
+    
+    def invalidate_collections_cache(self):
+        """Сбрасывает кэш количества коллекций и курсоры пагинации (кнопка "Обновить")"""
+        with self._pagination_lock:
+            self._count_cache.clear()
+            self._page_cursors.clear()
+    
+    def get_collections_by_ids(self, collection_ids: List[str]) -> Dict[str, Dict]:
+        """
+        Получает информацию о нескольких коллекциях одним запросом
+        
+        Args:
+            collection_ids: Список ID коллекций
+        
+        Returns:
+            Словарь {collection_id: информация о коллекции} (ненайденных ID в нем нет)
+        
+        Raises:
+            BigQueryError: Ошибка запроса к BigQuery
+        """
+        from config.settings import BIGQUERY_TABLE_COLLECTIONS
+        
+        collection_ids = list(dict.fromkeys(collection_ids))
+        if not collection_ids:
+            return {}
+        
+        query = f"""
+        SELECT 
+            collection_id,
+            collection_name,
+            company_id,
+            created_at,
+            updated_at
+        FROM `{BIGQUERY_TABLE_COLLECTIONS}`
+        WHERE collection_id IN UNNEST(@collection_ids)
+        """
+        
+        job_config = bigquery.QueryJobConfig(
+            query_parameters=[
+                bigquery.ArrayQueryParameter("collection_ids", "STRING", collection_ids)
+            ]
+        )
+        
+        results = self._run_query(query, job_config, label='get_collections_by_ids')
+        
+        collections = {}
+        for row in results:
+            # Определяем статус по названию коллекции
+            collection_name = row.collection_name or ''
+            status = 'tsum cs' if 'tsum' in collection_name.lower() and 'cs' in collection_name.lower() else ''
             
-        except Exception as e:
-            logger.error(f"Error getting collection by ID: {e}")
-            return None
+            collections[row.collection_id] = {
+                'collection_id': row.collection_id,
+                'collection_name': row.collection_name,
+                'company_id': row.company_id,
+                'status': status,
+                'created_at': str(row.created_at) if row.created_at else None,
+                'updated_at': str(row.updated_at) if row.updated_at else None,
+            }
+        
+        logger.info(f"Looked up {len(collection_ids)} collections by ID, found {len(collections)}")
+        return collections
+    
+    def get_collection_by_id(self, collection_id: str) -> Optional[Dict]:
+        """
+        Получает информацию о коллекции по ID
+        
+        Args:
+            collection_id: ID коллекции
+        
+        Returns:
+            Словарь с информацией о коллекции или None (не найдена)
+        
+        Raises:
+            BigQueryError: Ошибка запроса к BigQuery
+        """
+        return self.get_collections_by_ids([collection_id]).get(collection_id)
+
+
+    def get_collection_stats(self, collection_ids: List[str]) -> Dict[str, Dict]:
+        """
+        Считает статистику отчета (done-айтемы и combo-айтемы) по таблицам айтемов и действий
+        
+        Один агрегирующий запрос на любое количество коллекций. Предполагаемая схема:
+        - BIGQUERY_TABLE_ACTIONS: collection_id, item_id, action (значение 'done' - айтем сделан);
+        - BIGQUERY_TABLE_ITEMS: collection_id, item_id, is_combo (BOOL - combo-айтем).
+        
+        Args:
+            collection_ids: Список ID коллекций
+        
+        Returns:
+            Словарь {collection_id: {'total_done': int, 'combo_items': int}};
+            коллекций без done-действий в нем нет
+        
+        Raises:
+            BigQueryError: Ошибка запроса к BigQuery
+        """
+        from config.settings import BIGQUERY_TABLE_ITEMS, BIGQUERY_TABLE_ACTIONS
+        
+        collection_ids = list(dict.fromkeys(collection_ids))
+        if not collection_ids:
+            return {}
+        
+        query = f"""
+        WITH done_items AS (
+            SELECT DISTINCT collection_id, item_id
+            FROM `{BIGQUERY_TABLE_ACTIONS}`
+            WHERE collection_id IN UNNEST(@collection_ids)
+            AND LOWER(action) = 'done'
+        )
+        SELECT 
+            d.collection_id,
+            COUNT(*) AS total_done,
+            COUNTIF(IFNULL(i.is_combo, FALSE)) AS combo_items
+        FROM done_items d
+        LEFT JOIN `{BIGQUERY_TABLE_ITEMS}` i
+            ON i.collection_id = d.collection_id AND i.item_id = d.item_id
+        GROUP BY d.collection_id
+        """
+        
+        job_config = bigquery.QueryJobConfig(
+            query_parameters=[
+                bigquery.ArrayQueryParameter("collection_ids", "STRING", collection_ids)
+            ]
+        )
+        
+        results = self._run_query(query, job_config, label='get_collection_stats')
+        
+        stats = {
+            row.collection_id: {'total_done': row.total_done, 'combo_items': row.combo_items}
+            for row in results
+        }
+        
+        logger.info(f"Computed report stats for {len(stats)} of {len(collection_ids)} collections")
+        return stats
 
+
+_shared_client: Optional[BigQueryClient] = None
+_shared_client_lock = threading.Lock()
+
+
+def get_bq_client() -> BigQueryClient:
+    """
+    Возвращает общий для процесса клиент BigQuery (создается при первом обращении)
+    
+    Клиент держит одну авторизованную HTTP-сессию: соединения переиспользуются,
+    а токен доступа обновляется автоматически по мере истечения.
+    """
+    global _shared_client
+    if _shared_client is None:
+        with _shared_client_lock:
+            if _shared_client is None:
+                from config.settings import GOOGLE_APPLICATION_CREDENTIALS_JSON, BIGQUERY_PROJECT_ID
+                _shared_client = BigQueryClient(GOOGLE_APPLICATION_CREDENTIALS_JSON, BIGQUERY_PROJECT_ID)
+    return _shared_client
@@ -0,0 +1,106 @@
+import json
+import time
+import logging
+import threading
+from pathlib import Path
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class BigQueryMetricsSink:
+    """
+    Сбор метрик запросов BigQuery
+
+    Каждый запрос записывается строкой JSON в файл (для анализа стоимости и задержек)
+    и учитывается в сводке по меткам запросов, которую можно вывести в лог.
+    """
+
+    def __init__(self, metrics_file: Optional[Path] = None):
+        """
+        Args:
+            metrics_file: Файл JSON Lines для записей (None - только сводка в памяти)
+        """
+        self.metrics_file = Path(metrics_file) if metrics_file else None
+        self._lock = threading.Lock()
+        # Сводка: {метка: {'queries', 'errors', 'bytes_processed', 'bytes_billed', 'cache_hits', 'slot_ms', 'wall_ms'}}
+        self._summary: Dict[str, Dict[str, float]] = {}
+
+    def record(self, label: str, job=None, wall_ms: float = 0.0, error: Optional[str] = None,
+               dry_run_bytes: Optional[int] = None):
+        """
+        Записывает метрики одного запроса
+
+        Args:
+            label: Метка запроса (обычно имя метода BigQueryClient)
+            job: Задание BigQuery (QueryJob) после завершения
+            wall_ms: Время от запуска до получения результата (в мс)
+            error: Текст ошибки, если запрос не удался
+            dry_run_bytes: Оценка объема из пробного запуска (если он выполнялся)
+        """
+        entry = {
+            'ts': time.time(),
+            'label': label,
+            'job_id': getattr(job, 'job_id', None),
+            'bytes_processed': getattr(job, 'total_bytes_processed', None),
+            'bytes_billed': getattr(job, 'total_bytes_billed', None),
+            'cache_hit': getattr(job, 'cache_hit', None),
+            'slot_ms': getattr(job, 'slot_millis', None),
+            'wall_ms': round(wall_ms, 1),
+            'dry_run_bytes': dry_run_bytes,
+            'error': error,
+        }
+
+        with self._lock:
+            stats = self._summary.setdefault(label, {
+                'queries': 0, 'errors': 0, 'bytes_processed': 0, 'bytes_billed': 0,
+                'cache_hits': 0, 'slot_ms': 0, 'wall_ms': 0.0,
+            })
+            stats['queries'] += 1
+            stats['errors'] += 1 if error else 0
+            stats['bytes_processed'] += entry['bytes_processed'] or 0
+            stats['bytes_billed'] += entry['bytes_billed'] or 0
+            stats['cache_hits'] += 1 if entry['cache_hit'] else 0
+            stats['slot_ms'] += entry['slot_ms'] or 0
+            stats['wall_ms'] += entry['wall_ms']
+
+            if self.metrics_file:
+                try:
+                    with open(self.metrics_file, 'a', encoding='utf-8') as f:
+                        f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+                except Exception as e:
+                    logger.debug(f"Could not write BigQuery metrics: {e}")
+
+        logger.debug(f"BigQuery {label}: {entry['bytes_processed']} bytes processed, "
+                     f"{entry['bytes_billed']} billed, cache_hit={entry['cache_hit']}, "
+                     f"{entry['slot_ms']} slot-ms, {entry['wall_ms']} ms")
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """Сводка метрик по меткам запросов с момента запуска"""
+        with self._lock:
+            return {label: dict(stats) for label, stats in self._summary.items()}
+
+    def log_summary(self):
+        """Выводит сводку в лог"""
+        for label, stats in sorted(self.summary().items()):
+            queries = stats['queries'] or 1
+            logger.info(
+                f"BigQuery {label}: {stats['queries']} queries ({stats['errors']} errors, "
+                f"{stats['cache_hits']} cache hits), {stats['bytes_billed'] / 1024 ** 2:.1f} MB billed, "
+                f"avg {stats['bytes_processed'] / queries / 1024 ** 2:.2f} MB processed, "
+                f"avg {stats['slot_ms'] / queries:.0f} slot-ms, avg {stats['wall_ms'] / queries:.0f} ms"
+            )
+
+
+_sink: Optional[BigQueryMetricsSink] = None
+_sink_lock = threading.Lock()
+
+
+def get_metrics_sink() -> BigQueryMetricsSink:
+    """Возвращает общий для процесса сборщик метрик BigQuery"""
+    global _sink
+    with _sink_lock:
+        if _sink is None:
+            from config.settings import BQ_METRICS_FILE
+            _sink = BigQueryMetricsSink(BQ_METRICS_FILE)
+        return _sink
@@ -0,0 +1,188 @@
+import time
+import random
+import logging
+import threading
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+try:
+    from google.api_core import exceptions as api_exceptions
+except ImportError:
+    api_exceptions = None
+
+try:
+    from google.auth.exceptions import TransportError as AuthTransportError
+except ImportError:
+    AuthTransportError = None
+
+try:
+    import requests
+except ImportError:
+    requests = None
+
+
+class BigQueryError(Exception):
+    """Ошибка запроса к BigQuery"""
+
+
+class BigQueryTransientError(BigQueryError):
+    """Временная ошибка BigQuery (сеть, 5xx, превышение лимитов) - запрос можно повторить"""
+
+
+class BigQueryTimeoutError(BigQueryTransientError):
+    """Запрос не уложился в отведенное время"""
+
+
+class BigQueryUnavailableError(BigQueryError):
+    """BigQuery временно не опрашивается: circuit breaker разомкнут после серии ошибок"""
+
+
+def _transient_types() -> tuple:
+    types = [FutureTimeoutError, TimeoutError, ConnectionError]
+    if api_exceptions is not None:
+        types += [
+            api_exceptions.InternalServerError,
+            api_exceptions.BadGateway,
+            api_exceptions.ServiceUnavailable,
+            api_exceptions.GatewayTimeout,
+            api_exceptions.TooManyRequests,
+            api_exceptions.DeadlineExceeded,
+        ]
+    if AuthTransportError is not None:
+        types.append(AuthTransportError)
+    if requests is not None:
+        types += [requests.exceptions.ConnectionError, requests.exceptions.Timeout]
+    return tuple(types)
+
+
+_TRANSIENT_TYPES = _transient_types()
+# Причины ошибок 4xx в BigQuery, которые на самом деле временные
+_TRANSIENT_REASONS = ('rateLimitExceeded', 'backendError', 'internalError', 'jobBackendError')
+
+
+def classify_error(error: Exception) -> BigQueryError:
+    """
+    Преобразует исключение клиента BigQuery в типизированную ошибку
+
+    Returns:
+        BigQueryTimeoutError, BigQueryTransientError или BigQueryError (постоянная ошибка)
+    """
+    if isinstance(error, BigQueryError):
+        return error
+    if isinstance(error, (FutureTimeoutError, TimeoutError)):
+        return BigQueryTimeoutError(str(error) or "BigQuery query timed out")
+    if isinstance(error, _TRANSIENT_TYPES):
+        return BigQueryTransientError(str(error))
+    if any(reason in str(error) for reason in _TRANSIENT_REASONS):
+        return BigQueryTransientError(str(error))
+    return BigQueryError(str(error))
+
+
+class RetryPolicy:
+    """Ограниченные повторы с экспоненциальной задержкой и случайным разбросом (full jitter)"""
+
+    def __init__(self, attempts: int = 3, base_delay: float = 1.0, max_delay: float = 10.0):
+        """
+        Args:
+            attempts: Максимум попыток (включая первую)
+            base_delay: Базовая задержка перед повтором (в секундах)
+            max_delay: Максимальная задержка (в секундах)
+        """
+        self.attempts = max(1, attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt: int) -> float:
+        """Задержка перед повтором после попытки с номером attempt (с нуля)"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker для BigQuery
+
+    После failure_threshold временных ошибок подряд размыкается, и запросы сразу
+    получают BigQueryUnavailableError, не нагружая упавший backend. Через
+    reset_timeout секунд пропускается один пробный запрос: успех замыкает цепь,
+    ошибка снова размыкает ее.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 60.0):
+        """
+        Args:
+            failure_threshold: Сколько ошибок подряд размыкают цепь
+            reset_timeout: Через сколько секунд пробовать снова (в секундах)
+        """
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def retry_after(self) -> float:
+        """Через сколько секунд цепь пропустит пробный запрос (0 - уже пропускает)"""
+        with self._lock:
+            if self.state != self.OPEN:
+                return 0.0
+            return max(0.0, self.opened_at + self.reset_timeout - time.monotonic())
+
+    def before_call(self):
+        """
+        Проверяет, можно ли выполнить запрос
+
+        Raises:
+            BigQueryUnavailableError: Цепь разомкнута
+        """
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    raise BigQueryUnavailableError("BigQuery circuit breaker is open")
+                self.state = self.HALF_OPEN
+                self._probe_in_flight = False
+                logger.info("BigQuery circuit breaker is half-open, probing")
+
+            if self.state == self.HALF_OPEN:
+                if self._probe_in_flight:
+                    raise BigQueryUnavailableError("BigQuery circuit breaker is half-open, probe in progress")
+                self._probe_in_flight = True
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                logger.info("BigQuery circuit breaker closed")
+            self.state = self.CLOSED
+            self.failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probe_in_flight = False
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logger.error(f"BigQuery circuit breaker opened after {self.failures} failures, "
+                                 f"pausing queries for {self.reset_timeout:.0f}s")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+
+_breaker: Optional[CircuitBreaker] = None
+_breaker_lock = threading.Lock()
+
+
+def get_circuit_breaker() -> CircuitBreaker:
+    """Возвращает общий для процесса circuit breaker BigQuery"""
+    global _breaker
+    with _breaker_lock:
+        if _breaker is None:
+            from config.settings import BQ_BREAKER_FAILURES, BQ_BREAKER_RESET_TIMEOUT
+            _breaker = CircuitBreaker(BQ_BREAKER_FAILURES, BQ_BREAKER_RESET_TIMEOUT)
+        return _breaker
@@ -0,0 +1,141 @@
+import re
+from datetime import date, datetime, time, timedelta, timezone
+from typing import List, NamedTuple, Optional, Tuple
+
+# Ключи аргументов /collections и их синонимы
+_KEYS = {
+    'company': 'company_id',
+    'name': 'name_contains',
+    'prefix': 'name_prefix',
+    'created': 'created',
+    'updated': 'updated',
+    'status': 'status',
+}
+
+_DATE_FORMATS = ('%Y-%m-%d', '%d.%m.%Y')
+
+
+class CollectionFilter(NamedTuple):
+    """
+    Фильтр списка коллекций (неизменяемый - используется как ключ кэшей)
+
+    Даты - границы включительно, по UTC. Поиск по названию не зависит от регистра.
+    """
+    status: Optional[str] = None
+    company_id: Optional[str] = None
+    name_contains: Optional[str] = None
+    name_prefix: Optional[str] = None
+    created_from: Optional[date] = None
+    created_to: Optional[date] = None
+    updated_from: Optional[date] = None
+    updated_to: Optional[date] = None
+
+    @classmethod
+    def from_status(cls, filter_status: Optional[str]) -> 'CollectionFilter':
+        """Фильтр по статусу: 'tsum cs' или None (все коллекции)"""
+        return cls(status=filter_status or None)
+
+    @property
+    def is_status_only(self) -> bool:
+        """Фильтр задан только статусом (его можно передать в callback_data одним словом)"""
+        return self._replace(status=None) == CollectionFilter()
+
+    def date_bounds(self) -> List[Tuple[str, str, datetime]]:
+        """
+        Границы дат в виде условий
+
+        Returns:
+            Список (колонка, оператор, момент UTC); верхняя граница - начало следующего дня
+        """
+        bounds = []
+        for column, start, end in (('created_at', self.created_from, self.created_to),
+                                   ('updated_at', self.updated_from, self.updated_to)):
+            if start:
+                bounds.append((column, '>=', datetime.combine(start, time.min, tzinfo=timezone.utc)))
+            if end:
+                bounds.append((column, '<', datetime.combine(end + timedelta(days=1), time.min, tzinfo=timezone.utc)))
+        return bounds
+
+    def describe(self) -> str:
+        """Описание фильтра для сообщения со списком"""
+        parts = []
+        if self.status:
+            parts.append(f"статус '{self.status}'")
+        if self.company_id:
+            parts.append(f"компания {self.company_id}")
+        if self.name_contains:
+            parts.append(f"название содержит «{self.name_contains}»")
+        if self.name_prefix:
+            parts.append(f"название начинается с «{self.name_prefix}»")
+        for label, start, end in (('создана', self.created_from, self.created_to),
+                                  ('изменена', self.updated_from, self.updated_to)):
+            if start or end:
+                parts.append(f"{label} {start.isoformat() if start else '…'} – {end.isoformat() if end else '…'}")
+        return ', '.join(parts) or 'все коллекции'
+
+
+def _parse_date(value: str) -> Optional[date]:
+    if not value:
+        return None
+    for fmt in _DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).date()
+        except ValueError:
+            continue
+    raise ValueError(f"Неверная дата: {value} (ожидается ГГГГ-ММ-ДД или ДД.ММ.ГГГГ)")
+
+
+def _parse_range(value: str) -> Tuple[Optional[date], Optional[date]]:
+    """'2025-01-01..2025-01-31', '2025-01-01..' , '..2025-01-31' или одна дата (один день)"""
+    if '..' in value:
+        start, _, end = value.partition('..')
+        return _parse_date(start.strip()), _parse_date(end.strip())
+    day = _parse_date(value)
+    return day, day
+
+
+def parse_collection_filter(args: List[str], base: Optional[CollectionFilter] = None) -> CollectionFilter:
+    """
+    Разбирает аргументы команды /collections
+
+    Формат: ключ=значение через пробел, слова без ключа ищутся в названии.
+        company=tsum_cs name=panel prefix=TSUM created=2025-01-01..2025-01-31 updated=2025-02-01..
+        status=tsum (только 'tsum cs')
+
+    Args:
+        args: Аргументы команды (context.args)
+        base: Исходный фильтр (например, статус для /collections_tsum)
+
+    Raises:
+        ValueError: Неизвестный ключ или неверное значение (текст можно показать пользователю)
+    """
+    collection_filter = base or CollectionFilter()
+    words = []
+    for arg in args:
+        key, sep, value = arg.partition('=')
+        if not sep:
+            words.append(arg)
+            continue
+        field = _KEYS.get(key.strip().lower())
+        value = value.strip()
+        if field is None:
+            raise ValueError(f"Неизвестный параметр: {key}")
+        if not value:
+            raise ValueError(f"Пустое значение параметра: {key}")
+
+        if field == 'created':
+            start, end = _parse_range(value)
+            collection_filter = collection_filter._replace(created_from=start, created_to=end)
+        elif field == 'updated':
+            start, end = _parse_range(value)
+            collection_filter = collection_filter._replace(updated_from=start, updated_to=end)
+        elif field == 'status':
+            if not re.fullmatch(r'tsum(\s*cs)?', value.lower()):
+                raise ValueError("Поддерживается только status=tsum")
+            collection_filter = collection_filter._replace(status='tsum cs')
+        else:
+            collection_filter = collection_filter._replace(**{field: value})
+
+    if words:
+        collection_filter = collection_filter._replace(name_contains=' '.join(words))
+    return collection_filter
@@ -0,0 +1,166 @@
+import asyncio
+import time
+import logging
+from collections import OrderedDict
+from typing import Dict, List, Optional
+from services.bq_async import AsyncBigQueryClient, get_async_bq_client
+from services.collections_mirror import CollectionsMirror, get_collections_mirror
+
+logger = logging.getLogger(__name__)
+
+
+class CollectionLookupBatcher:
+    """
+    Пакетный поиск коллекций по ID
+
+    Запросы, пришедшие в пределах короткого окна, объединяются в один запрос
+    WHERE collection_id IN UNNEST(@ids) - накладные расходы задания BigQuery
+    (около секунды) платятся один раз на пакет, а не на каждую кнопку отчета.
+    Найденные коллекции кладутся в небольшой LRU-кэш.
+    """
+
+    def __init__(self, bq_client: AsyncBigQueryClient, window_ms: int = 50, max_batch: int = 100,
+                 cache_size: int = 256, cache_ttl: float = 60.0, mirror: Optional[CollectionsMirror] = None):
+        """
+        Args:
+            bq_client: Асинхронный клиент BigQuery
+            window_ms: Сколько мс собирать запросы перед отправкой пакета
+            max_batch: Максимум ID в одном запросе (при достижении пакет отправляется сразу)
+            cache_size: Размер LRU-кэша найденных коллекций
+            cache_ttl: Время жизни записи в кэше (в секундах)
+            mirror: Локальная копия таблицы коллекций (пока свежая, поиск сначала идет в нее)
+        """
+        self.bq_client = bq_client
+        self.window = window_ms / 1000.0
+        self.max_batch = max_batch
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self.mirror = mirror
+        # LRU: {collection_id: (коллекция, время загрузки)}
+        self._cache: OrderedDict = OrderedDict()
+        # Ожидающие отправки: {collection_id: future}
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+
+    def _cache_get(self, collection_id: str) -> Optional[Dict]:
+        entry = self._cache.get(collection_id)
+        if entry is None:
+            return None
+        collection, loaded_at = entry
+        if time.monotonic() - loaded_at >= self.cache_ttl:
+            del self._cache[collection_id]
+            return None
+        self._cache.move_to_end(collection_id)
+        return collection
+
+    def _cache_put(self, collection_id: str, collection: Dict):
+        self._cache[collection_id] = (collection, time.monotonic())
+        self._cache.move_to_end(collection_id)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def _schedule_flush(self):
+        """Планирует отправку пакета по окончании окна (или сразу, если пакет заполнен)"""
+        loop = asyncio.get_running_loop()
+        if len(self._pending) >= self.max_batch:
+            if self._flush_handle is not None:
+                self._flush_handle.cancel()
+                self._flush_handle = None
+            loop.create_task(self._flush())
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.window, lambda: loop.create_task(self._flush()))
+
+    async def _flush(self):
+        """Отправляет накопленный пакет одним запросом и раздает результаты ожидающим"""
+        self._flush_handle = None
+        pending, self._pending = self._pending, {}
+        if not pending:
+            return
+
+        try:
+            found = await self.bq_client.get_collections_by_ids(list(pending))
+        except Exception as e:
+            logger.error(f"Error looking up {len(pending)} collections by ID: {e}")
+            # Ошибку получает каждый ожидающий: "не найдена" и "BigQuery недоступен" различаются
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for collection_id, future in pending.items():
+            collection = found.get(collection_id)
+            if collection is not None:
+                self._cache_put(collection_id, collection)
+            if not future.done():
+                future.set_result(collection)
+
+    def _mirror_get(self, collection_id: str) -> Optional[Dict]:
+        """Коллекция из локальной копии (блокирующий вызов); None - нет в копии или копия устарела"""
+        if not self.mirror.is_fresh():
+            return None
+        return self.mirror.get_collections_by_ids([collection_id]).get(collection_id)
+
+    async def get(self, collection_id: str) -> Optional[Dict]:
+        """
+        Возвращает информацию о коллекции по ID
+
+        Returns:
+            Словарь с информацией о коллекции или None (не найдена)
+
+        Raises:
+            Exception: Ошибка запроса к BigQuery (общая для всего пакета)
+        """
+        collection = self._cache_get(collection_id)
+        if collection is not None:
+            return collection
+
+        # Сначала смотрим в свежую локальную копию (в потоке: SQLite может ждать блокировку
+        # файла); коллекцию, которой в ней еще нет (только что создана), ищем в BigQuery
+        if self.mirror is not None:
+            try:
+                collection = await asyncio.to_thread(self._mirror_get, collection_id)
+            except Exception as e:
+                logger.warning(f"Collections mirror read failed, using BigQuery: {e}")
+                collection = None
+            if collection is not None:
+                return collection
+
+        future = self._pending.get(collection_id)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self._pending[collection_id] = future
+            self._schedule_flush()
+        return await asyncio.shield(future)
+
+    async def get_many(self, collection_ids: List[str]) -> Dict[str, Dict]:
+        """
+        Возвращает информацию о нескольких коллекциях (через тот же пакет и кэш)
+
+        Returns:
+            Словарь {collection_id: информация о коллекции} (ненайденных ID в нем нет)
+
+        Raises:
+            Exception: Ошибка запроса к BigQuery
+        """
+        ids = list(dict.fromkeys(collection_ids))
+        results = await asyncio.gather(*(self.get(collection_id) for collection_id in ids))
+        return {collection_id: c for collection_id, c in zip(ids, results) if c is not None}
+
+
+_lookup: Optional[CollectionLookupBatcher] = None
+
+
+def get_collection_lookup() -> CollectionLookupBatcher:
+    """Возвращает общий для процесса пакетный поиск коллекций"""
+    global _lookup
+    if _lookup is None:
+        from config.settings import LOOKUP_BATCH_WINDOW_MS, LOOKUP_BATCH_SIZE, LOOKUP_CACHE_SIZE, LOOKUP_CACHE_TTL
+        _lookup = CollectionLookupBatcher(
+            get_async_bq_client(),
+            window_ms=LOOKUP_BATCH_WINDOW_MS,
+            max_batch=LOOKUP_BATCH_SIZE,
+            cache_size=LOOKUP_CACHE_SIZE,
+            cache_ttl=LOOKUP_CACHE_TTL,
+            mirror=get_collections_mirror(),
+        )
+    return _lookup
@@ -0,0 +1,352 @@
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from pathlib import Path
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+from services.bq_client import BigQueryClient, get_bq_client
+from services.collection_filters import CollectionFilter
+from services.tenants import TenantRule
+from services.status_tracker import parse_timestamp
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS collections (
+    collection_id TEXT PRIMARY KEY,
+    collection_name TEXT,
+    company_id TEXT,
+    created_at TEXT,
+    updated_at TEXT,
+    status TEXT NOT NULL DEFAULT '',
+    sort_created_at TEXT NOT NULL DEFAULT '',
+    changed_ts REAL NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_collections_sort ON collections (sort_created_at DESC, collection_id DESC);
+CREATE INDEX IF NOT EXISTS idx_collections_status ON collections (status, company_id, sort_created_at DESC, collection_id DESC);
+CREATE INDEX IF NOT EXISTS idx_collections_changed ON collections (company_id, changed_ts);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+_COLUMNS = "collection_id, collection_name, company_id, created_at, updated_at, status"
+
+
+class _XorFingerprint:
+    """Агрегат SQLite: XOR 64-битных хэшей строк (аналог BIT_XOR(FARM_FINGERPRINT(...)) в BigQuery)"""
+
+    def __init__(self):
+        self.value = 0
+
+    def step(self, *values):
+        digest = hashlib.blake2b('|'.join(str(value) for value in values).encode('utf-8'), digest_size=8).digest()
+        self.value ^= int.from_bytes(digest, 'big', signed=True)
+
+    def finalize(self):
+        return self.value
+
+
+class CollectionsMirror:
+    """
+    Локальная копия таблицы коллекций в SQLite (data/collections.db)
+
+    Фоновая синхронизация забирает из BigQuery только строки, измененные после
+    watermark, и периодически делает полную перезагрузку (чтобы заметить удаления).
+    Чтение из копии занимает микросекунды; если копия устарела (синхронизация давно
+    не проходила), вызывающий код должен обращаться к BigQuery напрямую (см. is_fresh).
+
+    Методы чтения повторяют сигнатуры BigQueryClient, поэтому копию можно
+    подставлять вместо клиента.
+
+    Файл открывают все экземпляры бота с общим каталогом data/ (пишет ведущий,
+    читают все), поэтому журнал SQLite обычный (rollback), а не WAL: WAL требует
+    общей памяти между процессами, которой у разных контейнеров может не быть.
+    Поэтому запись должна быть короткой: синхронизация готовит строки во временной
+    таблице (в памяти соединения, читателей не блокирует) и переносит их в копию одной
+    короткой транзакцией. Чтение и запись идут через разные соединения и блокировки,
+    чтение - блокирующее (асинхронный код вызывает его через asyncio.to_thread).
+    """
+
+    def __init__(self, db_path: Path, bq_client: Optional[BigQueryClient] = None,
+                 max_staleness: float = 300.0, full_sync_interval: float = 3600.0, overlap: float = 120.0):
+        """
+        Args:
+            db_path: Путь к файлу SQLite
+            bq_client: Клиент BigQuery (по умолчанию общий для процесса)
+            max_staleness: Через сколько секунд без успешной синхронизации копия считается устаревшей
+            full_sync_interval: Как часто делать полную перезагрузку (в секундах)
+            overlap: Перекрытие окна инкрементальной синхронизации (в секундах)
+        """
+        self.db_path = Path(db_path)
+        self.bq_client = bq_client or get_bq_client()
+        self.max_staleness = max_staleness
+        self.full_sync_interval = full_sync_interval
+        self.overlap = overlap
+        # Чтение (_conn) и синхронизация (_write_conn) не ждут друг друга в этом процессе
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._write_conn = sqlite3.connect(str(self.db_path), check_same_thread=False, timeout=30.0)
+        with self._write_lock:
+            self._write_conn.execute("PRAGMA journal_mode=DELETE")
+            # Временная таблица для подготовки строк синхронизации - в памяти, а не в общем файле
+            self._write_conn.execute("PRAGMA temp_store=MEMORY")
+            self._write_conn.executescript(_SCHEMA)
+            self._write_conn.commit()
+        # timeout: пока другой экземпляр переносит синхронизацию в копию, чтение ждет блокировку
+        # (транзакция короткая - см. sync)
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False, timeout=10.0)
+        self._conn.row_factory = sqlite3.Row
+        # Встроенный lower() SQLite понимает только латиницу, а названия бывают русскими
+        self._conn.create_function('py_lower', 1, lambda value: value.lower() if value else value, deterministic=True)
+        self._conn.create_aggregate('xor_fingerprint', 2, _XorFingerprint)
+        self.last_sync = self._get_meta_float('last_sync')
+        self.last_full_sync = self._get_meta_float('last_full_sync')
+
+    # --- служебное ---
+
+    def _get_meta_float(self, key: str) -> Optional[float]:
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        try:
+            return float(row['value']) if row else None
+        except (TypeError, ValueError):
+            return None
+
+    def _set_meta(self, key: str, value):
+        self._write_conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+    @staticmethod
+    def _to_db_row(collection: Dict) -> tuple:
+        changed_at = parse_timestamp(collection.get('updated_at') or collection.get('created_at'))
+        return (
+            collection['collection_id'],
+            collection.get('collection_name'),
+            collection.get('company_id'),
+            collection.get('created_at'),
+            collection.get('updated_at'),
+            collection.get('status', '') or '',
+            collection.get('created_at') or '',
+            changed_at.timestamp() if changed_at else 0.0,
+        )
+
+    @staticmethod
+    def _to_collection(row: sqlite3.Row) -> Dict:
+        return {
+            'collection_id': row['collection_id'],
+            'collection_name': row['collection_name'],
+            'company_id': row['company_id'],
+            'status': row['status'],
+            'created_at': row['created_at'],
+            'updated_at': row['updated_at'],
+        }
+
+    @staticmethod
+    def _filter_clause(collection_filter: CollectionFilter) -> tuple:
+        """Условие WHERE для фильтра списка (как в BigQueryClient._collections_filter)"""
+        conditions, params = [], []
+        if collection_filter.status == 'tsum cs':
+            conditions.append("status = 'tsum cs' AND company_id = 'tsum_cs'")
+        if collection_filter.company_id:
+            conditions.append("company_id = ?")
+            params.append(collection_filter.company_id)
+        if collection_filter.name_contains:
+            conditions.append("instr(py_lower(collection_name), ?) > 0")
+            params.append(collection_filter.name_contains.lower())
+        if collection_filter.name_prefix:
+            prefix = collection_filter.name_prefix.lower()
+            conditions.append("substr(py_lower(collection_name), 1, ?) = ?")
+            params += [len(prefix), prefix]
+        for column, operator, moment in collection_filter.date_bounds():
+            # Время хранится строкой str(datetime) в UTC - строки сравниваются в хронологическом порядке
+            conditions.append(f"{column} {operator} ?")
+            params.append(str(moment))
+        return (f"WHERE {' AND '.join(conditions)}" if conditions else ""), tuple(params)
+
+    def _query(self, sql: str, params: tuple = ()) -> List[sqlite3.Row]:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    # --- свежесть ---
+
+    def age_seconds(self) -> Optional[float]:
+        """Сколько секунд прошло с последней успешной синхронизации (None - еще не было)"""
+        if self.last_sync is None:
+            return None
+        return max(0.0, time.time() - self.last_sync)
+
+    def is_fresh(self) -> bool:
+        """Копия синхронизирована недавно и ей можно отвечать вместо BigQuery"""
+        age = self.age_seconds()
+        if age is None or age > self.max_staleness:
+            # Копию мог синхронизировать другой экземпляр бота (общий каталог data/)
+            self.last_sync = self._get_meta_float('last_sync') or self.last_sync
+            age = self.age_seconds()
+        return age is not None and age <= self.max_staleness
+
+    # --- синхронизация ---
+
+    def _watermark(self) -> Optional[datetime]:
+        with self._lock:
+            row = self._conn.execute("SELECT MAX(changed_ts) AS ts FROM collections").fetchone()
+        if not row or not row['ts']:
+            return None
+        return datetime.fromtimestamp(row['ts'], tz=timezone.utc)
+
+    def sync(self) -> int:
+        """
+        Синхронизирует копию с BigQuery (инкрементально или полностью)
+
+        Returns:
+            Количество загруженных строк
+
+        Raises:
+            BigQueryError: Ошибка запроса к BigQuery (копия при этом не меняется)
+        """
+        now = time.time()
+        watermark = self._watermark()
+        full = (watermark is None or self.last_full_sync is None
+                or now - self.last_full_sync >= self.full_sync_interval)
+
+        if full:
+            collections = self.bq_client.get_all_collections()
+        else:
+            since = watermark - timedelta(seconds=self.overlap)
+            collections = self.bq_client.get_collections_changed_since(since)
+
+        rows = [self._to_db_row(c) for c in collections if c.get('collection_id')]
+        columns = f"{_COLUMNS}, sort_created_at, changed_ts"
+        with self._write_lock:
+            conn = self._write_conn
+            # Строки готовятся во временной таблице (общий файл не блокируется), затем
+            # переносятся в копию одной короткой транзакцией
+            conn.execute("CREATE TEMP TABLE IF NOT EXISTS sync_rows AS SELECT * FROM main.collections WHERE 0")
+            with conn:
+                conn.execute("DELETE FROM temp.sync_rows")
+                conn.executemany(
+                    f"INSERT OR REPLACE INTO temp.sync_rows ({columns}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows
+                )
+            with conn:
+                if full:
+                    conn.execute("DELETE FROM main.collections")
+                conn.execute(
+                    f"INSERT OR REPLACE INTO main.collections ({columns}) SELECT {columns} FROM temp.sync_rows"
+                )
+                self._set_meta('last_sync', now)
+                if full:
+                    self._set_meta('last_full_sync', now)
+            with conn:
+                conn.execute("DELETE FROM temp.sync_rows")
+
+        self.last_sync = now
+        if full:
+            self.last_full_sync = now
+        logger.info(f"Collections mirror {'fully reloaded' if full else 'synced'}: {len(rows)} rows")
+        return len(rows)
+
+    # --- чтение (те же сигнатуры, что у BigQueryClient) ---
+
+    def count_collections(self, collection_filter: CollectionFilter = CollectionFilter()) -> int:
+        where, params = self._filter_clause(collection_filter)
+        return self._query(f"SELECT COUNT(*) AS total FROM collections {where}", params)[0]['total']
+
+    def get_collections_page(self, collection_filter: CollectionFilter = CollectionFilter(), page: int = 0,
+                             page_size: int = 12) -> List[Dict]:
+        where, params = self._filter_clause(collection_filter)
+        rows = self._query(
+            f"SELECT {_COLUMNS} FROM collections {where} "
+            "ORDER BY sort_created_at DESC, collection_id DESC LIMIT ? OFFSET ?",
+            params + (page_size, page * page_size)
+        )
+        return [self._to_collection(row) for row in rows]
+
+    def get_collections_with_status(self, status: str = 'tsum cs') -> List[Dict]:
+        where, params = self._filter_clause(CollectionFilter(status='tsum cs'))
+        rows = self._query(f"SELECT {_COLUMNS} FROM collections {where} ORDER BY sort_created_at DESC", params)
+        return [self._to_collection(row) for row in rows]
+
+    def get_collections_changed_since(self, since: datetime, company_ids: Optional[List[str]] = None) -> List[Dict]:
+        if company_ids:
+            placeholders = ', '.join('?' for _ in company_ids)
+            rows = self._query(
+                f"SELECT {_COLUMNS} FROM collections WHERE company_id IN ({placeholders}) AND changed_ts >= ? "
+                "ORDER BY sort_created_at DESC",
+                tuple(company_ids) + (since.timestamp(),)
+            )
+        else:
+            rows = self._query(
+                f"SELECT {_COLUMNS} FROM collections WHERE changed_ts >= ? ORDER BY sort_created_at DESC",
+                (since.timestamp(),)
+            )
+        return [self._to_collection(row) for row in rows]
+
+    def get_collections_fingerprint(self, since: datetime,
+                                    company_ids: Optional[List[str]] = None) -> Tuple[int, int]:
+        conditions, params = ["changed_ts >= ?"], [since.timestamp()]
+        if company_ids:
+            conditions.append(f"company_id IN ({', '.join('?' for _ in company_ids)})")
+            params.extend(company_ids)
+        rows = self._query(
+            "SELECT COUNT(*) AS row_count, xor_fingerprint(collection_id, changed_ts) AS fingerprint "
+            f"FROM collections WHERE {' AND '.join(conditions)}",
+            tuple(params)
+        )
+        return rows[0]['row_count'], rows[0]['fingerprint'] or 0
+
+    def get_collections_for_tenants(self, tenants: List[TenantRule]) -> List[Dict]:
+        if not tenants:
+            return []
+        # instr() учитывает регистр, как STRPOS в BigQueryClient.get_collections_for_tenants
+        conditions = ' OR '.join("(company_id = ? AND instr(collection_name, ?) > 0)" for _ in tenants)
+        params = tuple(value for tenant in tenants for value in (tenant.company_id, tenant.name_pattern))
+        rows = self._query(f"SELECT {_COLUMNS} FROM collections WHERE {conditions} ORDER BY sort_created_at DESC", params)
+        return [self._to_collection(row) for row in rows]
+    
+    def get_collections_by_ids(self, collection_ids: List[str]) -> Dict[str, Dict]:
+        collection_ids = list(dict.fromkeys(collection_ids))
+        if not collection_ids:
+            return {}
+        placeholders = ', '.join('?' for _ in collection_ids)
+        rows = self._query(f"SELECT {_COLUMNS} FROM collections WHERE collection_id IN ({placeholders})",
+                           tuple(collection_ids))
+
+        collections = {}
+        for row in rows:
+            collection = self._to_collection(row)
+            # Для поиска по ID статус определяется так же, как в BigQueryClient.get_collections_by_ids
+            collection_name = (row['collection_name'] or '').lower()
+            collection['status'] = 'tsum cs' if 'tsum' in collection_name and 'cs' in collection_name else ''
+            collections[row['collection_id']] = collection
+        return collections
+
+    def close(self):
+        with self._write_lock:
+            self._write_conn.close()
+        with self._lock:
+            self._conn.close()
+
+
+_mirror: Optional[CollectionsMirror] = None
+_mirror_lock = threading.Lock()
+
+
+def get_collections_mirror() -> CollectionsMirror:
+    """Возвращает общую для процесса локальную копию таблицы коллекций"""
+    global _mirror
+    with _mirror_lock:
+        if _mirror is None:
+            from config.settings import (
+                COLLECTIONS_MIRROR_FILE, MIRROR_MAX_STALENESS, MIRROR_FULL_SYNC_INTERVAL, STATUS_WATERMARK_OVERLAP
+            )
+            _mirror = CollectionsMirror(
+                COLLECTIONS_MIRROR_FILE,
+                max_staleness=MIRROR_MAX_STALENESS,
+                full_sync_interval=MIRROR_FULL_SYNC_INTERVAL,
+                overlap=STATUS_WATERMARK_OVERLAP,
+            )
+        return _mirror
@@ -0,0 +1,151 @@
+import time
+import logging
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+from services.selenium_collector import SeleniumCollector
+from services.resource_governor import ResourceGovernor, create_governor
+from services.webdriver_endpoints import LOCAL_ENDPOINT, get_endpoint_pool
+
+logger = logging.getLogger(__name__)
+
+
+class CollectorPool:
+    """
+    Пул переиспользуемых Selenium-коллекторов
+
+    Браузер с активной сессией Мозаики переиспользуется между отчетами, пока
+    ResourceGovernor не решит, что его пора пересоздать (по числу отчетов или RSS).
+    Новый локальный браузер запускается только после допуска по памяти, иначе задание ждет.
+    """
+
+    def __init__(self, email: str, password: str, governor: Optional[ResourceGovernor] = None,
+                 idle_timeout: float = 300.0, endpoint: Optional[str] = None):
+        """
+        Инициализация пула
+
+        Args:
+            email: Email для входа в Мозаику
+            password: Пароль для входа в Мозаику
+            governor: Контроллер ресурсов (по умолчанию - учет браузеров только этого пула)
+            idle_timeout: Через сколько секунд простоя браузер закрывается
+            endpoint: Точка WebDriver для всех браузеров пула; None - выбирать наименее
+                загруженную из WEBDRIVER_ENDPOINTS для каждого нового браузера
+        """
+        self.email = email
+        self.password = password
+        self.endpoint = endpoint
+        self.governor = governor or create_governor()
+        self.idle_timeout = idle_timeout
+        # Свободные коллекторы: (коллектор, время освобождения)
+        self._idle: List[Tuple[SeleniumCollector, float]] = []
+        self._lock = threading.Lock()
+
+    def _close_collector(self, collector: SeleniumCollector, failed: bool = False):
+        """Закрывает браузер и освобождает слот в контроллере ресурсов и точке WebDriver"""
+        try:
+            collector.close()
+        except Exception as e:
+            logger.debug(f"Error closing collector: {e}")
+        finally:
+            if not collector.is_remote:
+                self.governor.release()
+            endpoint = getattr(collector, 'pool_endpoint', None)
+            if endpoint is not None:
+                get_endpoint_pool().release(endpoint, failed=failed)
+
+    def reap_idle(self):
+        """Закрывает браузеры, которые простаивают дольше idle_timeout"""
+        now = time.monotonic()
+        with self._lock:
+            expired = [c for c, since in self._idle if now - since > self.idle_timeout]
+            self._idle = [(c, since) for c, since in self._idle if now - since <= self.idle_timeout]
+        for collector in expired:
+            logger.info("Closing idle browser")
+            self._close_collector(collector)
+
+    def _acquire(self) -> Optional[SeleniumCollector]:
+        """Берет свободный коллектор или запускает новый после допуска по ресурсам"""
+        self.reap_idle()
+
+        with self._lock:
+            if self._idle:
+                collector, _ = self._idle.pop()
+                logger.info("Reusing browser session from pool")
+                return collector
+
+        # Фиксированная точка пула или наименее загруженная из общего списка
+        pool_endpoint = None
+        endpoint_url = self.endpoint
+        if endpoint_url is None:
+            pool_endpoint = get_endpoint_pool().acquire()
+            endpoint_url = pool_endpoint.url
+        is_local = endpoint_url == LOCAL_ENDPOINT
+
+        # Ограничения по памяти контейнера касаются только локального Chrome
+        if is_local and not self.governor.admit():
+            if pool_endpoint is not None:
+                get_endpoint_pool().release(pool_endpoint)
+            return None
+
+        try:
+            collector = SeleniumCollector(self.email, self.password, endpoint=endpoint_url)
+        except Exception:
+            if is_local:
+                self.governor.release()
+            if pool_endpoint is not None:
+                get_endpoint_pool().release(pool_endpoint, failed=True)
+            raise
+        finally:
+            if is_local:
+                # Браузер запущен (или не запустился) - следующий допуск учтет его память
+                self.governor.launched()
+        collector.pool_endpoint = pool_endpoint
+        return collector
+
+    def _release(self, collector: SeleniumCollector, healthy: bool = True):
+        """Возвращает коллектор в пул или пересоздает браузер"""
+        if not healthy or not collector.driver or self.governor.should_recycle(collector):
+            self._close_collector(collector, failed=not healthy)
+            return
+
+        with self._lock:
+            self._idle.append((collector, time.monotonic()))
+
+    def collect_report(self, collection_id: str,
+                       on_stage: Optional[Callable[[str], None]] = None) -> Tuple[Optional[Dict], Optional[str]]:
+        """
+        Собирает отчет по коллекции на свободном браузере из пула
+
+        Args:
+            collection_id: ID коллекции
+            on_stage: Callback с названием текущего этапа сбора
+
+        Returns:
+            Кортеж (отчет или None, сообщение об ошибке или None)
+        """
+        collector = self._acquire()
+        if collector is None:
+            return None, "❌ Недостаточно ресурсов для запуска браузера. Попробуйте позже."
+
+        healthy = False
+        try:
+            # Входим в Мозаику (только для нового браузера, дальше сессия переиспользуется)
+            if not collector.logged_in and not collector.login():
+                return None, "❌ Не удалось войти в Мозаику. Проверьте учетные данные."
+
+            report = collector.get_collection_report(collection_id, on_stage=on_stage)
+            collector.reports_done += 1
+            # Если отчет не собрался даже с повторами этапов, браузер лучше пересоздать
+            healthy = report is not None
+            return report, None
+        finally:
+            self._release(collector, healthy=healthy)
+
+    def close_all(self):
+        """Закрывает все свободные браузеры пула"""
+        with self._lock:
+            idle = [c for c, _ in self._idle]
+            self._idle = []
+        for collector in idle:
+            self._close_collector(collector)
+
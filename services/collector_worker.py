@@ -0,0 +1,310 @@
+import asyncio
+import inspect
+import itertools
+import logging
+import multiprocessing
+from typing import Callable, Dict, List, Optional, Tuple
+from services.webdriver_endpoints import endpoint_slot_count, get_endpoint_pool
+from services.resource_governor import SharedBrowserSlots
+
+logger = logging.getLogger(__name__)
+
+# Протокол между ботом и воркером (словари, передаваемые через Pipe):
+#   бот -> воркер:  {'type': 'report', 'job_id': int, 'collection_id': str}
+#                   {'type': 'ping'} / {'type': 'shutdown'}
+#   воркер -> бот:  {'type': 'progress', 'job_id': int, 'stage': str}
+#                   {'type': 'result', 'job_id': int, 'report': dict | None, 'error': str | None}
+#                   {'type': 'pong'}
+
+
+def _worker_main(conn, slots: SharedBrowserSlots, index: int):
+    """
+    Точка входа процесса-воркера: принимает задания на сбор отчетов и выполняет их
+    на собственном пуле браузеров, отправляя обратно этапы и результат
+
+    Args:
+        conn: Конец Pipe для обмена сообщениями с ботом
+        slots: Учет браузеров, общий для всех воркеров (лимит и допуск по памяти - на контейнер,
+            загрузка точек WebDriver - по всем воркерам)
+        index: Номер воркера в slots
+    """
+    logging.basicConfig(
+        format='%(asctime)s - %(processName)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+    from services.collector_pool import CollectorPool
+    from services.resource_governor import create_governor
+    from config.settings import ADMIN_EMAIL, ADMIN_PASSWORD, COLLECTOR_IDLE_TIMEOUT
+
+    # Точка WebDriver выбирается для каждого нового браузера: недоступная точка
+    # пропускается при следующем запуске, а не занимает воркер до перезапуска
+    get_endpoint_pool(slots, index)
+    pool = CollectorPool(ADMIN_EMAIL, ADMIN_PASSWORD, governor=create_governor(slots, index),
+                         idle_timeout=COLLECTOR_IDLE_TIMEOUT)
+    # Простаивающие браузеры закрываются и между заданиями, а не только при следующем
+    reap_interval = max(1.0, min(COLLECTOR_IDLE_TIMEOUT / 2, 30.0))
+    logger.info("Collector worker started")
+
+    try:
+        while True:
+            try:
+                if not conn.poll(reap_interval):
+                    pool.reap_idle()
+                    continue
+                request = conn.recv()
+            except (EOFError, OSError):
+                # Бот закрыл канал - завершаемся
+                break
+
+            request_type = request.get('type')
+            if request_type == 'shutdown':
+                break
+
+            if request_type == 'ping':
+                conn.send({'type': 'pong'})
+                continue
+
+            if request_type != 'report':
+                logger.warning(f"Unknown request type: {request_type}")
+                continue
+
+            job_id = request.get('job_id')
+
+            def on_stage(stage: str):
+                conn.send({'type': 'progress', 'job_id': job_id, 'stage': stage})
+
+            try:
+                report, error_msg = pool.collect_report(request['collection_id'], on_stage=on_stage)
+            except Exception as e:
+                logger.error(f"Error collecting report in worker: {e}")
+                report, error_msg = None, f"❌ Ошибка при сборе отчета: {str(e)}"
+
+            conn.send({'type': 'result', 'job_id': job_id, 'report': report, 'error': error_msg})
+    finally:
+        pool.close_all()
+        logger.info("Collector worker stopped")
+
+
+class CollectorWorker:
+    """Отдельный процесс для сбора отчетов через Selenium"""
+
+    def __init__(self, index: int, slots: SharedBrowserSlots):
+        """
+        Args:
+            index: Номер воркера (для имени процесса в логах и счетчика в slots)
+            slots: Учет браузеров, общий для всех воркеров пула
+        """
+        self.index = index
+        self.slots = slots
+        self.process = None
+        self.conn = None
+        self.restarts = 0
+
+    def is_alive(self) -> bool:
+        """Проверяет, что процесс воркера жив"""
+        return self.process is not None and self.process.is_alive()
+
+    def start(self):
+        """Запускает процесс воркера"""
+        # spawn: воркер не наследует потоки и состояние event loop бота
+        ctx = multiprocessing.get_context('spawn')
+        parent_conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(
+            target=_worker_main,
+            args=(child_conn, self.slots, self.index),
+            name=f"collector-worker-{self.index}",
+            daemon=True
+        )
+        self.process.start()
+        # Закрываем копию дочернего конца, иначе не узнаем о падении процесса (EOFError)
+        child_conn.close()
+        self.conn = parent_conn
+        logger.info(f"Collector worker {self.index} started (pid {self.process.pid})")
+
+    def restart(self):
+        """Перезапускает воркер после падения или зависания"""
+        self.terminate()
+        self.restarts += 1
+        logger.warning(f"Restarting collector worker {self.index} (restart #{self.restarts})")
+        self.start()
+
+    def terminate(self):
+        """Принудительно завершает процесс воркера"""
+        if self.process is not None and self.process.is_alive():
+            self.process.kill()
+            self.process.join(timeout=5)
+        if self.conn is not None:
+            try:
+                self.conn.close()
+            except Exception:
+                pass
+        self.process = None
+        self.conn = None
+        # Браузеры завершенного процесса больше не занимают слоты (и сессии на точках WebDriver)
+        self.slots.reset(self.index)
+
+    def stop(self, timeout: float = 30.0):
+        """Корректно останавливает воркер (с закрытием браузеров)"""
+        if self.is_alive():
+            try:
+                self.conn.send({'type': 'shutdown'})
+                self.process.join(timeout=timeout)
+            except Exception as e:
+                logger.debug(f"Error stopping collector worker {self.index}: {e}")
+        self.terminate()
+
+
+class WorkerCrashedError(Exception):
+    """Процесс-воркер упал во время выполнения задания"""
+
+
+class CollectorWorkerPool:
+    """
+    Пул процессов-воркеров для сбора отчетов
+
+    Chrome, блокирующие вызовы WebDriver и очистка процессов выполняются вне процесса
+    бота, поэтому event loop Telegram не разделяет с ними GIL и не страдает от падений.
+    Каждый воркер выполняет одно задание за раз; упавший воркер перезапускается.
+    """
+
+    def __init__(self, workers: int, job_timeout: float, endpoints: int = 1):
+        """
+        Инициализация пула
+
+        Args:
+            workers: Количество процессов-воркеров
+            job_timeout: Максимальное время выполнения одного задания (в секундах)
+            endpoints: Сколько точек WebDriver учитывать (см. endpoint_slot_count)
+        """
+        self.job_timeout = job_timeout
+        # Лимит браузеров, допуск по памяти и загрузка точек WebDriver - общие для всех
+        # воркеров (MAX_CHROME_COLLECTORS на контейнер, *N на точку)
+        self.slots = SharedBrowserSlots(workers, endpoints)
+        self.workers = [CollectorWorker(i, self.slots) for i in range(workers)]
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._job_ids = itertools.count(1)
+
+    @property
+    def is_started(self) -> bool:
+        return bool(self._tasks)
+
+    async def start(self):
+        """Запускает процессы-воркеры и задачи диспетчеризации"""
+        if self.is_started:
+            return
+        self._queue = asyncio.Queue()
+        for worker in self.workers:
+            await asyncio.to_thread(worker.start)
+            self._tasks.append(asyncio.create_task(self._run_worker(worker)))
+        logger.info(f"Collector worker pool started with {len(self.workers)} workers")
+
+    async def stop(self):
+        """Останавливает воркеры"""
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        for worker in self.workers:
+            await asyncio.to_thread(worker.stop)
+        logger.info("Collector worker pool stopped")
+
+    async def _run_worker(self, worker: CollectorWorker):
+        """Берет задания из очереди и выполняет их на конкретном воркере"""
+        while True:
+            collection_id, on_progress, future = await self._queue.get()
+            try:
+                if future.cancelled():
+                    continue
+                result = await self._execute(worker, collection_id, on_progress)
+                if not future.done():
+                    future.set_result(result)
+            except asyncio.CancelledError:
+                if not future.done():
+                    future.set_result((None, "❌ Сбор отчета прерван."))
+                raise
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            finally:
+                self._queue.task_done()
+
+    async def _execute(self, worker: CollectorWorker, collection_id: str,
+                       on_progress: Optional[Callable]) -> Tuple[Optional[Dict], Optional[str]]:
+        """Выполняет задание на воркере; при падении воркера перезапускает его и повторяет один раз"""
+        for attempt in range(2):
+            if not worker.is_alive():
+                await asyncio.to_thread(worker.restart)
+            try:
+                return await self._send_job(worker, collection_id, on_progress)
+            except WorkerCrashedError as e:
+                logger.error(f"Collector worker {worker.index} crashed on collection {collection_id}: {e}")
+                await asyncio.to_thread(worker.restart)
+            except asyncio.TimeoutError:
+                logger.error(f"Collector worker {worker.index} timed out on collection {collection_id}")
+                await asyncio.to_thread(worker.restart)
+                return None, "❌ Превышено время ожидания сбора отчета."
+        return None, "❌ Процесс сбора отчета аварийно завершился."
+
+    async def _send_job(self, worker: CollectorWorker, collection_id: str,
+                        on_progress: Optional[Callable]) -> Tuple[Optional[Dict], Optional[str]]:
+        """Отправляет задание воркеру и читает поток ответов до результата"""
+        loop = asyncio.get_running_loop()
+        job_id = next(self._job_ids)
+        deadline = loop.time() + self.job_timeout
+
+        try:
+            worker.conn.send({'type': 'report', 'job_id': job_id, 'collection_id': collection_id})
+        except (OSError, ValueError) as e:
+            raise WorkerCrashedError(str(e))
+
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                raise asyncio.TimeoutError()
+            try:
+                message = await asyncio.wait_for(asyncio.to_thread(worker.conn.recv), remaining)
+            except (EOFError, OSError) as e:
+                raise WorkerCrashedError(str(e) or "connection closed")
+
+            if message.get('job_id') != job_id:
+                continue
+
+            if message.get('type') == 'progress':
+                if on_progress:
+                    try:
+                        result = on_progress(message.get('stage'))
+                        if inspect.isawaitable(result):
+                            await result
+                    except Exception as e:
+                        logger.debug(f"Progress callback error: {e}")
+            elif message.get('type') == 'result':
+                return message.get('report'), message.get('error')
+
+    async def collect_report(self, collection_id: str,
+                             on_progress: Optional[Callable] = None) -> Tuple[Optional[Dict], Optional[str]]:
+        """
+        Собирает отчет по коллекции в процессе-воркере
+
+        Args:
+            collection_id: ID коллекции
+            on_progress: Callback (обычный или async) с названием текущего этапа
+
+        Returns:
+            Кортеж (отчет или None, сообщение об ошибке или None)
+        """
+        await self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((collection_id, on_progress, future))
+        return await future
+
+
+_worker_pool: Optional[CollectorWorkerPool] = None
+
+
+def get_worker_pool() -> CollectorWorkerPool:
+    """Возвращает общий пул процессов-воркеров"""
+    global _worker_pool
+    if _worker_pool is None:
+        from config.settings import COLLECTOR_WORKERS, REPORT_JOB_TIMEOUT
+        _worker_pool = CollectorWorkerPool(COLLECTOR_WORKERS, REPORT_JOB_TIMEOUT, endpoint_slot_count())
+    return _worker_pool
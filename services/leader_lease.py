@@ -0,0 +1,129 @@
+import os
+import time
+import uuid
+import socket
+import sqlite3
+import logging
+import threading
+from pathlib import Path
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS lease (
+    name TEXT PRIMARY KEY,
+    holder TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+"""
+
+
+class LeaderLease:
+    """
+    Выбор ведущего экземпляра бота через аренду в SQLite (data/leader.db)
+
+    Несколько экземпляров бота с общим каталогом data/ конкурируют за одну
+    запись: ведущий тот, чья аренда не истекла. Ведущий продлевает аренду чаще,
+    чем она истекает; если он упал, аренду забирает другой экземпляр после
+    истечения срока. Захват и продление выполняются в транзакции BEGIN IMMEDIATE,
+    поэтому два экземпляра не могут стать ведущими одновременно. Если продление
+    зависло, экземпляр перестает считать себя ведущим по истечении своего срока.
+
+    Журнал SQLite оставлен по умолчанию (не WAL): файл может быть открыт из
+    разных контейнеров, а WAL требует общей памяти между процессами. Сроки
+    считаются по time.time(), поэтому часы экземпляров должны совпадать (один
+    хост или NTP).
+    """
+
+    def __init__(self, db_path: Path, ttl: float = 30.0, name: str = 'status_scheduler',
+                 holder_id: Optional[str] = None):
+        """
+        Args:
+            db_path: Путь к файлу SQLite (в общем каталоге data/)
+            ttl: Срок аренды в секундах
+            name: Имя аренды (роль, за которую идет выбор)
+            holder_id: Идентификатор экземпляра (по умолчанию хост, PID и случайный суффикс)
+        """
+        self.db_path = Path(db_path)
+        self.ttl = ttl
+        self.name = name
+        self.holder_id = holder_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._leader = False
+        # Срок аренды, известный этому экземпляру (time.time()): после него экземпляр
+        # не считает себя ведущим, даже если продление зависло и не вернуло ошибку
+        self._expires_at = 0.0
+        # Сколько раз экземпляр становился ведущим: по смене номера видно, что
+        # между проверками ведущим успел побыть другой экземпляр
+        self.term = 0
+        self._lock = threading.Lock()
+
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        # isolation_level=None: транзакциями управляем сами (BEGIN IMMEDIATE)
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False,
+                                     timeout=max(1.0, ttl / 3), isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock:
+            self._conn.executescript(_SCHEMA)
+
+    @property
+    def is_leader(self) -> bool:
+        """Экземпляр ведущий: аренда захвачена и ее срок еще не истек"""
+        return self._leader and time.time() < self._expires_at
+
+    def try_acquire(self) -> bool:
+        """
+        Захватывает или продлевает аренду
+
+        Returns:
+            True если этот экземпляр ведущий до now + ttl
+        """
+        now = time.time()
+        # Аренда, истекшая до продления, могла успеть побывать у другого экземпляра
+        was_leader = self._leader and now < self._expires_at
+        row = None
+        try:
+            with self._lock:
+                self._conn.execute("BEGIN IMMEDIATE")
+                try:
+                    row = self._conn.execute("SELECT holder, expires_at FROM lease WHERE name = ?",
+                                             (self.name,)).fetchone()
+                    acquired = row is None or row['holder'] == self.holder_id or row['expires_at'] <= now
+                    if acquired:
+                        self._conn.execute(
+                            "INSERT OR REPLACE INTO lease (name, holder, expires_at) VALUES (?, ?, ?)",
+                            (self.name, self.holder_id, now + self.ttl)
+                        )
+                    self._conn.execute("COMMIT")
+                except BaseException:
+                    self._conn.execute("ROLLBACK")
+                    raise
+        except sqlite3.Error as e:
+            # Не удалось продлить - считаем аренду потерянной: лучше пропустить
+            # проверку, чем опрашивать BigQuery вдвоем
+            logger.error(f"Leader lease check failed: {e}")
+            acquired = False
+
+        if acquired and not was_leader:
+            self.term += 1
+            previous = row['holder'] if row is not None else None
+            logger.info(f"Became leader for {self.name} as {self.holder_id}"
+                        + (f" (previous holder {previous})" if previous and previous != self.holder_id else ""))
+        elif not acquired and self._leader:
+            logger.warning(f"Lost leadership for {self.name}, "
+                           f"current holder: {row['holder'] if row is not None else 'unknown'}")
+        self._leader = acquired
+        self._expires_at = now + self.ttl if acquired else 0.0
+        return acquired
+
+    def release(self):
+        """Отдает аренду (при остановке), чтобы другой экземпляр стал ведущим сразу"""
+        try:
+            with self._lock:
+                self._conn.execute("DELETE FROM lease WHERE name = ? AND holder = ?", (self.name, self.holder_id))
+        except sqlite3.Error as e:
+            logger.error(f"Error releasing leader lease: {e}")
+        if self._leader:
+            logger.info(f"Released leadership for {self.name}")
+        self._leader = False
+        self._expires_at = 0.0
@@ -0,0 +1,168 @@
+import asyncio
+import time
+import logging
+from typing import Awaitable, Callable, Dict, NamedTuple, Optional, Tuple
+from services.bq_async import AsyncBigQueryClient, get_async_bq_client
+from services.collections_mirror import CollectionsMirror, get_collections_mirror
+from services.collection_filters import CollectionFilter
+
+logger = logging.getLogger(__name__)
+
+
+class CollectionRow(NamedTuple):
+    """Неизменяемая строка списка коллекций (общая для всех пользователей)"""
+    collection_id: str
+    collection_name: Optional[str]
+    company_id: Optional[str]
+    status: str
+    created_at: Optional[str]
+    updated_at: Optional[str]
+
+    @classmethod
+    def from_dict(cls, collection: Dict) -> 'CollectionRow':
+        return cls(
+            collection_id=collection.get('collection_id'),
+            collection_name=collection.get('collection_name'),
+            company_id=collection.get('company_id'),
+            status=collection.get('status', ''),
+            created_at=collection.get('created_at'),
+            updated_at=collection.get('updated_at'),
+        )
+
+
+class ListingCache:
+    """
+    Общий для процесса кэш списков коллекций для /collections
+
+    Ключи - фильтр (CollectionFilter) и номер страницы. Записи живут ttl секунд
+    или до явного сброса (планировщик сбрасывает кэш, когда видит изменения).
+    Одновременные запросы одной и той же страницы разными пользователями
+    выполняются одним запросом к BigQuery. В сессии пользователя хранится только
+    фильтр и номер страницы.
+    """
+
+    def __init__(self, bq_client: AsyncBigQueryClient, ttl: float = 120.0,
+                 mirror: Optional[CollectionsMirror] = None):
+        """
+        Args:
+            bq_client: Асинхронный клиент BigQuery
+            ttl: Время жизни записи (в секундах)
+            mirror: Локальная копия таблицы коллекций (пока свежая, страницы читаются из нее)
+        """
+        self.bq_client = bq_client
+        self.mirror = mirror
+        self.ttl = ttl
+        # {ключ: (значение, время загрузки)}
+        self._entries: Dict[tuple, Tuple[object, float]] = {}
+        # {ключ: future загрузки} - запросы, которые уже выполняются
+        self._inflight: Dict[tuple, asyncio.Future] = {}
+        # Увеличивается при сбросе, чтобы загрузка, начатая до сброса, не сохранила старые данные
+        self._generation = 0
+
+    async def _get(self, key: tuple, loader: Callable[[], Awaitable]):
+        """Возвращает значение из кэша или загружает его (один раз для всех ожидающих)"""
+        entry = self._entries.get(key)
+        if entry and time.monotonic() - entry[1] < self.ttl:
+            return entry[0]
+
+        future = self._inflight.get(key)
+        if future is not None:
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        generation = self._generation
+        try:
+            value = await loader()
+            if generation == self._generation:
+                now = time.monotonic()
+                # Поисковых фильтров много - устаревшие записи выбрасываем
+                for stale in [k for k, (_, loaded_at) in self._entries.items() if now - loaded_at >= self.ttl]:
+                    del self._entries[stale]
+                self._entries[key] = (value, now)
+            future.set_result(value)
+            return value
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Исключение уже передано вызывающему, ожидающие получат его из future
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+    async def _count(self, collection_filter: CollectionFilter) -> int:
+        return await self._get(
+            ('count', collection_filter),
+            lambda: self.bq_client.count_collections(collection_filter)
+        )
+
+    async def _page(self, collection_filter: CollectionFilter, page: int, page_size: int) -> Tuple[CollectionRow, ...]:
+        async def load():
+            collections = await self.bq_client.get_collections_page(collection_filter, page, page_size)
+            return tuple(CollectionRow.from_dict(c) for c in collections)
+
+        return await self._get(('page', collection_filter, page, page_size), load)
+
+    async def get_page(self, collection_filter: CollectionFilter, page: int,
+                       page_size: int) -> Tuple[int, int, Tuple[CollectionRow, ...]]:
+        """
+        Возвращает страницу списка коллекций
+
+        Args:
+            collection_filter: Фильтр списка
+            page: Запрошенный номер страницы (с нуля)
+            page_size: Количество коллекций на странице
+
+        Returns:
+            Кортеж (всего коллекций, фактический номер страницы, строки страницы)
+        """
+        if self.mirror is not None:
+            # Локальная копия отвечает быстро - кэшировать нечего. SQLite может ждать
+            # блокировку файла (синхронизация другого экземпляра), поэтому чтение - в потоке
+            try:
+                result = await asyncio.to_thread(self._mirror_page, collection_filter, page, page_size)
+            except Exception as e:
+                logger.warning(f"Collections mirror read failed, using BigQuery: {e}")
+                result = None
+            if result is not None:
+                return result
+
+        total_count = await self._count(collection_filter)
+        total_pages = (total_count + page_size - 1) // page_size
+        page = max(0, min(page, total_pages - 1))
+        if not total_pages:
+            return total_count, page, ()
+        return total_count, page, await self._page(collection_filter, page, page_size)
+
+    def _mirror_page(self, collection_filter: CollectionFilter, page: int,
+                     page_size: int) -> Optional[Tuple[int, int, Tuple[CollectionRow, ...]]]:
+        """Страница из локальной копии (блокирующий вызов); None - копия устарела"""
+        if not self.mirror.is_fresh():
+            return None
+        total_count = self.mirror.count_collections(collection_filter)
+        total_pages = (total_count + page_size - 1) // page_size
+        page = max(0, min(page, total_pages - 1))
+        rows = self.mirror.get_collections_page(collection_filter, page, page_size) if total_pages else []
+        return total_count, page, tuple(CollectionRow.from_dict(c) for c in rows)
+
+    def invalidate(self):
+        """Сбрасывает все списки (а также кэш количества и курсоры страниц в клиенте BigQuery)"""
+        self._generation += 1
+        self._entries.clear()
+        self.bq_client.client.invalidate_collections_cache()
+        logger.info("Collection listing cache invalidated")
+
+
+_listing_cache: Optional[ListingCache] = None
+
+
+def get_listing_cache() -> ListingCache:
+    """Возвращает общий для процесса кэш списков коллекций"""
+    global _listing_cache
+    if _listing_cache is None:
+        from config.settings import LISTING_CACHE_TTL
+        _listing_cache = ListingCache(get_async_bq_client(), LISTING_CACHE_TTL, mirror=get_collections_mirror())
+    return _listing_cache
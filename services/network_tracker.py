@@ -0,0 +1,180 @@
+import json
+import time
+import logging
+from typing import Dict, Iterable, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+# Типы запросов, которые считаем "значимыми" для готовности страницы Мозаики.
+# Картинки, шрифты и медиа не влияют на то, отрисованы ли данные, поэтому их не ждем.
+DEFAULT_TRACKED_TYPES = {'Document', 'XHR', 'Fetch', 'Script'}
+
+# Фрагменты URL долгоживущих запросов (long-polling, аналитика, мониторинг ошибок): они
+# могут не завершаться, пока страница открыта. Остальные запросы (в том числе медленные
+# запросы данных отчета) ждем до таймаута.
+DEFAULT_LONG_POLL_PATTERNS = (
+    'socket.io', 'sockjs', '/longpoll', '/long-poll', '/poll', 'hot-update',
+    'google-analytics.com', 'googletagmanager.com', 'mc.yandex.ru', 'sentry',
+)
+
+
+class NetworkActivityTracker:
+    """
+    Отслеживает сетевую активность страницы через события DevTools (Network.*)
+
+    События читаются из performance-лога ChromeDriver (capability goog:loggingPrefs),
+    поэтому трекер работает синхронно и не требует отдельного event loop.
+    """
+
+    def __init__(self, driver, tracked_types: Optional[Set[str]] = None,
+                 stale_request_seconds: float = 4.0, poll_interval: float = 0.1,
+                 long_poll_patterns: Optional[Iterable[str]] = None):
+        """
+        Инициализация трекера
+
+        Args:
+            driver: Экземпляр Selenium WebDriver (Chrome)
+            tracked_types: Типы ресурсов DevTools, которые учитываются при ожидании
+            stale_request_seconds: Через сколько секунд незавершенный долгоживущий запрос
+                (URL совпадает с long_poll_patterns) перестает блокировать ожидание
+            poll_interval: Интервал опроса лога событий (в секундах)
+            long_poll_patterns: Фрагменты URL долгоживущих запросов
+                (по умолчанию DEFAULT_LONG_POLL_PATTERNS)
+        """
+        self.driver = driver
+        self.tracked_types = tracked_types or DEFAULT_TRACKED_TYPES
+        self.stale_request_seconds = stale_request_seconds
+        self.poll_interval = poll_interval
+        self.long_poll_patterns = tuple(
+            p.lower() for p in (DEFAULT_LONG_POLL_PATTERNS if long_poll_patterns is None else long_poll_patterns) if p
+        )
+        self.available = True
+        # requestId -> время (monotonic), когда мы увидели начало запроса
+        self._inflight: Dict[str, float] = {}
+        # Незавершенные запросы, которые можно перестать ждать через stale_request_seconds
+        self._long_poll: Set[str] = set()
+        self._last_activity = time.monotonic()
+
+        try:
+            # Явно включаем домен Network (ChromeDriver делает это для performance-лога,
+            # но удаленные/нестандартные драйверы могут этого не делать)
+            self.driver.execute_cdp_cmd('Network.enable', {})
+        except Exception as e:
+            logger.debug(f"Could not enable CDP Network domain: {e}")
+
+    def _drain(self):
+        """Читает накопившиеся события из performance-лога и обновляет список активных запросов"""
+        if not self.available:
+            return
+
+        try:
+            entries = self.driver.get_log('performance')
+        except Exception as e:
+            logger.warning(f"Performance log is not available, falling back to readyState waits: {e}")
+            self.available = False
+            return
+
+        now = time.monotonic()
+        for entry in entries:
+            try:
+                message = json.loads(entry['message'])['message']
+            except Exception:
+                continue
+
+            method = message.get('method', '')
+            if not method.startswith('Network.'):
+                continue
+
+            params = message.get('params', {})
+            request_id = params.get('requestId')
+            if not request_id:
+                continue
+
+            if method == 'Network.requestWillBeSent':
+                if params.get('type') in self.tracked_types:
+                    self._inflight[request_id] = now
+                    self._last_activity = now
+                    if self._is_long_poll(params.get('request', {}).get('url', '')):
+                        self._long_poll.add(request_id)
+            elif method in ('Network.loadingFinished', 'Network.loadingFailed'):
+                self._long_poll.discard(request_id)
+                if self._inflight.pop(request_id, None) is not None:
+                    self._last_activity = now
+
+    def _is_long_poll(self, url: str) -> bool:
+        url = url.lower()
+        return any(pattern in url for pattern in self.long_poll_patterns)
+
+    def _drop_stale_requests(self, now: float):
+        """Перестает ждать долгоживущие запросы, которые висят дольше stale_request_seconds"""
+        stale = [rid for rid in self._long_poll
+                 if now - self._inflight.get(rid, now) > self.stale_request_seconds]
+        for request_id in stale:
+            self._inflight.pop(request_id, None)
+            self._long_poll.discard(request_id)
+            logger.debug(f"Ignoring long-running request {request_id}")
+
+    def reset(self):
+        """Сбрасывает накопленные события (например, после пересоздания страницы)"""
+        self._drain()
+        self._inflight.clear()
+        self._long_poll.clear()
+        self._last_activity = time.monotonic()
+
+    @property
+    def inflight_count(self) -> int:
+        """Количество незавершенных отслеживаемых запросов"""
+        return len(self._inflight)
+
+    def wait_for_network_idle(self, quiet_ms: int = 500, timeout: float = 15.0) -> bool:
+        """
+        Ждет, пока на странице не останется активных запросов в течение quiet_ms
+
+        Момент вызова считается активностью, поэтому запросы, запущенные действием
+        прямо перед вызовом (клик, вызов JS-функции), успевают попасть в лог.
+
+        Args:
+            quiet_ms: Сколько миллисекунд сеть должна быть "тихой"
+            timeout: Максимальное время ожидания (в секундах)
+
+        Returns:
+            True если сеть затихла, False если истек таймаут
+        """
+        started = time.monotonic()
+        deadline = started + timeout
+        quiet_seconds = quiet_ms / 1000.0
+        self._last_activity = max(self._last_activity, started)
+
+        if not self.available:
+            return self._wait_for_ready_state(quiet_seconds, deadline)
+
+        while True:
+            self._drain()
+            if not self.available:
+                return self._wait_for_ready_state(quiet_seconds, deadline)
+
+            now = time.monotonic()
+            self._drop_stale_requests(now)
+
+            if not self._inflight and now - self._last_activity >= quiet_seconds:
+                logger.debug(f"Network idle after {now - started:.2f}s")
+                return True
+
+            if now >= deadline:
+                logger.warning(f"Network did not become idle within {timeout}s "
+                               f"({len(self._inflight)} requests still in flight)")
+                return False
+
+            time.sleep(self.poll_interval)
+
+    def _wait_for_ready_state(self, quiet_seconds: float, deadline: float) -> bool:
+        """Запасной вариант без DevTools: ждем document.readyState и тихий интервал"""
+        while time.monotonic() < deadline:
+            try:
+                if self.driver.execute_script("return document.readyState") == "complete":
+                    time.sleep(quiet_seconds)
+                    return True
+            except Exception:
+                pass
+            time.sleep(self.poll_interval)
+        return False
@@ -0,0 +1,127 @@
+import random
+import logging
+from datetime import datetime
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class HourProfile(NamedTuple):
+    """Границы интервала опроса для часов [start_hour, end_hour) (через полночь, если start > end)"""
+    start_hour: int
+    end_hour: int
+    min_interval: float
+    max_interval: float
+
+    def covers(self, hour: int) -> bool:
+        if self.start_hour <= self.end_hour:
+            return self.start_hour <= hour < self.end_hour
+        return hour >= self.start_hour or hour < self.end_hour
+
+
+def parse_hour_profiles(value: str) -> List[HourProfile]:
+    """
+    Разбирает профили по часам из строки вида "9-21:30:300,21-9:120:1800"
+
+    Каждый профиль: часы начала-конца (локальное время), минимальный и
+    максимальный интервал в секундах. Некорректные профили пропускаются.
+    """
+    profiles = []
+    for item in (value or '').split(','):
+        item = item.strip()
+        if not item:
+            continue
+        try:
+            hours, min_interval, max_interval = item.split(':')
+            start_hour, end_hour = (int(hour) % 24 for hour in hours.split('-'))
+            profile = HourProfile(start_hour, end_hour, float(min_interval), float(max_interval))
+            if profile.min_interval <= 0 or profile.max_interval < profile.min_interval:
+                raise ValueError("intervals must be positive and min <= max")
+            profiles.append(profile)
+        except ValueError as e:
+            logger.error(f"Invalid status interval profile '{item}': {e}")
+    return profiles
+
+
+class PollCadence:
+    """
+    Адаптивный интервал проверки статусов
+
+    После проверки, нашедшей переходы, интервал сбрасывается к минимальному
+    (панели меняются пачками - следующие переходы вероятны скоро). Каждая
+    проверка без переходов увеличивает интервал в backoff раз, но не больше
+    максимального: ночью и в выходные BigQuery опрашивается редко. Границы можно
+    задать по часам суток (профили). К интервалу добавляется случайный разброс
+    ±jitter, чтобы несколько экземпляров не опрашивали BigQuery синхронно.
+    """
+
+    def __init__(self, initial_interval: float, min_interval: float, max_interval: float,
+                 backoff: float = 1.5, jitter: float = 0.1, profiles: Optional[List[HourProfile]] = None):
+        """
+        Args:
+            initial_interval: Интервал до первой проверки с переходами
+            min_interval: Интервал после проверки с переходами (в секундах)
+            max_interval: Максимальный интервал в тихий период (в секундах)
+            backoff: Во сколько раз увеличивать интервал после проверки без переходов
+            jitter: Доля случайного разброса интервала (0.1 - ±10%)
+            profiles: Границы интервала по часам суток (вместо min/max_interval)
+        """
+        self.min_interval = min_interval
+        self.max_interval = max(min_interval, max_interval)
+        self.backoff = max(1.0, backoff)
+        self.jitter = min(max(jitter, 0.0), 0.5)
+        self.profiles = profiles or []
+        self.interval = float(initial_interval)
+        self.reason = 'initial'
+        self.quiet_checks = 0
+        self.last_delay: Optional[float] = None
+
+    def bounds(self, now: Optional[datetime] = None) -> Tuple[float, float, Optional[HourProfile]]:
+        """Минимальный и максимальный интервал для текущего часа (и профиль, если он задан)"""
+        hour = (now or datetime.now()).hour
+        for profile in self.profiles:
+            if profile.covers(hour):
+                return profile.min_interval, profile.max_interval, profile
+        return self.min_interval, self.max_interval, None
+
+    def next_delay(self, transitions: int, now: Optional[datetime] = None) -> float:
+        """
+        Пересчитывает интервал по результату проверки
+
+        Args:
+            transitions: Сколько переходов нашла проверка
+            now: Текущее время (для профилей по часам)
+
+        Returns:
+            Задержка до следующей проверки (с разбросом), в секундах
+        """
+        min_interval, max_interval, profile = self.bounds(now)
+        previous = self.interval
+        if transitions:
+            self.quiet_checks = 0
+            self.interval = min_interval
+            self.reason = f"{transitions} transitions"
+        else:
+            self.quiet_checks += 1
+            self.interval = min(previous * self.backoff, max_interval)
+            self.reason = f"quiet for {self.quiet_checks} checks"
+        # Профиль часа мог смениться - интервал всегда в его границах
+        self.interval = min(max(self.interval, min_interval), max_interval)
+        if profile is not None:
+            self.reason += f", profile {profile.start_hour:02d}-{profile.end_hour:02d}h"
+        if self.interval >= max_interval:
+            self.reason += ", at ceiling"
+
+        self.last_delay = self.interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+        log = logger.info if abs(self.interval - previous) >= 1 else logger.debug
+        log(f"Next status check in {self.last_delay:.0f}s (interval {self.interval:.0f}s: {self.reason})")
+        return self.last_delay
+
+    def state(self) -> Dict:
+        """Текущее состояние для логов и метрик"""
+        return {
+            'interval': round(self.interval, 1),
+            'next_delay': round(self.last_delay, 1) if self.last_delay is not None else None,
+            'reason': self.reason,
+            'quiet_checks': self.quiet_checks,
+        }
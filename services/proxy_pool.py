@@ -0,0 +1,255 @@
+import time
+import logging
+import threading
+from typing import Dict, List, Optional
+
+import requests
+from google.auth.transport.requests import AuthorizedSession, Request
+
+logger = logging.getLogger(__name__)
+
+# Ошибки, по которым понятно, что виноват прокси (а не BigQuery)
+_PROXY_ERRORS = (
+    requests.exceptions.ProxyError,
+    requests.exceptions.ConnectTimeout,
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+)
+
+
+class ProxyEndpoint:
+    """Прокси-сервер с накопленной статистикой задержки и ошибок"""
+
+    # Вес нового замера в скользящем среднем
+    ALPHA = 0.3
+
+    def __init__(self, address: str):
+        """
+        Args:
+            address: host:port прокси (или полный URL http://host:port)
+        """
+        self.url = address if '://' in address else f"http://{address}"
+        self.latency_ms: Optional[float] = None
+        self.error_rate = 0.0
+        self.consecutive_failures = 0
+        self.healthy = True
+        self.last_check = 0.0
+
+    @property
+    def proxies(self) -> Dict[str, str]:
+        """Аргумент proxies для requests"""
+        return {'http': self.url, 'https': self.url}
+
+    @property
+    def score(self) -> float:
+        """Оценка прокси: чем меньше, тем лучше (недоступный прокси - бесконечность)"""
+        if not self.healthy:
+            return float('inf')
+        # Прокси без замеров еще не проверялся - считаем его средним
+        latency = self.latency_ms if self.latency_ms is not None else 1000.0
+        return latency * (1 + 4 * self.error_rate)
+
+    def observe(self, ok: bool, latency_ms: Optional[float] = None):
+        """Учитывает результат проверки или запроса через прокси"""
+        self.error_rate += self.ALPHA * ((0.0 if ok else 1.0) - self.error_rate)
+        self.consecutive_failures = 0 if ok else self.consecutive_failures + 1
+        if latency_ms is not None:
+            if self.latency_ms is None:
+                self.latency_ms = latency_ms
+            else:
+                self.latency_ms += self.ALPHA * (latency_ms - self.latency_ms)
+
+    def __repr__(self):
+        latency = f"{self.latency_ms:.0f}ms" if self.latency_ms is not None else "n/a"
+        return f"ProxyEndpoint({self.url}, {latency}, errors={self.error_rate:.2f}, healthy={self.healthy})"
+
+
+class ProxyPool:
+    """
+    Пул прокси для HTTP-сессий BigQuery
+
+    Прокси периодически проверяются запросом через них (задержка и ошибки), к этим
+    замерам добавляются ошибки соединения из реальных запросов. Сессия использует
+    текущий выбранный прокси и переключается на другой, когда текущий деградировал
+    (стал недоступен или заметно хуже лучшего). Переменные окружения процесса
+    не меняются: Telegram и chromedriver ходят в сеть напрямую.
+    """
+
+    def __init__(self, proxies: List[ProxyEndpoint], probe_url: str,
+                 health_check_interval: float = 60.0, health_check_timeout: float = 5.0,
+                 max_error_rate: float = 0.5, max_failures: int = 3, switch_ratio: float = 1.5):
+        """
+        Args:
+            proxies: Список прокси
+            probe_url: URL, который запрашивается через прокси при проверке (подходит любой HTTP-ответ)
+            health_check_interval: Как часто перепроверять прокси (в секундах)
+            health_check_timeout: Таймаут проверочного запроса (в секундах)
+            max_error_rate: Доля ошибок, при которой прокси считается деградировавшим
+            max_failures: Сколько ошибок соединения подряд делают прокси недоступным
+            switch_ratio: Во сколько раз оценка текущего прокси должна быть хуже лучшего, чтобы переключиться
+        """
+        self.proxies = proxies
+        self.probe_url = probe_url
+        self.health_check_interval = health_check_interval
+        self.health_check_timeout = health_check_timeout
+        self.max_error_rate = max_error_rate
+        self.max_failures = max_failures
+        self.switch_ratio = switch_ratio
+        self.current: Optional[ProxyEndpoint] = None
+        self._lock = threading.Lock()
+        self._probing = False
+
+    def _update_health(self, proxy: ProxyEndpoint):
+        healthy = proxy.error_rate < self.max_error_rate and proxy.consecutive_failures < self.max_failures
+        if healthy != proxy.healthy:
+            if healthy:
+                logger.info(f"Proxy {proxy.url} is healthy again")
+            else:
+                logger.warning(f"Proxy {proxy.url} degraded (error rate {proxy.error_rate:.2f}, "
+                               f"{proxy.consecutive_failures} failures in a row)")
+        proxy.healthy = healthy
+
+    def check_health(self, proxy: ProxyEndpoint) -> bool:
+        """Проверяет прокси запросом через него и обновляет его статистику"""
+        proxy.last_check = time.monotonic()
+        started = time.monotonic()
+        try:
+            # Сессия без trust_env, чтобы переменные окружения не подменили проверяемый прокси
+            with requests.Session() as session:
+                session.trust_env = False
+                session.get(self.probe_url, proxies=proxy.proxies, timeout=self.health_check_timeout)
+            ok = True
+        except Exception as e:
+            logger.debug(f"Proxy {proxy.url} health check failed: {e}")
+            ok = False
+
+        with self._lock:
+            proxy.observe(ok, (time.monotonic() - started) * 1000 if ok else None)
+            self._update_health(proxy)
+        return proxy.healthy
+
+    def _probe_due(self):
+        try:
+            now = time.monotonic()
+            for proxy in self.proxies:
+                if now - proxy.last_check >= self.health_check_interval:
+                    self.check_health(proxy)
+        finally:
+            self._probing = False
+
+    def _refresh(self):
+        """Запускает фоновую проверку прокси, у которых истек интервал (запросы ее не ждут)"""
+        now = time.monotonic()
+        with self._lock:
+            if self._probing or all(now - p.last_check < self.health_check_interval for p in self.proxies):
+                return
+            self._probing = True
+        threading.Thread(target=self._probe_due, name='proxy-health', daemon=True).start()
+
+    def select(self) -> Optional[ProxyEndpoint]:
+        """
+        Возвращает прокси для очередного запроса
+
+        Текущий прокси сохраняется, пока он здоров и не хуже лучшего в switch_ratio раз,
+        чтобы не терять открытые соединения на каждом запросе. Запрос не ждет проверки
+        прокси (даже первый).
+
+        Returns:
+            Прокси или None, если пул пуст
+        """
+        if not self.proxies:
+            return None
+        # Проверки идут в фоне (одна на пул): до первых замеров выбирается прокси
+        # по текущей оценке, а переключение на лучший - при следующих запросах
+        self._refresh()
+
+        with self._lock:
+            best = min(self.proxies, key=lambda p: p.score)
+            current = self.current
+            if current is None or not current.healthy or current.score > best.score * self.switch_ratio:
+                if not best.healthy:
+                    # Все прокси деградировали - берем тот, у которого меньше ошибок
+                    best = min(self.proxies, key=lambda p: (p.error_rate, p.consecutive_failures))
+                    if best is not current:
+                        logger.error(f"All proxies are degraded, using {best.url}")
+                if best is not current:
+                    logger.info(f"Using proxy {best.url} for BigQuery"
+                                + (f" instead of {current.url}" if current else ""))
+                self.current = best
+            return self.current
+
+    def report(self, proxy: ProxyEndpoint, ok: bool):
+        """Учитывает результат реального запроса через прокси (задержку запросов не учитываем - в ней время BigQuery)"""
+        with self._lock:
+            proxy.observe(ok)
+            self._update_health(proxy)
+            if not ok:
+                # Перепроверить прокси при ближайшей фоновой проверке
+                proxy.last_check = 0.0
+
+
+def _send_through_pool(pool: ProxyPool, send, method, url, kwargs):
+    """Выполняет запрос через выбранный прокси пула и учитывает его результат"""
+    proxy = pool.select()
+    if proxy is not None:
+        kwargs['proxies'] = proxy.proxies
+    try:
+        response = send(method, url, **kwargs)
+    except _PROXY_ERRORS:
+        if proxy is not None:
+            pool.report(proxy, ok=False)
+        raise
+    if proxy is not None:
+        # 407 / 502 от самого прокси (без ответа BigQuery) - тоже отказ прокси
+        pool.report(proxy, ok=response.status_code not in (407, 502))
+    return response
+
+
+class ProxiedSession(requests.Session):
+    """HTTP-сессия, отправляющая запросы через прокси пула (для обновления токена доступа)"""
+
+    def __init__(self, pool: ProxyPool):
+        super().__init__()
+        self.pool = pool
+        self.trust_env = False
+
+    def request(self, method, url, **kwargs):
+        return _send_through_pool(self.pool, super().request, method, url, kwargs)
+
+
+class ProxiedAuthorizedSession(AuthorizedSession):
+    """Авторизованная сессия Google API, отправляющая запросы через прокси пула"""
+
+    def __init__(self, credentials, pool: ProxyPool):
+        super().__init__(credentials, auth_request=Request(ProxiedSession(pool)))
+        self.pool = pool
+        self.trust_env = False
+
+    def request(self, method, url, data=None, headers=None, **kwargs):
+        def send(method, url, **kwargs):
+            return super(ProxiedAuthorizedSession, self).request(method, url, data=data, headers=headers, **kwargs)
+
+        return _send_through_pool(self.pool, send, method, url, kwargs)
+
+
+_proxy_pool: Optional[ProxyPool] = None
+_proxy_pool_lock = threading.Lock()
+
+
+def get_proxy_pool() -> Optional[ProxyPool]:
+    """Возвращает общий для процесса пул прокси BigQuery (None, если прокси выключены)"""
+    global _proxy_pool
+    with _proxy_pool_lock:
+        if _proxy_pool is None:
+            from config.settings import (
+                USE_PROXY, PROXY_SERVERS, PROXY_PROBE_URL, PROXY_HEALTH_CHECK_INTERVAL, PROXY_HEALTH_CHECK_TIMEOUT
+            )
+            if not USE_PROXY or not PROXY_SERVERS:
+                return None
+            _proxy_pool = ProxyPool(
+                [ProxyEndpoint(address) for address in PROXY_SERVERS],
+                probe_url=PROXY_PROBE_URL,
+                health_check_interval=PROXY_HEALTH_CHECK_INTERVAL,
+                health_check_timeout=PROXY_HEALTH_CHECK_TIMEOUT,
+            )
+        return _proxy_pool
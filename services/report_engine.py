@@ -0,0 +1,148 @@
+import asyncio
+import inspect
+import logging
+from typing import Callable, Dict, List, Optional, Tuple
+from services.bq_async import AsyncBigQueryClient, get_async_bq_client
+from services.collector_worker import get_worker_pool
+
+logger = logging.getLogger(__name__)
+
+# Источники статистики отчета (настройка REPORT_SOURCE)
+REPORT_SOURCE_SQL = 'sql'            # Запрос к таблицам айтемов/действий, Selenium - запасной вариант
+REPORT_SOURCE_SELENIUM = 'selenium'  # Только Selenium (как раньше)
+
+
+def build_report(collection_id: str, total_done: Optional[int], combo_items: Optional[int],
+                 source: str, stats_text: Optional[str] = None) -> Dict:
+    """Формирует данные отчета в том же виде, что и SeleniumCollector"""
+    return {
+        'collection_id': collection_id,
+        'collection_url': f"https://admin.dresscode.ai/collection/{collection_id}",
+        'stats_text': stats_text,
+        'total_done': total_done,
+        'combo_items': combo_items,
+        'total_done_items': (total_done or 0) + (combo_items or 0),
+        'source': source,
+    }
+
+
+class ReportEngine:
+    """
+    Сбор статистики отчетов
+
+    По умолчанию статистика собирается через Selenium. В режиме 'sql' счетчики
+    считаются одним запросом к таблицам айтемов и действий BigQuery (сразу для
+    нескольких коллекций); Selenium используется, если запрос не удался или по
+    коллекции нет данных, а в режиме сверки - еще и в фоне для сравнения чисел
+    со страницей Мозаики.
+    """
+
+    def __init__(self, bq_client: AsyncBigQueryClient, source: str = REPORT_SOURCE_SELENIUM,
+                 cross_check: bool = False):
+        """
+        Args:
+            bq_client: Асинхронный клиент BigQuery
+            source: Источник статистики ('sql' или 'selenium')
+            cross_check: Дополнительно собирать отчет через Selenium и логировать расхождения
+        """
+        self.bq_client = bq_client
+        self.source = source
+        self.cross_check = cross_check
+        self._cross_check_tasks = set()
+
+    async def _sql_reports(self, collection_ids: List[str]) -> Dict[str, Dict]:
+        """Считает отчеты через BigQuery; при ошибке возвращает пустой словарь"""
+        try:
+            stats = await self.bq_client.get_collection_stats(collection_ids)
+        except Exception as e:
+            logger.error(f"Error computing report stats in BigQuery: {e}")
+            return {}
+        return {
+            collection_id: build_report(collection_id, s['total_done'], s['combo_items'], REPORT_SOURCE_SQL)
+            for collection_id, s in stats.items()
+        }
+
+    async def _cross_check(self, report: Dict):
+        """Собирает отчет через Selenium и сравнивает его с отчетом из BigQuery"""
+        collection_id = report['collection_id']
+        selenium_report, error_msg = await get_worker_pool().collect_report(collection_id)
+        if error_msg or not selenium_report:
+            logger.warning(f"Report cross-check for {collection_id} skipped: {error_msg or 'no Selenium report'}")
+            return
+
+        mismatches = [
+            f"{key}: sql={report.get(key)} selenium={selenium_report.get(key)}"
+            for key in ('total_done', 'combo_items')
+            if (report.get(key) or 0) != (selenium_report.get(key) or 0)
+        ]
+        if mismatches:
+            logger.warning(f"Report cross-check mismatch for {collection_id}: {', '.join(mismatches)}")
+        else:
+            logger.info(f"Report cross-check for {collection_id} matches")
+
+    def _schedule_cross_check(self, report: Dict):
+        task = asyncio.create_task(self._cross_check(report))
+        self._cross_check_tasks.add(task)
+        task.add_done_callback(self._cross_check_tasks.discard)
+
+    async def collect_reports(self, collection_ids: List[str],
+                              on_progress: Optional[Callable] = None) -> Dict[str, Tuple[Optional[Dict], Optional[str]]]:
+        """
+        Собирает отчеты по нескольким коллекциям
+
+        Args:
+            collection_ids: Список ID коллекций
+            on_progress: Callback (обычный или async) с названием текущего этапа
+                (передается в Selenium при сборе одного отчета)
+
+        Returns:
+            Словарь {collection_id: (отчет или None, сообщение об ошибке или None)}
+        """
+        collection_ids = list(dict.fromkeys(collection_ids))
+        results: Dict[str, Tuple[Optional[Dict], Optional[str]]] = {}
+
+        if self.source == REPORT_SOURCE_SQL:
+            if on_progress:
+                progress = on_progress('sql_stats')
+                if inspect.isawaitable(progress):
+                    await progress
+            for collection_id, report in (await self._sql_reports(collection_ids)).items():
+                results[collection_id] = (report, None)
+                if self.cross_check:
+                    self._schedule_cross_check(report)
+
+        # Запасной путь: коллекции, по которым BigQuery не дал данных, собираем через Selenium
+        fallback_ids = [collection_id for collection_id in collection_ids if collection_id not in results]
+        if fallback_ids and self.source == REPORT_SOURCE_SQL:
+            logger.info(f"Falling back to Selenium for {len(fallback_ids)} collections")
+
+        for collection_id in fallback_ids:
+            results[collection_id] = await get_worker_pool().collect_report(
+                collection_id,
+                on_progress=on_progress if len(collection_ids) == 1 else None
+            )
+
+        return results
+
+    async def collect_report(self, collection_id: str,
+                             on_progress: Optional[Callable] = None) -> Tuple[Optional[Dict], Optional[str]]:
+        """
+        Собирает отчет по одной коллекции
+
+        Returns:
+            Кортеж (отчет или None, сообщение об ошибке или None)
+        """
+        results = await self.collect_reports([collection_id], on_progress=on_progress)
+        return results[collection_id]
+
+
+_engine: Optional[ReportEngine] = None
+
+
+def get_report_engine() -> ReportEngine:
+    """Возвращает общий для процесса сборщик отчетов"""
+    global _engine
+    if _engine is None:
+        from config.settings import REPORT_SOURCE, REPORT_CROSS_CHECK
+        _engine = ReportEngine(get_async_bq_client(), source=REPORT_SOURCE, cross_check=REPORT_CROSS_CHECK)
+    return _engine
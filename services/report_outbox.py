@@ -0,0 +1,267 @@
+import json
+import time
+import sqlite3
+import logging
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Состояния задания отчета
+JOB_PENDING = 'pending'        # Ждет сбора отчета (или повтора после ошибки)
+JOB_COLLECTING = 'collecting'  # Отчет собирается
+JOB_COLLECTED = 'collected'    # Отчет собран и сохранен, идет (или ждет повтора) отправка
+JOB_SENT = 'sent'              # Отправлен во все беседы
+JOB_FAILED = 'failed'          # Попытки исчерпаны
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    collection_id TEXT NOT NULL,
+    collection_name TEXT,
+    tenant_id TEXT,
+    status TEXT,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL DEFAULT 0,
+    report TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_state ON jobs (state, next_attempt_at);
+-- По коллекции может быть только одно незавершенное задание
+CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_active ON jobs (collection_id)
+    WHERE state IN ('pending', 'collecting', 'collected');
+CREATE TABLE IF NOT EXISTS deliveries (
+    job_id INTEGER NOT NULL,
+    chat_id TEXT NOT NULL,
+    sent_at REAL,
+    PRIMARY KEY (job_id, chat_id)
+);
+"""
+
+
+class ReportOutbox:
+    """
+    Очередь отчетов на диске (SQLite, data/report_outbox.db)
+
+    Переход коллекции в статус клиента записывается сюда до того, как трекер
+    сохранит новый статус, поэтому сбой, ошибка Chrome или перезапуск не теряют
+    отчет: незавершенные задания продолжаются после запуска. Собранный отчет
+    сохраняется в задании, и повторная отправка не собирает его заново. Отправка
+    учитывается по паре (задание, беседа) - ключ идемпотентности: беседа, уже
+    получившая отчет, не получит его повторно (кроме сбоя между отправкой
+    сообщения и записью об этом - доставка "хотя бы один раз").
+
+    Очередь общая для всех экземпляров бота с каталогом data/ (ее продолжает
+    новый ведущий), поэтому журнал SQLite обычный (rollback), а не WAL: WAL
+    требует общей памяти между процессами, которой у разных контейнеров может не быть.
+
+    Методы потокобезопасны (одно соединение под _lock): add() вызывается из пула
+    потоков BigQuery, остальные - из планировщика через asyncio.to_thread.
+    """
+
+    def __init__(self, db_path: Path, max_attempts: int = 5, retry_delay: float = 300.0):
+        """
+        Args:
+            db_path: Путь к файлу SQLite
+            max_attempts: Сколько раз пытаться собрать и отправить отчет
+            retry_delay: Задержка перед первым повтором (дальше удваивается, в секундах)
+        """
+        self.db_path = Path(db_path)
+        self.max_attempts = max(1, max_attempts)
+        self.retry_delay = retry_delay
+        self._lock = threading.Lock()
+
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False, timeout=30.0)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=DELETE")
+            # FULL: каждая транзакция на диске до возврата (задания не должны теряться)
+            self._conn.execute("PRAGMA synchronous=FULL")
+            self._conn.executescript(_SCHEMA)
+            self._conn.commit()
+
+    @staticmethod
+    def _to_job(row: sqlite3.Row) -> Dict:
+        return {
+            'job_id': row['job_id'],
+            'collection_id': row['collection_id'],
+            'collection_name': row['collection_name'],
+            'tenant_id': row['tenant_id'],
+            'status': row['status'],
+            'state': row['state'],
+            'attempts': row['attempts'],
+            'report': json.loads(row['report']) if row['report'] else None,
+            'error': row['error'],
+        }
+
+    def add(self, collections: List[Dict]) -> int:
+        """
+        Добавляет задания по коллекциям, перешедшим в статус клиента
+
+        Коллекция, по которой уже есть незавершенное задание, пропускается, поэтому
+        повторное обнаружение того же перехода (например, после перезапуска) не
+        создает дубликат.
+
+        Returns:
+            Количество новых заданий
+
+        Raises:
+            sqlite3.Error: Задания не записаны (трекер в этом случае не сохраняет статусы)
+        """
+        now = time.time()
+        with self._lock:
+            with self._conn:
+                cursor = self._conn.executemany(
+                    "INSERT OR IGNORE INTO jobs (collection_id, collection_name, tenant_id, status, state, "
+                    "created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [(c['collection_id'], c.get('collection_name'), c.get('tenant_id'), c.get('status'),
+                      JOB_PENDING, now, now) for c in collections]
+                )
+                added = cursor.rowcount
+        if added:
+            logger.info(f"Report outbox: {added} new jobs")
+        return added
+
+    def resume(self) -> int:
+        """
+        Возвращает в очередь задания, прерванные во время сбора (при запуске)
+
+        Returns:
+            Количество возвращенных заданий
+        """
+        with self._lock:
+            with self._conn:
+                cursor = self._conn.execute(
+                    "UPDATE jobs SET state = ?, next_attempt_at = 0, updated_at = ? WHERE state = ?",
+                    (JOB_PENDING, time.time(), JOB_COLLECTING)
+                )
+        if cursor.rowcount:
+            logger.warning(f"Report outbox: resumed {cursor.rowcount} interrupted jobs")
+        return cursor.rowcount
+
+    def due_jobs(self, limit: int = 100) -> List[Dict]:
+        """Задания, которые пора собирать или отправлять (старые сначала)"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM jobs WHERE state IN (?, ?) AND next_attempt_at <= ? ORDER BY job_id LIMIT ?",
+                (JOB_PENDING, JOB_COLLECTED, time.time(), limit)
+            ).fetchall()
+        return [self._to_job(row) for row in rows]
+
+    def _update(self, job_ids: Iterable[int], state: str, **fields):
+        """Меняет состояние заданий (вызывать под _lock внутри транзакции)"""
+        assignments = ', '.join(f"{name} = ?" for name in fields)
+        sql = f"UPDATE jobs SET state = ?, updated_at = ?{', ' + assignments if assignments else ''} WHERE job_id = ?"
+        now = time.time()
+        self._conn.executemany(sql, [(state, now, *fields.values(), job_id) for job_id in job_ids])
+
+    def _set_state(self, job_ids: Iterable[int], state: str, **fields):
+        with self._lock:
+            with self._conn:
+                self._update(job_ids, state, **fields)
+
+    def mark_collecting(self, job_ids: List[int]):
+        self._set_state(job_ids, JOB_COLLECTING)
+
+    def store_report(self, job_id: int, report: Dict):
+        """Сохраняет собранный отчет (после этого он не собирается повторно)"""
+        self._set_state([job_id], JOB_COLLECTED, report=json.dumps(report, ensure_ascii=False), error=None)
+
+    def retry_later(self, job_id: int, error: str):
+        """
+        Учитывает неудачную попытку: задание повторится с экспоненциальной задержкой
+        или станет failed, если попытки исчерпаны
+        """
+        # Чтение счетчика попыток и запись - одна транзакция: параллельный вызов
+        # для того же задания не потеряет попытку
+        with self._lock:
+            with self._conn:
+                row = self._conn.execute("SELECT attempts, report FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+                if row is None:
+                    return
+                attempts = row['attempts'] + 1
+                if attempts >= self.max_attempts:
+                    self._update([job_id], JOB_FAILED, attempts=attempts, error=error)
+                else:
+                    delay = self.retry_delay * (2 ** (attempts - 1))
+                    self._update([job_id], JOB_COLLECTED if row['report'] else JOB_PENDING,
+                                 attempts=attempts, error=error, next_attempt_at=time.time() + delay)
+        if attempts >= self.max_attempts:
+            logger.error(f"Report outbox: job {job_id} failed after {attempts} attempts: {error}")
+            return
+        logger.warning(f"Report outbox: job {job_id} attempt {attempts} failed ({error}), retrying in {delay:.0f}s")
+
+    def pending_chats(self, job_id: int, chat_ids: List[str]) -> List[str]:
+        """
+        Беседы, в которые отчет задания еще не отправлен
+
+        Список бесед фиксируется при первом вызове: повторные попытки отправляют
+        отчет только туда, где он не дошел.
+        """
+        with self._lock:
+            with self._conn:
+                known = self._conn.execute("SELECT 1 FROM deliveries WHERE job_id = ? LIMIT 1", (job_id,)).fetchone()
+                if known is None:
+                    self._conn.executemany(
+                        "INSERT OR IGNORE INTO deliveries (job_id, chat_id) VALUES (?, ?)",
+                        [(job_id, str(chat_id)) for chat_id in chat_ids]
+                    )
+                rows = self._conn.execute(
+                    "SELECT chat_id FROM deliveries WHERE job_id = ? AND sent_at IS NULL", (job_id,)
+                ).fetchall()
+        return [row['chat_id'] for row in rows]
+
+    def mark_delivered(self, job_id: int, chat_id: str):
+        with self._lock:
+            with self._conn:
+                self._conn.execute(
+                    "UPDATE deliveries SET sent_at = ? WHERE job_id = ? AND chat_id = ?",
+                    (time.time(), job_id, str(chat_id))
+                )
+
+    def mark_sent(self, job_id: int):
+        self._set_state([job_id], JOB_SENT, error=None)
+
+    def purge(self, older_than: float) -> int:
+        """Удаляет завершенные задания (sent / failed) старше older_than секунд"""
+        cutoff = time.time() - older_than
+        with self._lock:
+            with self._conn:
+                self._conn.execute(
+                    "DELETE FROM deliveries WHERE job_id IN "
+                    "(SELECT job_id FROM jobs WHERE state IN (?, ?) AND updated_at < ?)",
+                    (JOB_SENT, JOB_FAILED, cutoff)
+                )
+                cursor = self._conn.execute(
+                    "DELETE FROM jobs WHERE state IN (?, ?) AND updated_at < ?", (JOB_SENT, JOB_FAILED, cutoff)
+                )
+        return cursor.rowcount
+
+    def counts(self) -> Dict[str, int]:
+        """Количество заданий по состояниям"""
+        with self._lock:
+            rows = self._conn.execute("SELECT state, COUNT(*) AS total FROM jobs GROUP BY state").fetchall()
+        return {row['state']: row['total'] for row in rows}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_outbox: Optional[ReportOutbox] = None
+_outbox_lock = threading.Lock()
+
+
+def get_report_outbox() -> ReportOutbox:
+    """Возвращает общую для процесса очередь отчетов"""
+    global _outbox
+    with _outbox_lock:
+        if _outbox is None:
+            from config.settings import REPORT_OUTBOX_FILE, REPORT_MAX_ATTEMPTS, REPORT_RETRY_DELAY
+            _outbox = ReportOutbox(REPORT_OUTBOX_FILE, max_attempts=REPORT_MAX_ATTEMPTS, retry_delay=REPORT_RETRY_DELAY)
+        return _outbox
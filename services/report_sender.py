@@ -1,10 +1,8 @@
 import logging
-from typing import List, Dict
+from html import escape
+from typing import Dict, Iterable, List, Optional
 from telegram import Bot
-from services.selenium_collector import SeleniumCollector
-from services.bq_client import BigQueryClient
-from config.settings import ADMIN_EMAIL, ADMIN_PASSWORD, BIGQUERY_PROJECT_ID, GOOGLE_APPLICATION_CREDENTIALS_JSON
-from services.chat_manager import get_active_chats
+from services.chat_manager import get_active_chats, load_chats
 
 logger = logging.getLogger(__name__)
 
@@ -20,91 +18,79 @@ class ReportSender:
         """
         self.bot = bot
     
-    async def send_report_to_chats(self, collection_id: str, collection_name: str = None):
+    @staticmethod
+    def resolve_chats(chat_ids: Optional[Iterable[str]] = None) -> List[str]:
         """
-        Отправляет отчет по коллекции во все активные беседы
+        Возвращает беседы, в которые нужно отправить отчет
         
         Args:
-            collection_id: ID коллекции
-            collection_name: Название коллекции (опционально)
+            chat_ids: Беседы клиента (None - все активные беседы); беседы,
+                отключенные в chats.json, пропускаются
+        """
+        if chat_ids is None:
+            return [str(chat.get('chat_id')) for chat in get_active_chats() if chat.get('chat_id')]
+        inactive = {str(chat.get('chat_id')) for chat in load_chats() if not chat.get('is_active', True)}
+        return [str(chat_id) for chat_id in chat_ids if str(chat_id) not in inactive]
+    
+    @staticmethod
+    def format_report(collection_id: str, collection_name: Optional[str], report: Dict) -> str:
+        """Формирует текст отчета (HTML) - один формат для автоматической отправки и ручного вызова"""
+        # Формат:
+        # "Добрый вечер!\n"
+        # "\n"
+        # "Направляем пак {полное название коллекции}\n"
+        # "{ссылка}\n"
+        # "\n"
+        # "Статистика..."
+        
+        # Используем переданное название или получаем из отчета
+        if not collection_name:
+            collection_name = report.get('collection_name', 'Без названия')
+        
+        # Формируем ссылку
+        collection_url = f"https://admin.dresscode.ai/collection/{collection_id}"
+        
+        # Формируем сообщение с HTML форматированием для кликабельной ссылки
+        # Экранируем специальные символы HTML в названии коллекции и делаем жирным
+        escaped_name = escape(collection_name)
+        message = "Добрый вечер!\n"
+        message += "\n"
+        message += f"Направляем пак <b>{escaped_name}</b>\n"
+        message += f"<a href=\"{collection_url}\">{collection_url}</a>\n"
+        message += "\n"
+        
+        # Добавляем статистику
+        total_done = report.get('total_done', 0) or 0
+        combo_items = report.get('combo_items', 0) or 0
+        
+        if total_done:
+            message += f"Общее количество уникальных done-айтемов - {total_done}\n"
+        
+        if combo_items:
+            message += f"Из них combo-айтемов – {combo_items}\n"
+        
+        # Рассчитываем "Итого total done" = total_done + combo_items
+        total_done_items = total_done + combo_items
+        if total_done_items > 0:
+            message += f"Итого total done - {total_done_items} айтемов"
+        
+        return message
+    
+    async def send_to_chat(self, chat_id: str, message: str) -> bool:
+        """
+        Отправляет готовый отчет в одну беседу
+        
+        Returns:
+            True если сообщение отправлено
         """
         try:
-            # Собираем отчет через Selenium
-            collector = SeleniumCollector(ADMIN_EMAIL, ADMIN_PASSWORD)
-            
-            try:
-                if not collector.login():
-                    logger.error("Failed to login to admin panel")
-                    return
-                
-                report = collector.get_collection_report(collection_id)
-                
-                if not report:
-                    logger.error(f"Failed to get report for collection {collection_id}")
-                    return
-                
-                # Формируем сообщение в том же формате, что и ручной вызов
-                # Формат:
-                # "Добрый вечер!\n"
-                # "\n"
-                # "Направляем пак {полное название коллекции}\n"
-                # "{ссылка}\n"
-                # "\n"
-                # "Статистика..."
-                
-                # Используем переданное название или получаем из отчета
-                if not collection_name:
-                    collection_name = report.get('collection_name', 'Без названия')
-                
-                # Формируем ссылку
-                collection_url = f"https://admin.dresscode.ai/collection/{collection_id}"
-                
-                # Формируем сообщение с HTML форматированием для кликабельной ссылки
-                # Экранируем специальные символы HTML в названии коллекции и делаем жирным
-                from html import escape
-                escaped_name = escape(collection_name)
-                message = "Добрый вечер!\n"
-                message += "\n"
-                message += f"Направляем пак <b>{escaped_name}</b>\n"
-                message += f"<a href=\"{collection_url}\">{collection_url}</a>\n"
-                message += "\n"
-                
-                # Добавляем статистику
-                total_done = report.get('total_done', 0) or 0
-                combo_items = report.get('combo_items', 0) or 0
-                
-                if total_done:
-                    message += f"Общее количество уникальных done-айтемов - {total_done}\n"
-                
-                if combo_items:
-                    message += f"Из них combo-айтемов – {combo_items}\n"
-                
-                # Рассчитываем "Итого total done" = total_done + combo_items
-                total_done_items = total_done + combo_items
-                if total_done_items > 0:
-                    message += f"Итого total done - {total_done_items} айтемов"
-                
-                # Отправляем во все активные беседы
-                chats = get_active_chats()
-                
-                for chat in chats:
-                    chat_id = chat.get('chat_id')
-                    if not chat_id:
-                        continue
-                    
-                    try:
-                        await self.bot.send_message(
-                            chat_id=int(chat_id),
-                            text=message,
-                            parse_mode='HTML'
-                        )
-                        logger.info(f"Report sent to chat {chat_id}")
-                    except Exception as e:
-                        logger.error(f"Error sending report to chat {chat_id}: {e}")
-                
-            finally:
-                collector.close()
-                
+            await self.bot.send_message(
+                chat_id=int(chat_id),
+                text=message,
+                parse_mode='HTML'
+            )
+            logger.info(f"Report sent to chat {chat_id}")
+            return True
         except Exception as e:
-            logger.error(f"Error sending report to chats: {e}")
-
+            logger.error(f"Error sending report to chat {chat_id}: {e}")
+            return False
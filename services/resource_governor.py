@@ -0,0 +1,357 @@
+import os
+import time
+import signal
+import logging
+import multiprocessing
+from pathlib import Path
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+PROC_DIR = Path('/proc')
+
+
+def read_mem_available_mb() -> Optional[float]:
+    """
+    Возвращает объем доступной памяти из /proc/meminfo (MemAvailable) в МБ
+
+    Returns:
+        Доступная память в МБ или None, если /proc недоступен (например, Windows)
+    """
+    try:
+        with open(PROC_DIR / 'meminfo', 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    # Формат: "MemAvailable:    1234567 kB"
+                    return int(line.split()[1]) / 1024.0
+    except Exception as e:
+        logger.debug(f"Could not read /proc/meminfo: {e}")
+    return None
+
+
+def _read_stat(pid: int) -> Optional[Dict]:
+    """Читает имя процесса и PID родителя из /proc/<pid>/stat"""
+    try:
+        with open(PROC_DIR / str(pid) / 'stat', 'r', encoding='utf-8') as f:
+            data = f.read()
+        # Имя процесса в скобках может содержать пробелы, поэтому режем по последней ')'
+        name = data[data.index('(') + 1:data.rindex(')')]
+        fields = data[data.rindex(')') + 2:].split()
+        return {'pid': pid, 'name': name, 'ppid': int(fields[1])}
+    except Exception:
+        return None
+
+
+def list_processes() -> List[Dict]:
+    """Возвращает список процессов системы (pid, name, ppid)"""
+    processes = []
+    try:
+        for entry in PROC_DIR.iterdir():
+            if entry.name.isdigit():
+                stat = _read_stat(int(entry.name))
+                if stat:
+                    processes.append(stat)
+    except Exception as e:
+        logger.debug(f"Could not list processes: {e}")
+    return processes
+
+
+def _read_cmdline(pid: int) -> List[str]:
+    """Аргументы командной строки процесса (пустой список, если процесс завершился)"""
+    try:
+        with open(PROC_DIR / str(pid) / 'cmdline', 'rb') as f:
+            return [arg.decode('utf-8', 'replace') for arg in f.read().split(b'\0') if arg]
+    except Exception:
+        return []
+
+
+def _children_map(processes: List[Dict]) -> Dict[int, List[int]]:
+    children: Dict[int, List[int]] = {}
+    for proc in processes:
+        children.setdefault(proc['ppid'], []).append(proc['pid'])
+    return children
+
+
+def get_process_tree(root_pid: int, children: Optional[Dict[int, List[int]]] = None) -> List[int]:
+    """
+    Возвращает PID процесса и всех его потомков
+
+    Args:
+        root_pid: PID корневого процесса (например, chromedriver)
+        children: Готовая карта ppid -> [pid] (по умолчанию читается из /proc)
+    """
+    if children is None:
+        children = _children_map(list_processes())
+
+    tree = []
+    seen = set()
+    stack = [root_pid]
+    while stack:
+        pid = stack.pop()
+        if pid in seen:
+            continue
+        seen.add(pid)
+        tree.append(pid)
+        stack.extend(children.get(pid, []))
+    return tree
+
+
+def get_rss_mb(pids: List[int]) -> float:
+    """Суммарный RSS процессов (по /proc/<pid>/statm) в МБ"""
+    page_size = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+    total_pages = 0
+    for pid in pids:
+        try:
+            with open(PROC_DIR / str(pid) / 'statm', 'r', encoding='utf-8') as f:
+                total_pages += int(f.read().split()[1])
+        except Exception:
+            # Процесс мог уже завершиться
+            continue
+    return total_pages * page_size / (1024.0 * 1024.0)
+
+
+def kill_processes(pids: List[int], sig: int = signal.SIGKILL):
+    """Отправляет сигнал процессам, которые еще живы"""
+    for pid in pids:
+        try:
+            os.kill(pid, sig)
+        except ProcessLookupError:
+            pass
+        except Exception as e:
+            logger.debug(f"Could not kill process {pid}: {e}")
+
+
+def find_orphan_browser_processes() -> List[int]:
+    """
+    Ищет "осиротевшие" процессы Chrome - те, чей родитель (chromedriver или браузер)
+    уже завершился, вместе с их потомками
+
+    Деревья живых сессий (от каждого работающего chromedriver, в том числе из других
+    процессов-воркеров) не трогаем. chrome_crashpad_handler отделяется от браузера
+    и всегда выглядит осиротевшим, поэтому его убираем, только когда живых сессий
+    не осталось.
+    """
+    processes = list_processes()
+    by_pid = {proc['pid']: proc for proc in processes}
+    children = _children_map(processes)
+
+    protected = set(get_process_tree(os.getpid(), children))
+    for proc in processes:
+        if 'chromedriver' in proc['name'].lower():
+            protected.update(get_process_tree(proc['pid'], children))
+
+    orphans: List[int] = []
+    crashpad: List[int] = []
+    for proc in processes:
+        name = proc['name'].lower()
+        if 'chrome' not in name or 'chromedriver' in name or proc['pid'] in protected:
+            continue
+        if 'crashpad' in name or any('crashpad-handler' in arg for arg in _read_cmdline(proc['pid'])):
+            crashpad.append(proc['pid'])
+            continue
+        # Родитель жив (и это не init) - процесс принадлежит живому браузеру или чужой программе
+        if proc['ppid'] > 1 and proc['ppid'] in by_pid:
+            continue
+        orphans.extend(pid for pid in get_process_tree(proc['pid'], children) if pid not in protected)
+
+    live_browsers = any('chrome' in by_pid[pid]['name'].lower() and 'chromedriver' not in by_pid[pid]['name'].lower()
+                        for pid in protected if pid in by_pid)
+    if not live_browsers:
+        orphans.extend(pid for pid in crashpad if pid not in orphans)
+    return orphans
+
+
+class SharedBrowserSlots:
+    """
+    Учет локальных браузеров, общий для процессов-воркеров
+
+    Создается в процессе бота и передается воркерам при запуске (spawn): счетчики
+    у каждого воркера свои (их обнуляют при перезапуске упавшего воркера), а лимит,
+    проверка памяти и загрузка точек WebDriver считаются по сумме.
+    """
+
+    def __init__(self, workers: int, endpoints: int = 1, ctx=None):
+        """
+        Args:
+            workers: Количество процессов-воркеров
+            endpoints: Количество точек WebDriver (см. WebDriverEndpointPool)
+            ctx: Контекст multiprocessing (по умолчанию spawn, как у воркеров)
+        """
+        ctx = ctx or multiprocessing.get_context('spawn')
+        workers = max(1, workers)
+        self.endpoints = max(1, endpoints)
+        self.lock = ctx.Lock()
+        self.counts = ctx.Array('i', workers, lock=False)
+        # Сессии воркеров на точках WebDriver: [воркер * endpoints + точка]
+        self.endpoint_counts = ctx.Array('i', workers * self.endpoints, lock=False)
+        # До этого момента (time.time()) идет запуск браузера: следующий ждет, пока память
+        # занятая им, станет видна в MemAvailable (срок - на случай падения запускающего)
+        self.launch_until = ctx.Value('d', 0.0, lock=False)
+
+    def active(self) -> int:
+        """Сколько браузеров запущено всеми воркерами (вызывать под lock)"""
+        return sum(self.counts)
+
+    def endpoint_active(self, endpoint_index: int) -> int:
+        """Сколько сессий всех воркеров открыто на точке WebDriver (вызывать под lock)"""
+        return sum(self.endpoint_counts[endpoint_index::self.endpoints])
+
+    def reset(self, index: int):
+        """
+        Обнуляет счетчики воркера, процесс которого завершен (его осиротевшие
+        процессы Chrome убирает find_orphan_browser_processes при следующем запуске)
+        """
+        with self.lock:
+            self.counts[index] = 0
+            for i in range(self.endpoints):
+                self.endpoint_counts[index * self.endpoints + i] = 0
+
+
+class ResourceGovernor:
+    """
+    Контроль ресурсов для Chrome-коллекторов:
+    - допускает запуск нового браузера только при достаточном запасе памяти (/proc/meminfo)
+      и не больше max_collectors одновременно во всех процессах-воркерах (SharedBrowserSlots),
+      иначе задание ждет; браузеры запускаются по одному, чтобы проверка памяти учитывала
+      уже запущенные;
+    - решает, когда браузер пора пересоздать (по числу отчетов или по RSS дерева процессов).
+    """
+
+    def __init__(self, max_collectors: int, min_free_mb: float, max_rss_mb: float,
+                 max_reports: int, admission_timeout: float, slots: Optional[SharedBrowserSlots] = None,
+                 slot_index: int = 0, launch_grace: float = 60.0):
+        """
+        Инициализация контроллера ресурсов
+
+        Args:
+            max_collectors: Максимум одновременно запущенных браузеров (во всех воркерах)
+            min_free_mb: Минимальный запас MemAvailable для запуска нового браузера (МБ)
+            max_rss_mb: Порог RSS дерева процессов браузера для пересоздания (МБ)
+            max_reports: Через сколько отчетов пересоздавать браузер
+            admission_timeout: Сколько секунд задание может ждать допуска
+            slots: Общий учет браузеров воркеров (None - учет только в этом процессе)
+            slot_index: Номер воркера в slots
+            launch_grace: Максимальное время запуска браузера, на которое блокируется
+                допуск следующего (если запускающий не сообщил о завершении)
+        """
+        self.max_collectors = max_collectors
+        self.min_free_mb = min_free_mb
+        self.max_rss_mb = max_rss_mb
+        self.max_reports = max_reports
+        self.admission_timeout = admission_timeout
+        self.slots = slots or SharedBrowserSlots(1)
+        self.slot_index = slot_index if slots is not None else 0
+        self.launch_grace = launch_grace
+
+    @property
+    def active(self) -> int:
+        with self.slots.lock:
+            return self.slots.active()
+
+    def _has_memory_headroom(self) -> bool:
+        """Проверяет запас памяти для запуска еще одного браузера"""
+        available_mb = read_mem_available_mb()
+        if available_mb is None:
+            # Нет /proc - не можем измерить, не блокируем
+            return True
+        return available_mb >= self.min_free_mb
+
+    def admit(self, timeout: Optional[float] = None) -> bool:
+        """
+        Ждет разрешения на запуск нового браузера
+
+        После допуска вызывающий запускает браузер и сообщает об этом через
+        launched(); до тех пор (или до launch_grace) другие запуски ждут.
+
+        Args:
+            timeout: Максимальное время ожидания (по умолчанию admission_timeout)
+
+        Returns:
+            True если запуск разрешен, False если истек таймаут
+        """
+        timeout = self.admission_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        logged_wait = False
+
+        while True:
+            with self.slots.lock:
+                now = time.time()
+                active = self.slots.active()
+                if (self.slots.launch_until.value <= now and active < self.max_collectors
+                        and self._has_memory_headroom()):
+                    self.slots.counts[self.slot_index] += 1
+                    self.slots.launch_until.value = now + self.launch_grace
+                    logger.info(f"Browser admitted ({active + 1}/{self.max_collectors} active, "
+                                f"{read_mem_available_mb() or 0:.0f} MB available)")
+                    return True
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                logger.error(f"Browser admission timed out after {timeout}s "
+                             f"({active}/{self.max_collectors} active, "
+                             f"{read_mem_available_mb() or 0:.0f} MB available)")
+                return False
+
+            if not logged_wait:
+                logger.info("Not enough resources to start a browser, job is queued")
+                logged_wait = True
+            # Слот или память могут освободиться в другом процессе - перепроверяем периодически
+            time.sleep(min(remaining, 0.5))
+
+    def launched(self):
+        """Браузер запущен (или запуск не удался): можно допускать следующий"""
+        with self.slots.lock:
+            self.slots.launch_until.value = 0.0
+
+    def release(self):
+        """Освобождает слот после закрытия браузера"""
+        with self.slots.lock:
+            self.slots.counts[self.slot_index] = max(0, self.slots.counts[self.slot_index] - 1)
+
+    def browser_rss_mb(self, collector) -> Optional[float]:
+        """RSS дерева процессов браузера коллектора в МБ (None, если PID неизвестен)"""
+        root_pid = getattr(collector, 'browser_pid', None)
+        if not root_pid:
+            return None
+        return get_rss_mb(get_process_tree(root_pid))
+
+    def should_recycle(self, collector) -> bool:
+        """
+        Проверяет, нужно ли пересоздать браузер коллектора
+
+        Args:
+            collector: Экземпляр SeleniumCollector
+        """
+        if collector.reports_done >= self.max_reports:
+            logger.info(f"Recycling browser after {collector.reports_done} reports")
+            return True
+
+        rss_mb = self.browser_rss_mb(collector)
+        if rss_mb is not None and rss_mb > self.max_rss_mb:
+            logger.info(f"Recycling browser: RSS {rss_mb:.0f} MB exceeds {self.max_rss_mb:.0f} MB")
+            return True
+
+        return False
+
+
+def create_governor(slots: Optional[SharedBrowserSlots] = None, slot_index: int = 0) -> ResourceGovernor:
+    """
+    Создает контроллер ресурсов с настройками из config.settings
+
+    Args:
+        slots: Общий учет браузеров процессов-воркеров (создается в боте)
+        slot_index: Номер воркера
+    """
+    from config.settings import (
+        MAX_CHROME_COLLECTORS, CHROME_MIN_FREE_MB, CHROME_MAX_RSS_MB,
+        CHROME_MAX_REPORTS, COLLECTOR_ADMISSION_TIMEOUT
+    )
+    return ResourceGovernor(
+        max_collectors=MAX_CHROME_COLLECTORS,
+        min_free_mb=CHROME_MIN_FREE_MB,
+        max_rss_mb=CHROME_MAX_RSS_MB,
+        max_reports=CHROME_MAX_REPORTS,
+        admission_timeout=COLLECTOR_ADMISSION_TIMEOUT,
+        slots=slots,
+        slot_index=slot_index,
+    )
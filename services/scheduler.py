@@ -1,57 +1,308 @@
 import asyncio
+import time
 import logging
+from typing import Dict, List, Optional, Set
 from telegram import Bot
 from services.status_tracker import StatusTracker
 from services.report_sender import ReportSender
-from config.settings import STATUS_CHECK_INTERVAL, TELEGRAM_TOKEN
+from services.bq_client import get_bq_client
+from services.bq_async import get_async_bq_client
+from services.bq_transport import get_circuit_breaker
+from services.listing_cache import get_listing_cache
+from services.report_engine import get_report_engine
+from services.collections_mirror import get_collections_mirror
+from services.report_outbox import get_report_outbox
+from services.poll_cadence import PollCadence, parse_hour_profiles
+from services.leader_lease import LeaderLease
+from config.settings import (
+    STATUS_CHECK_INTERVAL, TELEGRAM_TOKEN, REPORT_DELIVERY_WORKERS, REPORT_DELIVERY_BATCH,
+    REPORT_OUTBOX_RETENTION, STATUS_MIN_INTERVAL, STATUS_MAX_INTERVAL, STATUS_INTERVAL_BACKOFF,
+    STATUS_INTERVAL_JITTER, STATUS_INTERVAL_PROFILES, LEADER_LEASE_FILE, LEADER_LEASE_TTL,
+    MIRROR_SYNC_INTERVAL, MIRROR_MAX_STALENESS
+)
 
 logger = logging.getLogger(__name__)
 
 class StatusScheduler:
-    """Планировщик для проверки изменений статусов и отправки отчетов"""
+    """
+    Планировщик для проверки изменений статусов и отправки отчетов
     
-    def __init__(self, bot: Bot):
+    Проверка статусов (детектор) и доставка отчетов разделены: детектор работает
+    с адаптивным интервалом (PollCadence) и записывает переходы в очередь отчетов на диске
+    (ReportOutbox), а отчеты собирают и отправляют воркеры доставки. Долгий сбор
+    отчета (Chrome) не задерживает следующую проверку, а сбой или перезапуск не
+    теряет обнаруженный переход: незавершенные задания продолжаются после запуска.
+    
+    Если запущено несколько экземпляров бота с общим каталогом data/, проверку и
+    доставку ведет только ведущий (держатель аренды LeaderLease); остальные
+    обслуживают команды и забирают аренду, если ведущий перестал ее продлевать.
+    """
+    
+    def __init__(self, bot: Bot, delivery_workers: int = REPORT_DELIVERY_WORKERS,
+                 delivery_batch: int = REPORT_DELIVERY_BATCH):
         """
         Инициализация планировщика
         
         Args:
             bot: Экземпляр Telegram бота
+            delivery_workers: Количество воркеров доставки отчетов
+            delivery_batch: Сколько коллекций из очереди воркер обрабатывает за раз
+                (статистика для них считается одним запросом)
         """
         self.bot = bot
-        self.tracker = StatusTracker()
+        # Один клиент BigQuery на процесс: учетные данные и HTTP-сессия переиспользуются
+        bq_client = get_bq_client()
+        self.mirror = get_collections_mirror()
+        self.tracker = StatusTracker(bq_client, self.mirror)
         self.report_sender = ReportSender(bot)
+        self.outbox = get_report_outbox()
+        self.breaker = get_circuit_breaker()
+        self.cadence = PollCadence(
+            STATUS_CHECK_INTERVAL, STATUS_MIN_INTERVAL, STATUS_MAX_INTERVAL,
+            backoff=STATUS_INTERVAL_BACKOFF, jitter=STATUS_INTERVAL_JITTER,
+            profiles=parse_hour_profiles(STATUS_INTERVAL_PROFILES)
+        )
+        # Копия коллекций не должна устаревать в тихий период, когда проверки редкие
+        self.mirror_sync_interval = MIRROR_SYNC_INTERVAL
+        if not 0 < self.mirror_sync_interval < MIRROR_MAX_STALENESS:
+            self.mirror_sync_interval = max(1, MIRROR_MAX_STALENESS // 2)
+            logger.warning(f"MIRROR_SYNC_INTERVAL={MIRROR_SYNC_INTERVAL} must be below "
+                           f"MIRROR_MAX_STALENESS={MIRROR_MAX_STALENESS}, using {self.mirror_sync_interval}s")
+        self._mirror_lock: Optional[asyncio.Lock] = None
+        self.lease = LeaderLease(LEADER_LEASE_FILE, ttl=LEADER_LEASE_TTL)
+        # Срок аренды, для которого уже подготовлено состояние (кэш статусов, очередь отчетов)
+        self._leader_term = 0
+        self.delivery_workers = max(1, delivery_workers)
+        self.delivery_batch = max(1, delivery_batch)
         self.is_running = False
+        self._queue: Optional[asyncio.Queue] = None
+        # Задания в очереди или в доставке - детектор не ставит их в очередь второй раз
+        self._pending: Set[int] = set()
+        self._workers: List[asyncio.Task] = []
     
     async def start(self):
-        """Запускает планировщик"""
+        """Запускает продление аренды, детектор и воркеры доставки"""
         self.is_running = True
-        logger.info("Status scheduler started")
+        self._queue = asyncio.Queue()
+        self._mirror_lock = asyncio.Lock()
+        self._workers = [
+            asyncio.create_task(self._delivery_worker(i), name=f"report-delivery-{i}")
+            for i in range(self.delivery_workers)
+        ]
+        # Первая попытка захвата до запуска детектора, чтобы ведущий начал проверку сразу
+        await asyncio.to_thread(self.lease.try_acquire)
+        self._workers.append(asyncio.create_task(self._lease_loop(), name="leader-lease"))
+        self._workers.append(asyncio.create_task(self._mirror_loop(), name="mirror-sync"))
+        logger.info(f"Status scheduler started as {self.lease.holder_id} ({self.delivery_workers} delivery workers), "
+                    f"cadence: {self.cadence.state()}")
         
+        try:
+            await self._detector_loop()
+        finally:
+            for worker in self._workers:
+                worker.cancel()
+            await asyncio.gather(*self._workers, return_exceptions=True)
+            self._workers = []
+            self.lease.release()
+    
+    async def _lease_loop(self):
+        """Захватывает или продлевает аренду ведущего каждую треть ее срока"""
+        while self.is_running:
+            await asyncio.sleep(self.lease.ttl / 3)
+            if not await asyncio.to_thread(self.lease.try_acquire):
+                # Аренды нет (или она истекла): задания, ждущие в памяти, доставит новый ведущий
+                # (они в очереди на диске)
+                self._drop_queued()
+    
+    async def _mirror_loop(self):
+        """Синхронизирует копию коллекций, если проверки статусов (адаптивный интервал) редки"""
         while self.is_running:
+            await asyncio.sleep(self.mirror_sync_interval / 2)
+            age = self.mirror.age_seconds()
+            if self.lease.is_leader and (age is None or age >= self.mirror_sync_interval):
+                await self._sync_mirror()
+    
+    async def _sync_mirror(self):
+        """
+        Подтягивает изменения таблицы коллекций в локальную копию (ее читают трекер
+        статусов и команды бота); при ошибке копия устареет и все чтения пойдут в
+        BigQuery напрямую
+        """
+        async with self._mirror_lock:
             try:
-                # Проверяем изменения статусов
-                changed_collections = self.tracker.check_status_changes()
-                
-                # Для каждой коллекции со статусом 'tsum cs' отправляем отчет
-                for collection in changed_collections:
-                    if collection.get('status') == 'tsum cs':
-                        collection_id = collection.get('collection_id')
-                        collection_name = collection.get('collection_name', '')
-                        
-                        logger.info(f"Sending report for collection {collection_id} ({collection_name})")
-                        await self.report_sender.send_report_to_chats(collection_id, collection_name)
+                await get_async_bq_client().run(self.mirror.sync)
+            except Exception as e:
+                logger.error(f"Error syncing collections mirror: {e}")
+    
+    def _drop_queued(self):
+        """Убирает из памяти задания, еще не взятые воркерами"""
+        while not self._queue.empty():
+            job = self._queue.get_nowait()
+            self._pending.discard(job['job_id'])
+            self._queue.task_done()
+    
+    async def _take_over(self):
+        """Готовит состояние после получения аренды: файлы мог менять прежний ведущий"""
+        await get_async_bq_client().run(self.tracker.reload)
+        # Задания, прерванные прежним ведущим (или прошлым запуском) на сборе отчета, собираются заново
+        await asyncio.to_thread(self.outbox.resume)
+        purged = await asyncio.to_thread(self.outbox.purge, REPORT_OUTBOX_RETENTION)
+        if purged:
+            logger.info(f"Purged {purged} finished report jobs")
+        counts = await asyncio.to_thread(self.outbox.counts)
+        logger.info(f"Leading status checks, report jobs: {counts}")
+        self._leader_term = self.lease.term
+    
+    async def _detector_loop(self):
+        """Проверяет изменения статусов с адаптивным интервалом и ставит изменения в очередь"""
+        while self.is_running:
+            # Ведомый экземпляр не опрашивает BigQuery и ждет освобождения аренды
+            if not self.lease.is_leader:
+                await asyncio.sleep(self.lease.ttl / 3)
+                continue
+            
+            started = time.monotonic()
+            transitions = 0
+            try:
+                if self._leader_term != self.lease.term:
+                    await self._take_over()
                 
-                # Ждем перед следующей проверкой
-                await asyncio.sleep(STATUS_CHECK_INTERVAL)
+                # BigQuery недоступен (circuit breaker разомкнут) - не опрашиваем его,
+                # а ждем, пока breaker пропустит пробный запрос
+                retry_after = self.breaker.retry_after()
+                if retry_after > 0:
+                    logger.warning(f"BigQuery is unavailable, next status check in {retry_after:.0f}s")
+                    await asyncio.sleep(retry_after)
+                    continue
                 
+                transitions = await self._detect()
             except Exception as e:
                 logger.error(f"Error in status scheduler: {e}")
-                await asyncio.sleep(STATUS_CHECK_INTERVAL)
+            
+            # Интервал отсчитывается от начала проверки: доставка отчетов его не сдвигает
+            delay = self.cadence.next_delay(transitions)
+            await asyncio.sleep(max(0.0, delay - (time.monotonic() - started)))
+    
+    async def _detect(self) -> int:
+        """
+        Одна проверка: синхронизация копии, поиск изменений, постановка заданий в очередь
+        
+        Returns:
+            Количество найденных переходов (для адаптивного интервала)
+        """
+        await self._sync_mirror()
+        
+        # Проверяем изменения статусов (в пуле потоков BigQuery, не блокируя бота);
+        # переходы записываются в очередь отчетов до сохранения кэша статусов
+        changed_collections = await get_async_bq_client().run(
+            self.tracker.check_status_changes, on_changes=self.outbox.add
+        )
+        
+        # Списки /collections устарели - сбрасываем общий кэш
+        if changed_collections:
+            get_listing_cache().invalidate()
+        
+        # В очередь воркеров идут все задания, которым пора: новые, отложенные
+        # после ошибки и оставшиеся от прошлого запуска. Очередь на диске
+        # (SQLite, fsync) читается и пишется в потоке, чтобы не блокировать бота
+        queued = 0
+        for job in await asyncio.to_thread(self.outbox.due_jobs):
+            if job['job_id'] in self._pending:
+                continue
+            self._pending.add(job['job_id'])
+            self._queue.put_nowait(job)
+            queued += 1
+        
+        if queued:
+            logger.info(f"Queued {queued} report jobs, {self._queue.qsize()} waiting for delivery")
+        return len(changed_collections)
+    
+    async def _next_batch(self) -> List[Dict]:
+        """Ждет задание в очереди и забирает вместе с ним уже накопившиеся (до delivery_batch)"""
+        batch = [await self._queue.get()]
+        while len(batch) < self.delivery_batch and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        return batch
+    
+    async def _delivery_worker(self, index: int):
+        """Воркер доставки: собирает отчеты по заданиям из очереди и отправляет их в беседы клиентов"""
+        while True:
+            batch = await self._next_batch()
+            try:
+                if not self.lease.is_leader:
+                    # Аренда потеряна - задания остаются в очереди на диске для нового ведущего
+                    logger.info(f"Not the leader, leaving {len(batch)} report jobs to the current leader")
+                    continue
+                await self._deliver(batch)
+            except Exception as e:
+                logger.error(f"Delivery worker {index} failed on {len(batch)} report jobs: {e}")
+            finally:
+                for job in batch:
+                    self._pending.discard(job['job_id'])
+                    self._queue.task_done()
+    
+    async def _deliver(self, jobs: List[Dict]):
+        """Собирает недостающие отчеты пачки и отправляет их"""
+        # Отчет, собранный в прошлой попытке, хранится в задании - собираем только остальные.
+        # Статистика по всем коллекциям пачки (всех клиентов) считается одним запросом
+        to_collect = [job for job in jobs if job['report'] is None]
+        if to_collect:
+            await asyncio.to_thread(self.outbox.mark_collecting, [job['job_id'] for job in to_collect])
+            try:
+                reports = await get_report_engine().collect_reports(
+                    [job['collection_id'] for job in to_collect]
+                )
+            except Exception as e:
+                reports = {}
+                logger.error(f"Error collecting {len(to_collect)} reports: {e}")
+            
+            for job in to_collect:
+                report, error_msg = reports.get(job['collection_id'], (None, 'report was not collected'))
+                if error_msg or not report:
+                    logger.error(f"Failed to collect report for collection {job['collection_id']}: {error_msg}")
+                    await asyncio.to_thread(self.outbox.retry_later, job['job_id'], error_msg or 'empty report')
+                    continue
+                await asyncio.to_thread(self.outbox.store_report, job['job_id'], report)
+                job['report'] = report
+        
+        for job in jobs:
+            if job['report'] is not None:
+                await self._send(job)
+    
+    async def _send(self, job: Dict):
+        """
+        Отправляет отчет задания в беседы его клиента
+        
+        Отправка в каждую беседу отмечается в очереди: при повторе отчет уходит
+        только в беседы, где он не дошел. Доставка "хотя бы один раз" - если процесс
+        упадет между отправкой сообщения и отметкой, беседа получит отчет повторно.
+        """
+        collection_id = job['collection_id']
+        tenant = next((t for t in self.tracker.tenants if t.tenant_id == job['tenant_id']), None)
+        chat_ids = self.report_sender.resolve_chats(tenant.chats if tenant else None)
+        message = self.report_sender.format_report(collection_id, job['collection_name'], job['report'])
+        
+        logger.info(f"Sending report for collection {collection_id} ({job['collection_name']}), "
+                    f"tenant {job['tenant_id']}")
+        failed = 0
+        for chat_id in await asyncio.to_thread(self.outbox.pending_chats, job['job_id'], chat_ids):
+            # Аренда истекла во время доставки - оставшиеся беседы получат отчет от нового
+            # ведущего; продолжив, отправили бы его дважды
+            if not self.lease.is_leader:
+                logger.warning(f"Leader lease expired, leaving job {job['job_id']} to the current leader")
+                return
+            if await self.report_sender.send_to_chat(chat_id, message):
+                await asyncio.to_thread(self.outbox.mark_delivered, job['job_id'], chat_id)
+            else:
+                failed += 1
+        
+        if failed:
+            await asyncio.to_thread(self.outbox.retry_later, job['job_id'], f"not delivered to {failed} chats")
+        else:
+            await asyncio.to_thread(self.outbox.mark_sent, job['job_id'])
     
     def stop(self):
-        """Останавливает планировщик"""
+        """Останавливает планировщик и отдает аренду ведущего"""
         self.is_running = False
+        self.lease.release()
         logger.info("Status scheduler stopped")
-
-
-
@@ -12,22 +12,45 @@ from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.common.action_chains import ActionChains
 from webdriver_manager.chrome import ChromeDriverManager
-from typing import Optional, Dict
+from selenium.common.exceptions import StaleElementReferenceException
+from typing import Optional, Dict, Callable
+from services.network_tracker import NetworkActivityTracker
+from services.webdriver_endpoints import LOCAL_ENDPOINT
+from services.resource_governor import find_orphan_browser_processes, get_process_tree, kill_processes
 import sys
 import io
 
 logger = logging.getLogger(__name__)
 
+# Этапы сбора отчета (checkpoints) в порядке выполнения
+REPORT_STAGES = ('session', 'showoff_view', 'search_results', 'edit_panel', 'stats')
+
+
+class ReportStageError(Exception):
+    """Ошибка на этапе сбора отчета"""
+    
+    def __init__(self, message: str, rewind_to: Optional[str] = None):
+        """
+        Args:
+            message: Описание ошибки
+            rewind_to: Этап, с которого нужно продолжить (по умолчанию - упавший этап)
+        """
+        super().__init__(message)
+        self.rewind_to = rewind_to
+
+
 class SeleniumCollector:
     """Класс для сбора отчетов через Selenium"""
     
-    def __init__(self, email: str, password: str):
+    def __init__(self, email: str, password: str, endpoint: Optional[str] = None):
         """
         Инициализация Selenium драйвера для работы с Мозаикой
         
         Args:
             email: Email для входа в Мозаику
             password: Пароль для входа в Мозаику
+            endpoint: Адрес удаленного WebDriver (chromedriver или Selenium standalone);
+                None или 'local' - локальный Chrome под Xvfb
         """
         if not email:
             raise ValueError("Email is required for SeleniumCollector")
@@ -36,58 +59,50 @@ class SeleniumCollector:
         
         self.email = email
         self.password = password
+        self.endpoint = endpoint or LOCAL_ENDPOINT
         self.driver = None
         self.wait = None
+        self.network = None
+        # Последний успешно пройденный этап сбора отчета на этом драйвере
+        self.checkpoint = None
+        self.logged_in = False
+        # Количество отчетов, собранных этим браузером (для пересоздания)
+        self.reports_done = 0
+        # PID процесса chromedriver - корень дерева процессов браузера
+        self.browser_pid = None
         # Путь к файлу cookies (в Docker - /app/data, локально - ./data)
         if sys.platform == 'win32' or not Path("/app").exists():
             self.cookies_file = Path("data/google_cookies.json")
         else:
             self.cookies_file = Path("/app/data/google_cookies.json")
         
-        # Очищаем зависшие процессы Chrome перед инициализацией (только в Linux)
-        if sys.platform != 'win32':
+        # Очищаем зависшие процессы Chrome перед инициализацией (только локально в Linux)
+        if sys.platform != 'win32' and not self.is_remote:
             self._cleanup_stale_chrome_processes()
         
         self._init_driver()
     
+    @property
+    def is_remote(self) -> bool:
+        """Браузер запущен на удаленной точке WebDriver"""
+        return self.endpoint != LOCAL_ENDPOINT
+    
     def _cleanup_stale_chrome_processes(self):
-        """Очищает зависшие процессы Chrome перед инициализацией нового браузера"""
+        """
+        Очищает зависшие процессы Chrome перед инициализацией нового браузера.
+        Убиваем только "осиротевшие" браузеры (их chromedriver уже завершился),
+        чтобы не задеть браузеры других коллекторов, работающих параллельно.
+        """
         try:
-            import subprocess
-            import time
-            # Проверяем, есть ли процессы Chrome
-            result = subprocess.run(['ps', 'aux'], 
-                                  capture_output=True, 
-                                  text=True,
-                                  timeout=2)
-            if result.returncode == 0:
-                chrome_processes = [line for line in result.stdout.split('\n') 
-                                  if 'chrome' in line.lower() and 'grep' not in line.lower()]
-                # Очищаем только если процессов много (более 5) - это явно зависшие
-                # Если процессов мало, возможно они еще закрываются
-                if len(chrome_processes) > 5:
-                    logger.info(f"Found {len(chrome_processes)} stale Chrome processes (>{5}), cleaning up...")
-                    # Более мягкое закрытие сначала
-                    subprocess.run(['pkill', '-TERM', '-f', 'chrome'], 
-                                 capture_output=True, 
-                                 timeout=2,
-                                 check=False)
-                    time.sleep(1)  # Даем время на корректное закрытие
-                    # Только если процессы остались - убиваем принудительно
-                    result2 = subprocess.run(['ps', 'aux'], 
-                                            capture_output=True, 
-                                            text=True,
-                                            timeout=2)
-                    if result2.returncode == 0:
-                        remaining = [line for line in result2.stdout.split('\n') 
-                                    if 'chrome' in line.lower() and 'grep' not in line.lower()]
-                        if len(remaining) > 5:
-                            logger.warning(f"Still {len(remaining)} Chrome processes, forcing kill...")
-                            subprocess.run(['pkill', '-9', '-f', 'chrome'], 
-                                         capture_output=True, 
-                                         timeout=2,
-                                         check=False)
-                            time.sleep(0.5)
+            import signal
+            stale_pids = find_orphan_browser_processes()
+            if stale_pids:
+                logger.info(f"Found {len(stale_pids)} orphaned Chrome processes, cleaning up...")
+                # Более мягкое закрытие сначала
+                kill_processes(stale_pids, signal.SIGTERM)
+                time.sleep(1)  # Даем время на корректное закрытие
+                # Только если процессы остались - убиваем принудительно
+                kill_processes(stale_pids, signal.SIGKILL)
         except Exception as e:
             logger.debug(f"Could not cleanup stale Chrome processes: {e}")
     
@@ -128,8 +143,12 @@ class SeleniumCollector:
             chrome_options.add_argument('--disable-infobars')
             chrome_options.add_argument('--disable-extensions')
             
+            # Включаем performance-лог, чтобы получать события DevTools Network.*
+            # (по ним определяем, когда страница закончила загрузку данных)
+            chrome_options.set_capability('goog:loggingPrefs', {'performance': 'ALL'})
+            
             # Проверяем доступность виртуального дисплея перед инициализацией
-            if sys.platform != 'win32':
+            if sys.platform != 'win32' and not self.is_remote:
                 # Проверяем, что Xvfb запущен
                 import subprocess
                 try:
@@ -142,21 +161,34 @@ class SeleniumCollector:
                 except:
                     pass
             
-            # Используем webdriver-manager для автоматической установки драйвера
-            try:
-                driver_path = ChromeDriverManager().install()
-                service = Service(driver_path)
-                # Добавляем небольшую задержку перед инициализацией для стабильности
-                time.sleep(0.5)
-                self.driver = webdriver.Chrome(service=service, options=chrome_options)
-            except Exception as e:
-                logger.warning(f"Error with webdriver-manager: {e}, trying system ChromeDriver")
-                time.sleep(0.5)
-                self.driver = webdriver.Chrome(options=chrome_options)
+            if self.is_remote:
+                # Удаленный chromedriver / Selenium standalone - браузер живет на другом хосте
+                self.driver = webdriver.Remote(command_executor=self.endpoint, options=chrome_options)
+            else:
+                # Используем webdriver-manager для автоматической установки драйвера
+                try:
+                    driver_path = ChromeDriverManager().install()
+                    service = Service(driver_path)
+                    # Добавляем небольшую задержку перед инициализацией для стабильности
+                    time.sleep(0.5)
+                    self.driver = webdriver.Chrome(service=service, options=chrome_options)
+                except Exception as e:
+                    logger.warning(f"Error with webdriver-manager: {e}, trying system ChromeDriver")
+                    time.sleep(0.5)
+                    self.driver = webdriver.Chrome(options=chrome_options)
             
             self.wait = WebDriverWait(self.driver, 30)
+            from config.settings import NETWORK_IDLE_STALE_REQUEST, NETWORK_LONG_POLL_PATTERNS
+            self.network = NetworkActivityTracker(self.driver, stale_request_seconds=NETWORK_IDLE_STALE_REQUEST,
+                                                  long_poll_patterns=NETWORK_LONG_POLL_PATTERNS or None)
             
-            logger.info("Selenium driver initialized successfully")
+            # Дерево процессов отслеживаем только для локального браузера
+            try:
+                self.browser_pid = None if self.is_remote else self.driver.service.process.pid
+            except Exception:
+                self.browser_pid = None
+            
+            logger.info(f"Selenium driver initialized successfully ({self.endpoint})")
             
             # Пробуем загрузить сохраненные cookies (только если файл существует)
             # Не загружаем при первом запуске save_cookies.py
@@ -170,6 +202,15 @@ class SeleniumCollector:
             logger.error(f"Failed to initialize Selenium driver: {e}")
             raise
     
+    def _wait_for_network_idle(self) -> bool:
+        """Ждет, пока Мозаика закончит сетевые запросы после навигации или действия"""
+        from config.settings import NETWORK_IDLE_QUIET_MS, NETWORK_IDLE_TIMEOUT
+        
+        if not self.network:
+            time.sleep(NETWORK_IDLE_QUIET_MS / 1000.0)
+            return False
+        return self.network.wait_for_network_idle(NETWORK_IDLE_QUIET_MS, NETWORK_IDLE_TIMEOUT)
+    
     def _load_cookies(self):
         """Загружает сохраненные cookies Google, если они есть"""
         try:
@@ -206,6 +247,11 @@ class SeleniumCollector:
         Returns:
             True если вход успешен, False в противном случае
         """
+        self.logged_in = self._login()
+        return self.logged_in
+    
+    def _login(self) -> bool:
+        """Выполняет вход в Мозаику (см. login)"""
         try:
             from config.settings import MOSAICA_URL
             from selenium.webdriver.common.action_chains import ActionChains
@@ -218,7 +264,7 @@ class SeleniumCollector:
                     logger.info("Trying to use saved cookies...")
                     # Переходим на Мозаику
                     self.driver.get(MOSAICA_URL)
-                    time.sleep(2)
+                    self._wait_for_network_idle()
                     
                     # Загружаем cookies для Мозаики
                     with open(self.cookies_file, 'r', encoding='utf-8') as f:
@@ -239,7 +285,7 @@ class SeleniumCollector:
                     
                     # Обновляем страницу
                     self.driver.refresh()
-                    time.sleep(3)
+                    self._wait_for_network_idle()
                     
                     # Проверяем, авторизованы ли мы
                     current_url = self.driver.current_url
@@ -255,7 +301,7 @@ class SeleniumCollector:
             # Переходим на главную страницу Мозаики (не /login)
             self.driver.get(MOSAICA_URL)
             logger.info(f"Opened {MOSAICA_URL}")
-            time.sleep(2)
+            self._wait_for_network_idle()
             
             # Ищем кнопку "Please, Login"
             logger.info("Looking for 'Please, Login' button...")
@@ -745,7 +791,8 @@ class SeleniumCollector:
             self.wait.until(
                 lambda driver: driver.execute_script("return document.readyState") == "complete"
             )
-            time.sleep(5)  # Дополнительное ожидание для загрузки JavaScript
+            # Ждем, пока отработают запросы за скриптами и данными приложения
+            self._wait_for_network_idle()
             
             # Пробуем вызвать функцию view_custom_collections()
             function_exists = False
@@ -765,7 +812,7 @@ class SeleniumCollector:
             if function_exists:
                 self.driver.execute_script("view_custom_collections();")
                 logger.info("Function view_custom_collections() called")
-                time.sleep(5)
+                self._wait_for_network_idle()
                 
                 # Проверяем, что мы на правильной странице
                 current_url = self.driver.current_url
@@ -777,7 +824,7 @@ class SeleniumCollector:
                 # Альтернативный способ - через hash
                 try:
                     self.driver.execute_script("window.location.hash = '#/collections';")
-                    time.sleep(3)
+                    self._wait_for_network_idle()
                     return True
                 except:
                     pass
@@ -897,9 +944,9 @@ class SeleniumCollector:
                     }
                 """, search_field)
                 
-                # Ждем результатов поиска (увеличено время ожидания)
+                # Ждем результатов поиска (пока не завершатся запросы фильтрации)
                 logger.info("Waiting for search results to appear...")
-                time.sleep(3)  # Увеличено с 2 до 3 секунд
+                self._wait_for_network_idle()
                 
                 # Проверяем, что значение все еще в поле
                 final_value = search_field.get_attribute("value")
@@ -1112,202 +1159,286 @@ class SeleniumCollector:
             logger.error(f"Error in click_collection: {e}")
             return False
     
-    def get_collection_report(self, collection_id: str) -> Optional[Dict]:
+    def _is_on_mosaica(self) -> bool:
+        """Проверяет, что браузер находится в авторизованной Мозаике"""
+        try:
+            current_url = self.driver.current_url.lower()
+        except Exception:
+            return False
+        return "mosaica.ai" in current_url and "accounts.google.com" not in current_url and "login" not in current_url
+    
+    def _stage_session(self, state: Dict):
+        """Этап 1: есть живая авторизованная сессия в Мозаике"""
+        if self._is_on_mosaica():
+            return
+        
+        logger.info("Session is not active, logging in again...")
+        # Сессии больше нет - checkpoint раздела Showoff тоже недействителен
+        self.checkpoint = None
+        if not self.login():
+            raise ReportStageError("Failed to login to Mosaica")
+    
+    def _stage_showoff_view(self, state: Dict):
+        """Этап 2: открыт раздел Showoff Collections"""
+        # Если раздел уже открыт на этом драйвере (предыдущий отчет), повторно не переходим
+        if self.checkpoint in REPORT_STAGES[REPORT_STAGES.index('showoff_view'):]:
+            if self.driver.find_elements(By.ID, "so_search_coll_name"):
+                logger.info("Showoff Collections already open, skipping navigation")
+                return
+        
+        if not self.navigate_to_showoff_collections():
+            raise ReportStageError("Failed to navigate to Showoff Collections")
+    
+    def _stage_search_results(self, state: Dict):
+        """Этап 3: коллекция найдена поиском и видна в списке"""
+        collection_id = state['collection_id']
+        
+        if not self.search_collection_by_id(collection_id):
+            raise ReportStageError(f"Failed to search for collection {collection_id}", rewind_to='showoff_view')
+        
+        # Ищем коллекцию в списке по data-id
+        try:
+            state['collection_li'] = self.wait.until(
+                EC.presence_of_element_located((By.XPATH, f'//li[@data-id="{collection_id}"]'))
+            )
+            logger.info(f"Found collection in list with data-id: {collection_id}")
+            return
+        except Exception:
+            logger.warning(f"Could not find collection by exact data-id, trying alternative...")
+        
+        # Пробуем найти по части ID
+        try:
+            state['collection_li'] = self.wait.until(
+                EC.presence_of_element_located((By.XPATH, f'//li[contains(@data-id, "{collection_id[:8]}")]'))
+            )
+            logger.info(f"Found collection by partial data-id")
+        except Exception:
+            raise ReportStageError("Could not find collection in list")
+    
+    def _stage_edit_panel(self, state: Dict):
+        """Этап 4: открыта форма редактирования коллекции (кнопка с иконкой карандаша)"""
+        # ВАЖНО: НЕ кликаем на коллекцию, а только на кнопку редактирования!
+        collection_id = state['collection_id']
+        collection_li = state.get('collection_li')
+        if collection_li is None:
+            raise ReportStageError("Collection list item is missing", rewind_to='search_results')
+        
+        edit_button = None
+        edit_button_id = f"so_coll_edit_button_{collection_id}"
+        
+        try:
+            # Пробуем найти по ID
+            try:
+                edit_button = collection_li.find_element(By.ID, edit_button_id)
+                logger.info(f"Found edit button by ID: {edit_button_id}")
+            except StaleElementReferenceException:
+                raise
+            except Exception:
+                # Пробуем другие селекторы
+                edit_button_selectors = [
+                    (By.XPATH, f'.//button[@id="{edit_button_id}"]'),
+                    (By.XPATH, './/button[contains(@id, "so_coll_edit_button")]'),
+                    (By.XPATH, './/button[contains(@class, "edit")]'),
+                    (By.CSS_SELECTOR, 'button[id*="edit"]'),
+                ]
+                
+                for by, selector in edit_button_selectors:
+                    try:
+                        edit_button = collection_li.find_element(by, selector)
+                        logger.info(f"Found edit button using selector: {selector}")
+                        break
+                    except StaleElementReferenceException:
+                        raise
+                    except Exception:
+                        continue
+        except StaleElementReferenceException:
+            # Список перерисовался - элемент нужно найти заново
+            raise ReportStageError("Collection list item went stale", rewind_to='search_results')
+        
+        if edit_button:
+            # Прокручиваем к кнопке
+            self.driver.execute_script("arguments[0].scrollIntoView({block: 'center', behavior: 'smooth'});", edit_button)
+            time.sleep(0.5)
+            
+            # Кликаем на кнопку редактирования
+            try:
+                edit_button.click()
+                logger.info("Edit button clicked")
+            except Exception:
+                self.driver.execute_script("arguments[0].click();", edit_button)
+                logger.info("Edit button clicked via JavaScript")
+        else:
+            logger.warning("Could not find edit button in collection item")
+            # Пробуем открыть форму редактирования через JavaScript
+            self.driver.execute_script("""
+                if (typeof $('#so_collection_edit').length !== 'undefined' && $('#so_collection_edit').length > 0) {
+                    $('#so_collection_edit').addClass('is-active');
+                    $('.js_custom_collection').addClass('has-edition');
+                    $('.js_select_coll_li').addClass('is-edited');
+                }
+            """)
+        
+        # Ждем открытия формы редактирования
+        self._wait_for_network_idle()
+    
+    def _stage_stats(self, state: Dict):
+        """Этап 5: прочитана статистика из textarea с id="so_coll_stat" (поле Stat)"""
+        stat_textarea = None
+        try:
+            stat_textarea = self.wait.until(
+                EC.presence_of_element_located((By.ID, "so_coll_stat"))
+            )
+        except Exception as e:
+            logger.error(f"Could not find stats textarea (so_coll_stat): {e}")
+            # Пробуем найти через XPath
+            try:
+                stat_textarea = self.driver.find_element(By.XPATH, '//textarea[@id="so_coll_stat"]')
+            except Exception:
+                # Форма редактирования, скорее всего, не открылась - кликаем еще раз
+                raise ReportStageError("Could not find stats textarea by any method", rewind_to='edit_panel')
+        
+        stats_text = stat_textarea.get_attribute("value") or stat_textarea.text
+        # Очищаем от шапки и яндекс ссылок
+        if stats_text:
+            stats_text = self._clean_stats_text(stats_text)
+        logger.info(f"Found stats text: {stats_text[:100] if stats_text else 'None'}...")
+        state['stats_text'] = stats_text
+    
+    def _parse_stats(self, collection_id: str, stats_text: Optional[str]) -> Dict:
+        """
+        Формирует данные отчета из текста статистики
+        
+        Args:
+            collection_id: ID коллекции
+            stats_text: Очищенный текст статистики
+        
+        Returns:
+            Словарь с данными отчета
+        """
+        # Формируем ссылку на коллекцию из ID (ID уже есть, браузер не нужен)
+        collection_link = f"https://admin.dresscode.ai/collection/{collection_id}"
+        logger.info(f"Generated collection link: {collection_link}")
+        
+        report_data = {
+            'collection_id': collection_id,
+            'collection_url': collection_link,
+            'stats_text': stats_text,
+            'total_done': None,
+            'combo_items': None,
+            'total_done_items': None,
+        }
+        
+        if stats_text:
+            # Парсим данные из текста статистики
+            try:
+                import re
+                
+                # Паттерн 1: "X total done items" (например, "423 total done items")
+                total_done_match = re.search(r'(\d+)\s+total\s+done\s+items?', stats_text, re.IGNORECASE)
+                if total_done_match:
+                    report_data['total_done'] = int(total_done_match.group(1))
+                
+                # Паттерн 2: "X combinations done" (например, "316 combinations done")
+                combo_match = re.search(r'(\d+)\s+combinations?\s+done', stats_text, re.IGNORECASE)
+                if combo_match:
+                    report_data['combo_items'] = int(combo_match.group(1))
+                
+                # Паттерн 3: "X total done" (без слова items)
+                if not report_data['total_done']:
+                    total_done_match2 = re.search(r'(\d+)\s+total\s+done(?!\s+items)', stats_text, re.IGNORECASE)
+                    if total_done_match2:
+                        report_data['total_done'] = int(total_done_match2.group(1))
+                
+                # Паттерн 4: "Общее количество уникальных done-айтемов - X" или "– X"
+                if not report_data['total_done']:
+                    total_done_pattern = re.search(r'Общее\s+количество\s+уникальных\s+done-айтемов\s*[–-]\s*(\d+)', stats_text, re.IGNORECASE)
+                    if total_done_pattern:
+                        report_data['total_done'] = int(total_done_pattern.group(1))
+                
+                # Паттерн 5: "Из них combo-айтемов – X"
+                if not report_data['combo_items']:
+                    combo_pattern = re.search(r'Из\s+них\s+combo-айтемов\s*[–-]\s*(\d+)', stats_text, re.IGNORECASE)
+                    if combo_pattern:
+                        report_data['combo_items'] = int(combo_pattern.group(1))
+                
+                # Паттерн 6: "Итого total done - X айтемов" (если есть, используем, но обычно считаем сами)
+                total_match = re.search(r'Итого\s+total\s+done\s*[-–]\s*(\d+)', stats_text, re.IGNORECASE)
+                if total_match:
+                    report_data['total_done_items'] = int(total_match.group(1))
+                
+                # Если не нашли total_done_items, рассчитываем: total_done + combo_items
+                if report_data['total_done'] and report_data['combo_items']:
+                    report_data['total_done_items'] = report_data['total_done'] + report_data['combo_items']
+                
+            except Exception as e:
+                logger.warning(f"Error parsing stats: {e}")
+        
+        return report_data
+    
+    def get_collection_report(self, collection_id: str, on_stage: Optional[Callable[[str], None]] = None) -> Optional[Dict]:
         """
         Собирает отчет по коллекции из Мозаики
-        Логика: переход в Showoff -> поиск по ID -> 
+        Логика: сессия -> переход в Showoff -> поиск по ID -> 
         открыть редактирование -> получить статистику
         
+        Каждый этап - checkpoint. При сбое повторяется только упавший этап
+        (или ближайший этап, от которого он зависит) на том же драйвере,
+        не более REPORT_STAGE_RETRIES раз на этап. Браузер не закрывается -
+        это делает вызывающий код.
+        
         Args:
             collection_id: ID коллекции
+            on_stage: Callback, вызываемый с названием этапа перед его выполнением
         
         Returns:
             Словарь с данными отчета или None
         """
+        from config.settings import REPORT_STAGE_RETRIES
+        
+        stages = {
+            'session': self._stage_session,
+            'showoff_view': self._stage_showoff_view,
+            'search_results': self._stage_search_results,
+            'edit_panel': self._stage_edit_panel,
+            'stats': self._stage_stats,
+        }
+        
+        self._current_collection_id = collection_id
+        state = {'collection_id': collection_id}
+        failures = {name: 0 for name in REPORT_STAGES}
+        stage_index = 0
+        
         try:
-            # 1. Переходим в Showoff Collections
-            if not self.navigate_to_showoff_collections():
-                logger.error("Failed to navigate to Showoff Collections")
-                return None
-            
-            # 2. Ищем коллекцию по ID
-            if not self.search_collection_by_id(collection_id):
-                logger.error(f"Failed to search for collection {collection_id}")
-                return None
-            
-            time.sleep(2)  # Ждем результатов поиска
-            
-            # 3. Находим коллекцию в списке и нажимаем на кнопку редактирования (иконка карандаша)
-            # ВАЖНО: НЕ кликаем на коллекцию, а только на кнопку редактирования!
-            stats_text = None
-            try:
-                # Ищем коллекцию в списке по data-id
-                collection_li = None
-                try:
-                    collection_li = self.wait.until(
-                        EC.presence_of_element_located((By.XPATH, f'//li[@data-id="{collection_id}"]'))
-                    )
-                    logger.info(f"Found collection in list with data-id: {collection_id}")
-                except:
-                    logger.warning(f"Could not find collection by exact data-id, trying alternative...")
-                    # Пробуем найти по части ID
-                    try:
-                        collection_li = self.wait.until(
-                            EC.presence_of_element_located((By.XPATH, f'//li[contains(@data-id, "{collection_id[:8]}")]'))
-                        )
-                        logger.info(f"Found collection by partial data-id")
-                    except:
-                        logger.error("Could not find collection in list")
-                        return None
-                
-                if collection_li:
-                    # Ищем кнопку редактирования (иконка карандаша) внутри этого li
-                    edit_button = None
-                    edit_button_id = f"so_coll_edit_button_{collection_id}"
-                    
-                    # Пробуем найти по ID
+            while stage_index < len(REPORT_STAGES):
+                stage = REPORT_STAGES[stage_index]
+                if on_stage:
                     try:
-                        edit_button = collection_li.find_element(By.ID, edit_button_id)
-                        logger.info(f"Found edit button by ID: {edit_button_id}")
-                    except:
-                        # Пробуем другие селекторы
-                        edit_button_selectors = [
-                            (By.XPATH, f'.//button[@id="{edit_button_id}"]'),
-                            (By.XPATH, './/button[contains(@id, "so_coll_edit_button")]'),
-                            (By.XPATH, './/button[contains(@class, "edit")]'),
-                            (By.CSS_SELECTOR, 'button[id*="edit"]'),
-                        ]
-                        
-                        for by, selector in edit_button_selectors:
-                            try:
-                                edit_button = collection_li.find_element(by, selector)
-                                logger.info(f"Found edit button using selector: {selector}")
-                                break
-                            except:
-                                continue
-                    
-                    if edit_button:
-                        # Прокручиваем к кнопке
-                        self.driver.execute_script("arguments[0].scrollIntoView({block: 'center', behavior: 'smooth'});", edit_button)
-                        time.sleep(0.5)
-                        
-                        # Кликаем на кнопку редактирования
-                        try:
-                            edit_button.click()
-                            logger.info("Edit button clicked")
-                        except:
-                            self.driver.execute_script("arguments[0].click();", edit_button)
-                            logger.info("Edit button clicked via JavaScript")
-                        
-                        time.sleep(2)  # Ждем открытия формы редактирования
-                    else:
-                        logger.warning("Could not find edit button in collection item")
-                        # Пробуем открыть форму редактирования через JavaScript
-                        self.driver.execute_script("""
-                            if (typeof $('#so_collection_edit').length !== 'undefined' && $('#so_collection_edit').length > 0) {
-                                $('#so_collection_edit').addClass('is-active');
-                                $('.js_custom_collection').addClass('has-edition');
-                                $('.js_select_coll_li').addClass('is-edited');
-                            }
-                        """)
-                        time.sleep(2)
-                else:
-                    logger.error("Could not find collection in list")
-                    return None
+                        on_stage(stage)
+                    except Exception as e:
+                        logger.debug(f"Stage callback error: {e}")
                 
-                # 4. Теперь ищем textarea с id="so_coll_stat" (поле Stat) и получаем статистику
                 try:
-                    stat_textarea = self.wait.until(
-                        EC.presence_of_element_located((By.ID, "so_coll_stat"))
-                    )
-                    stats_text = stat_textarea.get_attribute("value") or stat_textarea.text
-                    # Очищаем от шапки и яндекс ссылок
-                    if stats_text:
-                        stats_text = self._clean_stats_text(stats_text)
-                    logger.info(f"Found stats text: {stats_text[:100] if stats_text else 'None'}...")
+                    stages[stage](state)
                 except Exception as e:
-                    logger.error(f"Could not find stats textarea (so_coll_stat): {e}")
-                    # Пробуем найти через XPath
-                    try:
-                        stat_textarea = self.driver.find_element(By.XPATH, '//textarea[@id="so_coll_stat"]')
-                        stats_text = stat_textarea.get_attribute("value") or stat_textarea.text
-                        # Очищаем от шапки и яндекс ссылок
-                        if stats_text:
-                            stats_text = self._clean_stats_text(stats_text)
-                        logger.info(f"Found stats text via XPath: {stats_text[:100] if stats_text else 'None'}...")
-                    except:
-                        logger.error("Could not find stats textarea by any method")
+                    failures[stage] += 1
+                    if failures[stage] > REPORT_STAGE_RETRIES:
+                        logger.error(f"Stage '{stage}' failed {failures[stage]} times for collection {collection_id}: {e}")
                         return None
-            except Exception as e:
-                logger.error(f"Error getting stats: {e}")
-                import traceback
-                logger.error(traceback.format_exc())
-                return None
-            
-            # 5. Статистика собрана, сразу закрываем браузер
-            logger.info("Stats collected, closing browser...")
-            self.close()
-            
-            # 6. Формируем ссылку на коллекцию из ID (ID уже есть, браузер не нужен)
-            collection_link = f"https://admin.dresscode.ai/collection/{collection_id}"
-            logger.info(f"Generated collection link: {collection_link}")
-            
-            # 7. Парсим статистику из текста
-            report_data = {
-                'collection_id': collection_id,
-                'collection_url': collection_link,
-                'stats_text': stats_text,
-                'total_done': None,
-                'combo_items': None,
-                'total_done_items': None,
-            }
-            
-            if stats_text:
-                # Парсим данные из текста статистики
-                try:
-                    import re
-                    
-                    # Паттерн 1: "X total done items" (например, "423 total done items")
-                    total_done_match = re.search(r'(\d+)\s+total\s+done\s+items?', stats_text, re.IGNORECASE)
-                    if total_done_match:
-                        report_data['total_done'] = int(total_done_match.group(1))
-                    
-                    # Паттерн 2: "X combinations done" (например, "316 combinations done")
-                    combo_match = re.search(r'(\d+)\s+combinations?\s+done', stats_text, re.IGNORECASE)
-                    if combo_match:
-                        report_data['combo_items'] = int(combo_match.group(1))
-                    
-                    # Паттерн 3: "X total done" (без слова items)
-                    if not report_data['total_done']:
-                        total_done_match2 = re.search(r'(\d+)\s+total\s+done(?!\s+items)', stats_text, re.IGNORECASE)
-                        if total_done_match2:
-                            report_data['total_done'] = int(total_done_match2.group(1))
-                    
-                    # Паттерн 4: "Общее количество уникальных done-айтемов - X" или "– X"
-                    if not report_data['total_done']:
-                        total_done_pattern = re.search(r'Общее\s+количество\s+уникальных\s+done-айтемов\s*[–-]\s*(\d+)', stats_text, re.IGNORECASE)
-                        if total_done_pattern:
-                            report_data['total_done'] = int(total_done_pattern.group(1))
-                    
-                    # Паттерн 5: "Из них combo-айтемов – X"
-                    if not report_data['combo_items']:
-                        combo_pattern = re.search(r'Из\s+них\s+combo-айтемов\s*[–-]\s*(\d+)', stats_text, re.IGNORECASE)
-                        if combo_pattern:
-                            report_data['combo_items'] = int(combo_pattern.group(1))
-                    
-                    # Паттерн 6: "Итого total done - X айтемов" (если есть, используем, но обычно считаем сами)
-                    total_match = re.search(r'Итого\s+total\s+done\s*[-–]\s*(\d+)', stats_text, re.IGNORECASE)
-                    if total_match:
-                        report_data['total_done_items'] = int(total_match.group(1))
-                    
-                    # Если не нашли total_done_items, рассчитываем: total_done + combo_items
-                    if report_data['total_done'] and report_data['combo_items']:
-                        report_data['total_done_items'] = report_data['total_done'] + report_data['combo_items']
                     
-                except Exception as e:
-                    logger.warning(f"Error parsing stats: {e}")
+                    # Откатываемся к этапу, от которого зависит упавший, но не дальше последнего checkpoint
+                    rewind_to = getattr(e, 'rewind_to', None) or stage
+                    stage_index = min(stage_index, REPORT_STAGES.index(rewind_to))
+                    logger.warning(f"Stage '{stage}' failed ({failures[stage]}/{REPORT_STAGE_RETRIES} retries): {e}. "
+                                   f"Resuming from '{REPORT_STAGES[stage_index]}'")
+                    continue
+                
+                self.checkpoint = stage
+                stage_index += 1
             
-            logger.info(f"Report collected successfully. Stats: {stats_text[:100] if stats_text else 'None'}, Link: {collection_link}")
+            stats_text = state.get('stats_text')
+            report_data = self._parse_stats(collection_id, stats_text)
+            
+            logger.info(f"Report collected successfully. Stats: {stats_text[:100] if stats_text else 'None'}, Link: {report_data['collection_url']}")
             return report_data
             
         except Exception as e:
@@ -1319,6 +1450,10 @@ class SeleniumCollector:
     def close(self):
         """Закрытие браузера и всех связанных процессов"""
         if self.driver:
+            # Запоминаем дерево процессов до quit(): после выхода chromedriver
+            # его дочерние процессы Chrome переходят к init и их уже не найти по родителю
+            browser_pids = get_process_tree(self.browser_pid) if self.browser_pid else []
+            
             try:
                 # Закрываем все окна браузера
                 try:
@@ -1332,72 +1467,20 @@ class SeleniumCollector:
                 except:
                     pass
                 
-                self.driver = None  # Помечаем как закрытый
                 logger.info("Browser closed")
-                
-                # Дополнительно: принудительно убиваем процессы Chrome
-                # Это важно, так как иногда driver.quit() не убивает все процессы
-                try:
-                    import subprocess
-                    import time
-                    time.sleep(1)  # Даем время на закрытие
-                    
-                    # Убиваем процессы Chrome более агрессивно
-                    # Пробуем разные способы для надежности
-                    try:
-                        # Способ 1: pkill по имени процесса
-                        subprocess.run(['pkill', '-9', '-f', 'chrome'], 
-                                     capture_output=True, 
-                                     timeout=3,
-                                     check=False)
-                    except:
-                        pass
-                    
-                    try:
-                        # Способ 2: killall (если доступен)
-                        subprocess.run(['killall', '-9', 'chrome'], 
-                                     capture_output=True, 
-                                     timeout=3,
-                                     check=False)
-                    except:
-                        pass
-                    
-                    try:
-                        # Способ 3: через ps и kill
-                        result = subprocess.run(['ps', 'aux'], 
-                                              capture_output=True, 
-                                              text=True,
-                                              timeout=3)
-                        if result.returncode == 0:
-                            for line in result.stdout.split('\n'):
-                                if 'chrome' in line.lower() and 'grep' not in line.lower():
-                                    parts = line.split()
-                                    if len(parts) > 1:
-                                        pid = parts[1]
-                                        try:
-                                            subprocess.run(['kill', '-9', pid], 
-                                                         capture_output=True, 
-                                                         timeout=2,
-                                                         check=False)
-                                        except:
-                                            pass
-                    except:
-                        pass
-                        
-                except Exception as e:
-                    logger.debug(f"Could not kill Chrome processes: {e}")
-                    
             except Exception as e:
                 # Браузер уже может быть закрыт
                 logger.debug(f"Browser already closed or error closing: {e}")
-                self.driver = None
-                # Пробуем принудительно убить процессы Chrome
-                try:
-                    import subprocess
-                    subprocess.run(['pkill', '-9', '-f', 'chrome'], 
-                                 capture_output=True, 
-                                 timeout=3,
-                                 check=False)
-                except:
-                    pass
-
+            finally:
+                self.driver = None  # Помечаем как закрытый
+                self.network = None
+                self.checkpoint = None
+                self.logged_in = False
+                self.browser_pid = None
+            
+            # Дополнительно: принудительно убиваем оставшиеся процессы ЭТОГО браузера.
+            # Иногда driver.quit() не убивает все процессы, а pkill по имени
+            # задел бы браузеры других коллекторов
+            if browser_pids:
+                time.sleep(1)  # Даем время на закрытие
+                kill_processes(browser_pids)
@@ -0,0 +1,189 @@
+import os
+import copy
+import json
+import logging
+import tempfile
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Поля состояния трекера помимо кэша коллекций (watermark, время сверки, засеянные клиенты)
+META_KEYS = ('watermark', 'last_full_sync', 'tenants')
+
+
+def write_json_atomic(path: Path, data: Dict):
+    """
+    Записывает JSON атомарно: во временный файл рядом, fsync, затем rename поверх
+
+    После сбоя на диске остается либо старая, либо новая версия файла целиком.
+    """
+    path = Path(path)
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{path.name}.", suffix='.tmp', dir=str(path.parent))
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+    _fsync_dir(path.parent)
+
+
+def _fsync_dir(directory: Path):
+    """Сохраняет на диск запись каталога (rename / создание файла); на Windows недоступно"""
+    try:
+        fd = os.open(str(directory), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class StatusStore:
+    """
+    Хранилище кэша статусов: снимок (collections_status.json) и журнал изменений
+
+    Каждая проверка дописывает в журнал одну строку JSON только с тем, что
+    изменилось (новые/измененные и удаленные коллекции, watermark), и временем
+    проверки last_checked - одним значением на проверку. Проверка без изменений
+    дописывает только время и не делает fsync. После compact_every записей журнал
+    сворачивается: снимок перезаписывается атомарно (fsync + rename), журнал
+    очищается. Записи журнала задают итоговые значения, поэтому их повторное
+    применение поверх нового снимка (сбой между записью снимка и очисткой
+    журнала) дает то же состояние; оборванная последняя строка отбрасывается.
+    """
+
+    def __init__(self, path: Path, journal_path: Optional[Path] = None, compact_every: int = 500):
+        """
+        Args:
+            path: Файл снимка (collections_status.json)
+            journal_path: Файл журнала (по умолчанию рядом со снимком, расширение .journal)
+            compact_every: После скольких записей журнала сворачивать его в снимок
+        """
+        self.path = Path(path)
+        self.journal_path = Path(journal_path) if journal_path else self.path.with_suffix('.journal')
+        self.compact_every = max(1, compact_every)
+        self.collections: Dict[str, Dict] = {}
+        self.meta: Dict = {}
+        self.last_checked: Optional[str] = None
+        self._records = 0
+        # Последняя строка журнала оборвана, а файл загружен только для чтения:
+        # перед следующей записью журнал нужно свернуть
+        self._torn = False
+
+    def load(self, read_only: bool = False) -> Tuple[Dict[str, Dict], Dict]:
+        """
+        Загружает снимок и применяет журнал
+
+        Args:
+            read_only: Не исправлять файлы. Ведомый экземпляр бота загружает их только
+                для чтения: "оборванная" строка может быть записью, которую ведущий
+                дописывает прямо сейчас
+
+        Returns:
+            (копия кэша коллекций, копия полей META_KEYS, которые есть в файлах)
+        """
+        self.collections, self.meta, self.last_checked, self._records = {}, {}, None, 0
+        self._torn = False
+        if self.path.exists():
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.collections = data.get('collections', {})
+            self.meta = {key: data[key] for key in META_KEYS if key in data}
+            self.last_checked = data.get('last_checked')
+
+        torn = False
+        if self.journal_path.exists():
+            with open(self.journal_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if not line.endswith('\n'):
+                        torn = True
+                        break
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        torn = True
+                        break
+                    self._apply(record)
+                    self._records += 1
+
+        if torn and read_only:
+            logger.info(f"Skipping incomplete record at the end of {self.journal_path} (read-only load)")
+            self._torn = True
+        elif torn:
+            # Последняя запись оборвана сбоем: дописывать после нее нельзя - сворачиваем журнал
+            logger.warning(f"Discarding torn record at the end of {self.journal_path}")
+            self.compact()
+        logger.info(f"Loaded {len(self.collections)} cached collection statuses "
+                    f"({self._records} journal records)")
+        return copy.deepcopy(self.collections), copy.deepcopy(self.meta)
+
+    def _apply(self, record: Dict):
+        for collection_id, entry in record.get('set', {}).items():
+            self.collections[collection_id] = entry
+        for collection_id in record.get('del', []):
+            self.collections.pop(collection_id, None)
+        if 'meta' in record:
+            self.meta = record['meta']
+        if 'checked_at' in record:
+            self.last_checked = record['checked_at']
+
+    def commit(self, changes: Dict[str, Optional[Dict]], meta: Dict, checked_at: str):
+        """
+        Записывает результат одной проверки
+
+        Args:
+            changes: Измененные коллекции: ID -> запись кэша (None - коллекция удалена)
+            meta: Текущие значения полей META_KEYS
+            checked_at: Время проверки (хранится одно на проверку, а не в каждой записи)
+        """
+        record = {'checked_at': checked_at}
+        upserts = {cid: entry for cid, entry in changes.items() if entry is not None}
+        deletes = [cid for cid, entry in changes.items() if entry is None and cid in self.collections]
+        if upserts:
+            record['set'] = upserts
+        if deletes:
+            record['del'] = deletes
+        if meta != self.meta:
+            record['meta'] = copy.deepcopy(meta)
+        durable = len(record) > 1
+        self._apply(copy.deepcopy(record))
+
+        if self._torn or self._records + 1 >= self.compact_every:
+            self.compact()
+            return
+
+        created = not self.journal_path.exists()
+        with open(self.journal_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+            f.flush()
+            # Время проверки без изменений можно потерять при сбое - fsync только для изменений
+            if durable:
+                os.fsync(f.fileno())
+        if created:
+            _fsync_dir(self.journal_path.parent)
+        self._records += 1
+
+    def compact(self):
+        """Сворачивает журнал в снимок (атомарно) и очищает журнал"""
+        write_json_atomic(self.path, {
+            'collections': self.collections,
+            **self.meta,
+            'last_checked': self.last_checked,
+        })
+        with open(self.journal_path, 'w', encoding='utf-8') as f:
+            f.flush()
+            os.fsync(f.fileno())
+        self._records = 0
+        self._torn = False
+        logger.info(f"Compacted status journal into {self.path.name} ({len(self.collections)} collections)")
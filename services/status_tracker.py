@@ -1,110 +1,285 @@
-import json
 import logging
-from typing import Dict, List, Optional
+from typing import Callable, Dict, List, Optional, Tuple
 from pathlib import Path
-from datetime import datetime
-from config.settings import COLLECTIONS_STATUS_FILE, BIGQUERY_PROJECT_ID, GOOGLE_APPLICATION_CREDENTIALS_JSON
-from services.bq_client import BigQueryClient
+from datetime import datetime, timedelta, timezone
+from config.settings import (
+    COLLECTIONS_STATUS_FILE, STATUS_JOURNAL_FILE, STATUS_JOURNAL_COMPACT_EVERY,
+    STATUS_FULL_RECONCILE_INTERVAL, STATUS_WATERMARK_OVERLAP
+)
+from services.bq_client import BigQueryClient, get_bq_client
+from services.bq_transport import BigQueryError, BigQueryUnavailableError
+from services.tenants import TenantRule, load_tenants, match_tenant
+from services.status_store import StatusStore
 
 logger = logging.getLogger(__name__)
 
+def parse_timestamp(value) -> Optional[datetime]:
+    """
+    Преобразует строку времени (str(datetime) из BigQuery или isoformat) в datetime с таймзоной
+    
+    Returns:
+        datetime в UTC или None, если значение пустое или не распознано
+    """
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        parsed = value
+    else:
+        try:
+            parsed = datetime.fromisoformat(str(value))
+        except ValueError:
+            return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
 class StatusTracker:
     """Класс для отслеживания изменений статусов коллекций"""
     
-    def __init__(self):
-        """Инициализация трекера"""
-        self.bq_client = BigQueryClient(GOOGLE_APPLICATION_CREDENTIALS_JSON, BIGQUERY_PROJECT_ID)
+    def __init__(self, bq_client: Optional[BigQueryClient] = None, mirror=None,
+                 tenants: Optional[List[TenantRule]] = None):
+        """
+        Инициализация трекера
+        
+        Args:
+            bq_client: Клиент BigQuery (по умолчанию общий для процесса)
+            mirror: Локальная копия таблицы коллекций (CollectionsMirror); пока она свежая,
+                статусы читаются из нее, иначе из BigQuery
+            tenants: Правила клиентов (по умолчанию из data/tenants.json); все правила
+                проверяются по результату одного запроса за проверку
+        """
+        self.bq_client = bq_client or get_bq_client()
+        self.mirror = mirror
+        self.tenants = tenants or load_tenants()
         self.status_file = Path(COLLECTIONS_STATUS_FILE)
-        self._load_cached_statuses()
+        # Снимок кэша + журнал изменений: каждая проверка дописывает только изменения
+        self.store = StatusStore(self.status_file, STATUS_JOURNAL_FILE, STATUS_JOURNAL_COMPACT_EVERY)
+        # Экземпляр может оказаться ведомым - файлы исправляет только ведущий (см. reload)
+        self.reload(read_only=True)
+    
+    def reload(self, read_only: bool = False):
+        """
+        Перечитывает кэш статусов с диска
+        
+        Нужно, когда файлы мог менять другой экземпляр бота (после смены ведущего).
+        
+        Args:
+            read_only: Не исправлять файлы (экземпляр не держит аренду ведущего)
+        """
+        self._load_cached_statuses(read_only)
         # Флаг для отслеживания первой загрузки (чтобы не отправлять отчеты при перезапуске)
         self.is_first_run = len(self.cached_statuses) == 0
     
-    def _load_cached_statuses(self):
-        """Загружает кэшированные статусы из файла"""
+    def _load_cached_statuses(self, read_only: bool = False):
+        """Загружает кэшированные статусы и watermark (снимок + журнал)"""
+        self.watermark = None
+        self.last_full_sync = None
+        # Клиенты, коллекции которых уже закэшированы полной сверкой: пока клиент не
+        # засеян, его коллекции кэшируются без отправки отчетов (как при первом запуске)
+        self.seeded_tenants = set()
+        # Изменения кэша с последнего сохранения: ID -> запись (None - удалена)
+        self._dirty: Dict[str, Optional[Dict]] = {}
+        # Отпечаток последнего обработанного инкрементального опроса (см. check_status_changes)
+        self._last_poll: Optional[Tuple] = None
         try:
-            if self.status_file.exists():
-                with open(self.status_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    self.cached_statuses = data.get('collections', {})
-            else:
-                self.cached_statuses = {}
-            logger.info(f"Loaded {len(self.cached_statuses)} cached collection statuses")
+            self.cached_statuses, meta = self.store.load(read_only=read_only)
+            self.watermark = parse_timestamp(meta.get('watermark'))
+            self.last_full_sync = parse_timestamp(meta.get('last_full_sync'))
+            if 'tenants' in meta:
+                self.seeded_tenants = set(meta['tenants'])
+            elif self.cached_statuses:
+                # Файл из версии без клиентов: кэш уже заполнен по текущим правилам
+                self.seeded_tenants = {tenant.tenant_id for tenant in self.tenants}
         except Exception as e:
             logger.error(f"Error loading cached statuses: {e}")
             self.cached_statuses = {}
     
+    def _set_cached(self, collection_id: str, entry: Optional[Dict]):
+        """Меняет запись кэша и запоминает изменение для журнала (None - удалить)"""
+        if entry is None:
+            self.cached_statuses.pop(collection_id, None)
+        else:
+            self.cached_statuses[collection_id] = entry
+        self._dirty[collection_id] = entry
+    
     def _save_cached_statuses(self):
-        """Сохраняет статусы в файл"""
+        """Дописывает изменения проверки в журнал статусов (время проверки - одно на проверку)"""
         try:
-            data = {'collections': self.cached_statuses}
-            with open(self.status_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
+            meta = {
+                'watermark': self.watermark.isoformat() if self.watermark else None,
+                'last_full_sync': self.last_full_sync.isoformat() if self.last_full_sync else None,
+                'tenants': sorted(self.seeded_tenants),
+            }
+            self.store.commit(self._dirty, meta, datetime.now().isoformat())
+            self._dirty = {}
         except Exception as e:
             logger.error(f"Error saving cached statuses: {e}")
     
-    def check_status_changes(self) -> List[Dict]:
+    def _advance_watermark(self, collections: List[Dict]):
+        """Сдвигает watermark на максимальный COALESCE(updated_at, created_at) из полученных строк"""
+        for collection in collections:
+            changed_at = parse_timestamp(collection.get('updated_at') or collection.get('created_at'))
+            if changed_at and (self.watermark is None or changed_at > self.watermark):
+                self.watermark = changed_at
+    
+    def _is_full_sync_due(self, now: datetime) -> bool:
+        """Нужна ли полная сверка (первый запуск, новый клиент, нет watermark или истек интервал)"""
+        if self.is_first_run or self.watermark is None or self.last_full_sync is None:
+            return True
+        if any(tenant.tenant_id not in self.seeded_tenants for tenant in self.tenants):
+            return True
+        return (now - self.last_full_sync).total_seconds() >= STATUS_FULL_RECONCILE_INTERVAL
+    
+    def _source(self):
+        """Источник данных о коллекциях: свежая локальная копия или BigQuery"""
+        if self.mirror is not None and self.mirror.is_fresh():
+            return self.mirror
+        return self.bq_client
+    
+    def _apply_collection(self, collection: Dict, changed_collections: List[Dict]) -> bool:
+        """
+        Обновляет кэш по одной коллекции и фиксирует ее переход в статус клиента
+        
+        Returns:
+            True если кэш изменился
+        """
+        collection_id = collection['collection_id']
+        tenant = match_tenant(self.tenants, collection)
+        
+        if tenant is None:
+            # Коллекция не подходит ни под одно правило - убираем из кэша
+            if collection_id in self.cached_statuses:
+                self._set_cached(collection_id, None)
+                logger.debug(f"Removed collection {collection_id} from cache (no tenant rule matches)")
+                return True
+            return False
+        
+        # Проверяем, был ли изменен статус на статус клиента
+        cached = self.cached_statuses.get(collection_id, {})
+        cached_status_normalized = (cached.get('status', '') or '').strip().lower()
+        
+        # Если это первый запуск (или новый клиент), просто обновляем кэш без отправки отчетов
+        if self.is_first_run or tenant.tenant_id not in self.seeded_tenants:
+            logger.info(f"Seeding tenant {tenant.tenant_id}: caching collection {collection_id} "
+                        f"({collection.get('collection_name', '')}) with status '{tenant.status}'")
+        elif cached_status_normalized != tenant.status.strip().lower():
+            # Статус изменился (и клиент уже засеян)
+            changed_collections.append({**collection, 'status': tenant.status, 'tenant_id': tenant.tenant_id})
+            logger.info(f"Collection {collection_id} ({collection.get('collection_name', '')}) "
+                        f"status changed to '{tenant.status}' (tenant {tenant.tenant_id})")
+        
+        # В кэше храним только коллекции, подходящие под правила клиентов
+        # (время проверки хранится одно на проверку, а не в каждой записи)
+        entry = {
+            'status': tenant.status,
+            'collection_name': collection.get('collection_name', ''),
+            'tenant_id': tenant.tenant_id,
+        }
+        is_changed = any(cached.get(key) != entry[key] for key in entry)
+        if is_changed:
+            self._set_cached(collection_id, entry)
+        return is_changed
+    
+    def check_status_changes(self, on_changes: Optional[Callable[[List[Dict]], object]] = None) -> List[Dict]:
         """
         Проверяет изменения статусов коллекций
         
+        Обычно запрашиваются только строки компаний клиентов, измененные после
+        сохраненного watermark (с небольшим перекрытием на запаздывающие записи).
+        Периодически выполняется полная сверка, которая замечает удаленные коллекции.
+        В обоих случаях все правила клиентов проверяются по результату одного запроса.
+        
+        Перед инкрементальным опросом запрашивается отпечаток набора строк (одна
+        строка результата). Если он совпал с отпечатком прошлого опроса с тем же
+        окном, ничего не изменилось: строки не выгружаются и не обрабатываются.
+        
+        Если запрос к BigQuery не удался, кэш статусов и watermark не меняются:
+        иначе пустой ответ приняли бы за исчезновение всех коллекций, а на
+        следующей проверке все они снова "перешли" бы в 'tsum cs'.
+        
+        Args:
+            on_changes: Вызывается с найденными изменениями ДО сохранения кэша
+                (например, запись в очередь отчетов). Если он упал, кэш возвращается
+                к сохраненному состоянию, и те же изменения найдутся на следующей
+                проверке - переход не теряется между обнаружением и отправкой.
+        
         Returns:
-            Список коллекций, у которых статус изменился на 'tsum cs'
+            Список коллекций, у которых статус изменился на статус клиента
+            (с ключами 'status' - статус клиента и 'tenant_id')
         """
         try:
-            # Получаем ТОЛЬКО коллекции со статусом 'tsum cs' из BigQuery
-            collections = self.bq_client.get_collections_with_status('tsum cs')
-            
+            now = datetime.now(timezone.utc)
             changed_collections = []
+            source = self._source()
             
-            # Получаем список ID коллекций со статусом 'tsum cs' для очистки кэша
-            tsum_cs_collection_ids = {col['collection_id'] for col in collections}
-            
-            for collection in collections:
-                collection_id = collection['collection_id']
-                current_status = collection.get('status', '') or ''
+            full_sync = self._is_full_sync_due(now)
+            if full_sync:
+                # Полная сверка: ТОЛЬКО коллекции, подходящие под правила клиентов (один запрос)
+                collections = source.get_collections_for_tenants(self.tenants)
                 
-                # Проверяем, был ли изменен статус на 'tsum cs'
-                cached_status = self.cached_statuses.get(collection_id, {}).get('status', '') or ''
+                matched_ids = set()
+                for collection in collections:
+                    self._apply_collection(collection, changed_collections)
+                    if collection['collection_id'] in self.cached_statuses:
+                        matched_ids.add(collection['collection_id'])
                 
-                # Нормализуем статусы для сравнения
-                current_status_normalized = current_status.strip().lower()
-                cached_status_normalized = cached_status.strip().lower()
+                # Удаляем из кэша коллекции, которые больше не подходят под правила
+                # (в том числе удаленные из таблицы)
+                for collection_id in [cid for cid in self.cached_statuses if cid not in matched_ids]:
+                    self._set_cached(collection_id, None)
+                    logger.debug(f"Removed collection {collection_id} from cache (no tenant rule matches)")
                 
-                # Если это первый запуск (кэш был пустой), просто обновляем кэш без отправки отчетов
-                if self.is_first_run:
-                    logger.info(f"First run: caching collection {collection_id} ({collection.get('collection_name', '')}) with status 'tsum cs'")
-                elif current_status_normalized == 'tsum cs' and cached_status_normalized != 'tsum cs':
-                    # Статус изменился на 'tsum cs' (и это не первый запуск)
-                    changed_collections.append(collection)
-                    logger.info(f"Collection {collection_id} ({collection.get('collection_name', '')}) status changed to 'tsum cs'")
+                self._advance_watermark(collections)
+                self.last_full_sync = now
+                self.seeded_tenants = {tenant.tenant_id for tenant in self.tenants}
+                logger.info(f"Full status reconciliation done, {len(self.cached_statuses)} collections cached")
+            else:
+                # Инкрементальный опрос: только строки, измененные после watermark
+                since = self.watermark - timedelta(seconds=STATUS_WATERMARK_OVERLAP)
+                company_ids = sorted({tenant.company_id for tenant in self.tenants})
+                
+                # Отпечаток берется до выгрузки строк: если строки изменятся между
+                # запросами, отпечаток следующего опроса не совпадет и они будут обработаны
+                poll = (type(source).__name__, since, tuple(company_ids),
+                        source.get_collections_fingerprint(since, company_ids))
+                if poll == self._last_poll:
+                    logger.debug(f"No collection changes since {since.isoformat()} (fingerprint unchanged)")
+                    self._save_cached_statuses()
+                    return []
                 
-                # Обновляем кэш ТОЛЬКО для коллекций со статусом 'tsum cs'
-                self.cached_statuses[collection_id] = {
-                    'status': current_status,
-                    'collection_name': collection.get('collection_name', ''),
-                    'last_checked': datetime.now().isoformat()
-                }
+                collections = source.get_collections_changed_since(since, company_ids)
+                for collection in collections:
+                    self._apply_collection(collection, changed_collections)
+                self._advance_watermark(collections)
             
             # После первой проверки сбрасываем флаг
             if self.is_first_run:
                 self.is_first_run = False
                 logger.info("First run completed, cache initialized. Future status changes will trigger reports.")
             
-            # Удаляем из кэша коллекции, которые больше не имеют статус 'tsum cs'
-            # (чтобы не накапливались коллекции без статуса)
-            collections_to_remove = []
-            for collection_id in self.cached_statuses.keys():
-                if collection_id not in tsum_cs_collection_ids:
-                    collections_to_remove.append(collection_id)
-            
-            for collection_id in collections_to_remove:
-                del self.cached_statuses[collection_id]
-                logger.debug(f"Removed collection {collection_id} from cache (no longer 'tsum cs')")
+            if changed_collections and on_changes is not None:
+                try:
+                    on_changes(changed_collections)
+                except Exception as e:
+                    logger.error(f"Failed to record {len(changed_collections)} status changes, "
+                                 f"they will be detected again: {e}")
+                    self._load_cached_statuses()
+                    return []
             
-            # Сохраняем обновленные статусы
+            # Сохраняем результат проверки: в журнал дописываются только изменения
+            # (без изменений - одно время проверки)
             self._save_cached_statuses()
+            # Полная сверка отпечаток не запоминает: следующий опрос обработает окно заново
+            self._last_poll = None if full_sync else poll
             
             return changed_collections
             
+        except BigQueryUnavailableError as e:
+            logger.warning(f"Skipping status check: {e}")
+            return []
+        except BigQueryError as e:
+            logger.error(f"Error checking status changes, cached statuses kept: {e}")
+            return []
         except Exception as e:
             logger.error(f"Error checking status changes: {e}")
             return []
@@ -0,0 +1,82 @@
+import json
+import logging
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class TenantRule(NamedTuple):
+    """
+    Правило отслеживания коллекций одного клиента
+
+    Коллекция компании company_id, в названии которой есть name_pattern (с учетом
+    регистра, как LIKE в BigQuery), считается перешедшей в статус status; отчет
+    по ней отправляется в беседы chats (None - во все активные беседы).
+    """
+    tenant_id: str
+    company_id: str
+    name_pattern: str
+    status: str
+    chats: Optional[Tuple[str, ...]] = None
+
+    def matches(self, collection: Dict) -> bool:
+        return (collection.get('company_id') == self.company_id
+                and self.name_pattern in (collection.get('collection_name') or ''))
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'TenantRule':
+        chats = data.get('chats')
+        return cls(
+            tenant_id=str(data.get('tenant_id') or data['company_id']),
+            company_id=str(data['company_id']),
+            name_pattern=str(data['name_pattern']),
+            status=str(data.get('status') or 'tsum cs'),
+            chats=tuple(str(chat_id) for chat_id in chats) if chats else None,
+        )
+
+
+# Правило по умолчанию - поведение бота до появления tenants.json
+DEFAULT_TENANTS = [
+    TenantRule(tenant_id='tsum_cs', company_id='tsum_cs', name_pattern='TSUM Collection Panel', status='tsum cs'),
+]
+
+
+def load_tenants() -> List[TenantRule]:
+    """
+    Загружает правила клиентов из data/tenants.json
+
+    Формат: {"tenants": [{"tenant_id": ..., "company_id": ..., "name_pattern": ...,
+    "status": ..., "chats": ["-100..."]}]}. Если файла нет или он некорректен,
+    используется правило по умолчанию (tsum_cs).
+    """
+    from config.settings import TENANTS_FILE
+
+    try:
+        tenants_file = Path(TENANTS_FILE)
+        if not tenants_file.exists():
+            return list(DEFAULT_TENANTS)
+
+        with open(tenants_file, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        tenants = [TenantRule.from_dict(item) for item in data.get('tenants', [])]
+        if not tenants:
+            logger.warning(f"No tenants in {tenants_file}, using default tsum_cs rule")
+            return list(DEFAULT_TENANTS)
+
+        ids = [tenant.tenant_id for tenant in tenants]
+        if len(set(ids)) != len(ids):
+            raise ValueError(f"Duplicate tenant_id in {tenants_file}")
+        logger.info(f"Loaded {len(tenants)} tenant rules: {', '.join(ids)}")
+        return tenants
+    except Exception as e:
+        logger.error(f"Error loading tenants, using default tsum_cs rule: {e}")
+        return list(DEFAULT_TENANTS)
+
+
+def match_tenant(tenants: List[TenantRule], collection: Dict) -> Optional[TenantRule]:
+    """Первое правило, под которое подходит коллекция (порядок - как в tenants.json)"""
+    for tenant in tenants:
+        if tenant.matches(collection):
+            return tenant
+    return None
@@ -0,0 +1,226 @@
+import json
+import time
+import logging
+import threading
+import urllib.request
+from typing import List, Optional
+from services.resource_governor import SharedBrowserSlots
+
+logger = logging.getLogger(__name__)
+
+# Локальный Chrome под Xvfb контейнера (через ChromeDriverManager / системный chromedriver)
+LOCAL_ENDPOINT = 'local'
+
+
+class WebDriverEndpoint:
+    """Точка подключения WebDriver: локальный Chrome или удаленный chromedriver / Selenium standalone"""
+
+    def __init__(self, url: str, max_sessions: int = 1):
+        """
+        Args:
+            url: 'local' или адрес WebDriver (например, http://127.0.0.1:9515 или http://host:4444/wd/hub)
+            max_sessions: Сколько браузеров можно одновременно запускать на этой точке
+        """
+        self.url = url.rstrip('/') if url != LOCAL_ENDPOINT else url
+        self.max_sessions = max(1, max_sessions)
+        self.active = 0
+        # Занятые сессии, о которых сообщил сам сервер (Selenium Grid / standalone /status)
+        self.remote_busy = 0
+        self.healthy = True
+        self.last_check = 0.0
+        # Номер точки в счетчиках SharedBrowserSlots (задает WebDriverEndpointPool)
+        self.index = 0
+
+    @property
+    def is_local(self) -> bool:
+        return self.url == LOCAL_ENDPOINT
+
+    @property
+    def load(self) -> float:
+        """Загрузка точки: доля занятых слотов"""
+        return (max(self.active, self.remote_busy)) / self.max_sessions
+
+    def __repr__(self):
+        return f"WebDriverEndpoint({self.url}, {self.active}/{self.max_sessions}, healthy={self.healthy})"
+
+
+def parse_endpoints(spec: str) -> List[WebDriverEndpoint]:
+    """
+    Разбирает список точек WebDriver из строки настроек
+
+    Формат: элементы через запятую, у каждого необязательный суффикс *N (максимум сессий),
+    например: "local*2,http://127.0.0.1:9515,http://10.0.0.5:4444/wd/hub*4"
+    """
+    endpoints = []
+    for item in (spec or '').split(','):
+        item = item.strip()
+        if not item:
+            continue
+        max_sessions = 1
+        if '*' in item:
+            item, _, count = item.rpartition('*')
+            try:
+                max_sessions = int(count)
+            except ValueError:
+                logger.warning(f"Invalid session count in WebDriver endpoint '{item}*{count}', using 1")
+        endpoints.append(WebDriverEndpoint(item.strip(), max_sessions))
+    return endpoints or [WebDriverEndpoint(LOCAL_ENDPOINT)]
+
+
+class WebDriverEndpointPool:
+    """
+    Пул точек WebDriver с проверкой доступности и выбором наименее загруженной
+
+    Удаленные точки проверяются запросом GET /status, который поддерживают и chromedriver,
+    и Selenium standalone/Grid. Для Grid из ответа берется число занятых слотов.
+    Точка выбирается для каждого нового браузера; занятые сессии считаются по всем
+    процессам-воркерам (SharedBrowserSlots), поэтому лимиты *N действуют на весь бот.
+    """
+
+    def __init__(self, endpoints: List[WebDriverEndpoint], health_check_interval: float = 30.0,
+                 health_check_timeout: float = 3.0, slots: Optional[SharedBrowserSlots] = None,
+                 slot_index: int = 0):
+        """
+        Args:
+            endpoints: Список точек
+            health_check_interval: Как часто перепроверять точку (в секундах)
+            health_check_timeout: Таймаут запроса /status (в секундах)
+            slots: Общий учет сессий процессов-воркеров (None - учет только в этом процессе);
+                точек в нем должно быть не меньше endpoint_slot_count(endpoints)
+            slot_index: Номер воркера в slots
+        """
+        self.endpoints = endpoints
+        self.health_check_interval = health_check_interval
+        self.health_check_timeout = health_check_timeout
+        # Запасной локальный Chrome, когда все удаленные точки недоступны (одна запись на пул)
+        self.fallback = next((e for e in endpoints if e.is_local), None) or WebDriverEndpoint(LOCAL_ENDPOINT)
+        self._all = endpoints if self.fallback in endpoints else endpoints + [self.fallback]
+        for index, endpoint in enumerate(self._all):
+            endpoint.index = index
+        if slots is not None and slots.endpoints < len(self._all):
+            logger.error(f"Shared browser slots cover {slots.endpoints} WebDriver endpoints, "
+                         f"{len(self._all)} configured - counting sessions in this process only")
+            slots = None
+        self.slots = slots or SharedBrowserSlots(1, len(self._all))
+        self.slot_index = slot_index if slots is not None else 0
+        self._lock = threading.Lock()
+
+    def check_health(self, endpoint: WebDriverEndpoint) -> bool:
+        """Проверяет доступность точки и обновляет ее состояние"""
+        endpoint.last_check = time.monotonic()
+
+        if endpoint.is_local:
+            endpoint.healthy = True
+            return True
+
+        try:
+            with urllib.request.urlopen(f"{endpoint.url}/status", timeout=self.health_check_timeout) as response:
+                payload = json.loads(response.read().decode('utf-8'))
+            value = payload.get('value', {}) or {}
+            ready = value.get('ready', True)
+
+            # Selenium Grid / standalone сообщает слоты узлов - берем реальную загрузку
+            busy = 0
+            slots = 0
+            for node in value.get('nodes', []) or []:
+                for slot in node.get('slots', []) or []:
+                    slots += 1
+                    if slot.get('session'):
+                        busy += 1
+            endpoint.remote_busy = busy
+            if slots:
+                endpoint.max_sessions = slots
+                # Grid сообщает ready=False, когда все слоты заняты, - точка при этом жива
+                ready = True
+
+            if not endpoint.healthy and ready:
+                logger.info(f"WebDriver endpoint {endpoint.url} is healthy again")
+            endpoint.healthy = bool(ready)
+        except Exception as e:
+            if endpoint.healthy:
+                logger.warning(f"WebDriver endpoint {endpoint.url} health check failed: {e}")
+            endpoint.healthy = False
+
+        return endpoint.healthy
+
+    def _refresh(self):
+        """Перепроверяет точки, у которых истек интервал проверки"""
+        now = time.monotonic()
+        for endpoint in self.endpoints:
+            if now - endpoint.last_check >= self.health_check_interval:
+                self.check_health(endpoint)
+
+    def acquire(self) -> WebDriverEndpoint:
+        """
+        Выбирает наименее загруженную доступную точку и занимает в ней слот
+
+        Returns:
+            Выбранная точка (если все удаленные недоступны - локальный Chrome)
+        """
+        with self._lock:
+            self._refresh()
+            healthy = [e for e in self.endpoints if e.healthy]
+            if not healthy:
+                logger.error("No healthy WebDriver endpoints, falling back to local Chrome")
+                healthy = [self.fallback]
+
+            with self.slots.lock:
+                for e in self._all:
+                    e.active = self.slots.endpoint_active(e.index)
+                endpoint = min(healthy, key=lambda e: e.load)
+                self.slots.endpoint_counts[self._slot(endpoint)] += 1
+                endpoint.active += 1
+            if endpoint.load > 1:
+                logger.warning(f"All WebDriver endpoints are at capacity, using least loaded {endpoint.url}")
+            logger.info(f"Selected WebDriver endpoint {endpoint.url} ({endpoint.active}/{endpoint.max_sessions})")
+            return endpoint
+
+    def _slot(self, endpoint: WebDriverEndpoint) -> int:
+        return self.slot_index * self.slots.endpoints + endpoint.index
+
+    def release(self, endpoint: WebDriverEndpoint, failed: bool = False):
+        """
+        Освобождает слот точки
+
+        Args:
+            endpoint: Точка, полученная из acquire()
+            failed: Точка отработала с ошибкой - перепроверить ее при следующем выборе
+        """
+        with self._lock:
+            with self.slots.lock:
+                slot = self._slot(endpoint)
+                self.slots.endpoint_counts[slot] = max(0, self.slots.endpoint_counts[slot] - 1)
+                endpoint.active = self.slots.endpoint_active(endpoint.index)
+            if failed and not endpoint.is_local:
+                endpoint.last_check = 0.0
+
+
+_endpoint_pool: Optional[WebDriverEndpointPool] = None
+_endpoint_pool_lock = threading.Lock()
+
+
+def endpoint_slot_count() -> int:
+    """Сколько точек учитывать в SharedBrowserSlots: точки из настроек и запасной локальный Chrome"""
+    from config.settings import WEBDRIVER_ENDPOINTS
+    return len(parse_endpoints(WEBDRIVER_ENDPOINTS)) + 1
+
+
+def get_endpoint_pool(slots: Optional[SharedBrowserSlots] = None, slot_index: int = 0) -> WebDriverEndpointPool:
+    """
+    Возвращает общий для процесса пул точек WebDriver
+
+    Args:
+        slots: Общий учет сессий процессов-воркеров (учитывается при первом вызове в процессе)
+        slot_index: Номер воркера в slots
+    """
+    global _endpoint_pool
+    with _endpoint_pool_lock:
+        if _endpoint_pool is None:
+            from config.settings import WEBDRIVER_ENDPOINTS, WEBDRIVER_HEALTH_CHECK_INTERVAL
+            _endpoint_pool = WebDriverEndpointPool(
+                parse_endpoints(WEBDRIVER_ENDPOINTS),
+                health_check_interval=WEBDRIVER_HEALTH_CHECK_INTERVAL,
+                slots=slots,
+                slot_index=slot_index,
+            )
+        return _endpoint_pool